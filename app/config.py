@@ -6,6 +6,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _parse_limits(raw: str) -> dict[str, int]:
+    """Parse ``"gmail=4,drive=8"`` style per-service limits."""
+    limits = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            limits[key.strip()] = int(value)
+    return limits
+
+
 class Settings:
     """Central configuration for the application."""
 
@@ -13,16 +23,107 @@ class Settings:
     GOOGLE_CLIENT_ID: str = os.getenv("GOOGLE_CLIENT_ID", "")
     GOOGLE_CLIENT_SECRET: str = os.getenv("GOOGLE_CLIENT_SECRET", "")
     GOOGLE_REDIRECT_URI: str = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/callback")
+    # Refresh the access token this many seconds before it expires
+    GOOGLE_TOKEN_REFRESH_MARGIN: int = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+    # How often (s) to check the stored credentials for a login/logout/refresh by another worker
+    GOOGLE_TOKEN_RELOAD_INTERVAL: float = float(os.getenv("GOOGLE_TOKEN_RELOAD_INTERVAL", "5"))
+    # Per-user credentials, encrypted with APP_SECRET_KEY; how many users to keep decrypted in memory
+    CREDENTIALS_PATH: str = os.getenv("CREDENTIALS_PATH", "")
+    CREDENTIAL_CACHE_SIZE: int = int(os.getenv("CREDENTIAL_CACHE_SIZE", "256"))
+    # Built API clients kept per worker thread (one per user and API)
+    GOOGLE_CLIENT_CACHE_SIZE: int = int(os.getenv("GOOGLE_CLIENT_CACHE_SIZE", "64"))
 
     # AI Model
     AI_API_KEY: str = os.getenv("AI_API_KEY", "")
     AI_BASE_URL: str = os.getenv("AI_BASE_URL", "https://openrouter.ai/api/v1")
     AI_MODEL: str = os.getenv("AI_MODEL", "deepseek/deepseek-r1")
+    # "native" (OpenAI tools/tool_calls), "prompt" (JSON in the reply text) or
+    # "auto" (native, falling back to prompt if the backend rejects tools)
+    AI_TOOL_MODE: str = os.getenv("AI_TOOL_MODE", "auto").lower()
+    # Ask streaming responses for token usage (stream_options.include_usage)
+    AI_STREAM_USAGE: bool = os.getenv("AI_STREAM_USAGE", "true").lower() == "true"
+
+    # AI HTTP client (one pooled keep-alive client for the whole app)
+    AI_HTTP2: bool = os.getenv("AI_HTTP2", "true").lower() == "true"
+    AI_MAX_CONNECTIONS: int = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+    AI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    AI_KEEPALIVE_EXPIRY: float = float(os.getenv("AI_KEEPALIVE_EXPIRY", "30"))
+    AI_CONNECT_TIMEOUT: float = float(os.getenv("AI_CONNECT_TIMEOUT", "10"))
+    AI_READ_TIMEOUT: float = float(os.getenv("AI_READ_TIMEOUT", "120"))
+
+    # Conversation history (older turns are summarised past the budget)
+    HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+    HISTORY_SUMMARY_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_TOKENS", "500"))
+    HISTORY_SUMMARY_MODEL: str = os.getenv("HISTORY_SUMMARY_MODEL", "")
 
     # App
     APP_SECRET_KEY: str = os.getenv("APP_SECRET_KEY", "change-me-in-production")
     APP_HOST: str = os.getenv("APP_HOST", "0.0.0.0")
     APP_PORT: int = int(os.getenv("APP_PORT", "8000"))
+    # Send the user cookie over HTTPS only (enable behind TLS)
+    APP_SECURE_COOKIES: bool = os.getenv("APP_SECURE_COOKIES", "false").lower() == "true"
+    # Worker processes; more than one disables auto-reload and needs shared state
+    APP_WORKERS: int = int(os.getenv("APP_WORKERS", "1"))
+    APP_RELOAD: bool = os.getenv("APP_RELOAD", "true").lower() == "true"
+    # Seconds in-flight turns get to finish on shutdown before they are cancelled
+    APP_GRACEFUL_TIMEOUT: float = float(os.getenv("APP_GRACEFUL_TIMEOUT", "30"))
+
+    # Conversation sessions: "memory" or "sqlite" (shared by workers, survives restarts)
+    SESSION_STORE: str = os.getenv("SESSION_STORE", "memory").lower()
+    SESSION_STORE_PATH: str = os.getenv("SESSION_STORE_PATH", "")
+    SESSION_MAX_BYTES: int = int(os.getenv("SESSION_MAX_BYTES", str(32 * 1024 * 1024)))
+    SESSION_TTL: float = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+    SESSION_FLUSH_INTERVAL: float = float(os.getenv("SESSION_FLUSH_INTERVAL", "2"))
+    # Seconds a worker's claim on a session outlives the worker (renewed while a turn runs)
+    SESSION_LEASE_TTL: float = float(os.getenv("SESSION_LEASE_TTL", "30"))
+
+    # Tool execution (Google API calls run on a worker thread pool)
+    TOOL_WORKERS: int = int(os.getenv("TOOL_WORKERS", "16"))
+    TOOL_SERVICE_CONCURRENCY: int = int(os.getenv("TOOL_SERVICE_CONCURRENCY", "4"))
+    TOOL_SERVICE_LIMITS: dict[str, int] = _parse_limits(os.getenv("TOOL_SERVICE_LIMITS", ""))
+
+    # Cache for read-only tool results (LRU bounded by size)
+    TOOL_CACHE_ENABLED: bool = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+    TOOL_CACHE_MAX_BYTES: int = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Drive listings: files per API page, hard cap on results, time budget (s)
+    DRIVE_LIST_PAGE_SIZE: int = int(os.getenv("DRIVE_LIST_PAGE_SIZE", "200"))
+    DRIVE_LIST_MAX_RESULTS: int = int(os.getenv("DRIVE_LIST_MAX_RESULTS", "500"))
+    DRIVE_LIST_TIME_BUDGET: float = float(os.getenv("DRIVE_LIST_TIME_BUDGET", "15"))
+
+    # Local Drive metadata index (SQLite, synced via the Changes API)
+    DRIVE_INDEX_ENABLED: bool = os.getenv("DRIVE_INDEX_ENABLED", "true").lower() == "true"
+    DRIVE_INDEX_PATH: str = os.getenv("DRIVE_INDEX_PATH", "")
+    DRIVE_INDEX_MAX_AGE: float = float(os.getenv("DRIVE_INDEX_MAX_AGE", "60"))
+    # Open index databases (one per user) kept per worker, for each index
+    INDEX_CACHE_SIZE: int = int(os.getenv("INDEX_CACHE_SIZE", "64"))
+
+    # Full-text index over Docs/Sheets/Slides contents (workspace_search); needs the Drive index
+    CONTENT_INDEX_ENABLED: bool = os.getenv("CONTENT_INDEX_ENABLED", "true").lower() == "true"
+    CONTENT_INDEX_PATH: str = os.getenv("CONTENT_INDEX_PATH", "")
+    CONTENT_INDEX_PASSAGE_CHARS: int = int(os.getenv("CONTENT_INDEX_PASSAGE_CHARS", "800"))
+    # Seconds a workspace_search may spend re-indexing changed files first
+    CONTENT_INDEX_REFRESH_BUDGET: float = float(os.getenv("CONTENT_INDEX_REFRESH_BUDGET", "10"))
+    # Optional local sentence-transformers model for hybrid (BM25 + vector) ranking
+    CONTENT_INDEX_EMBEDDINGS_MODEL: str = os.getenv("CONTENT_INDEX_EMBEDDINGS_MODEL", "")
+
+    # Sheets ranges kept as typed columns for sheets_query (seconds, entries)
+    SHEETS_TABLE_CACHE_TTL: float = float(os.getenv("SHEETS_TABLE_CACHE_TTL", "120"))
+    SHEETS_TABLE_CACHE_SIZE: int = int(os.getenv("SHEETS_TABLE_CACHE_SIZE", "16"))
+
+    # Drive downloads served by /api/drive (stored files relayed in ranged chunks, exports spooled to a temp file)
+    DRIVE_DOWNLOAD_CHUNK_SIZE: int = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+    DRIVE_DOWNLOAD_CONCURRENCY: int = int(os.getenv("DRIVE_DOWNLOAD_CONCURRENCY", "2"))
+    DRIVE_DOWNLOAD_SPOOL_MEMORY: int = int(os.getenv("DRIVE_DOWNLOAD_SPOOL_MEMORY", str(16 * 1024 * 1024)))
+
+    # Tracing: spans feed the /metrics histograms; TRACE_PATH (JSONL, relative to the project) keeps every span
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_PATH: str = os.getenv("TRACE_PATH", "")
+
+    # Tool results fed back to the LLM (larger ones are summarised + paged)
+    TOOL_RESULT_MAX_CHARS: int = int(os.getenv("TOOL_RESULT_MAX_CHARS", "6000"))
+    TOOL_RESULT_SAMPLE_ROWS: int = int(os.getenv("TOOL_RESULT_SAMPLE_ROWS", "10"))
+    TOOL_RESULT_STORE_SIZE: int = int(os.getenv("TOOL_RESULT_STORE_SIZE", "64"))
 
     # Google API Scopes
     GOOGLE_SCOPES: list[str] = [
@@ -1,23 +1,69 @@
 """Main FastAPI application entry point."""
 
+import logging
 import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
+
+from app.routers import auth, chat, drive
+from app.config import settings
+from app.services import (
+    content_index,
+    drive_index,
+    google_auth,
+    llm_client,
+    session_store,
+    tool_cache,
+    tool_executor,
+    tracing,
+    turns,
+    users,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start-up / shutdown hooks for app-scoped resources."""
+    google_auth.check_secret_key()
+    await llm_client.open_client()
+    # Another worker logged in or out: results cached here belong to the old account
+    google_auth.on_account_change(tool_cache.clear)
+    yield
+    # In-flight turns were drained by app.server.DrainingServer before connections closed
+    await llm_client.close_client()
+    tool_executor.shutdown()
+    session_store.close_store()
+    tracing.close()
 
-from app.routers import auth, chat
 
 # Create the FastAPI app
 app = FastAPI(
     title="BerrAI – Personal AI Agent",
     description="Google ekosistemi ile entegre kişisel AI asistanı",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+
+@app.middleware("http")
+async def identify_user(request: Request, call_next):
+    """Make the user of the signed cookie the current user for the request."""
+    token = users.set_current_user(users.from_cookie(request.cookies.get(users.COOKIE_NAME)))
+    try:
+        return await call_next(request)
+    finally:
+        users.reset_current_user(token)
+
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(chat.router)
+app.include_router(drive.router)
 
 # Serve static files
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
@@ -35,13 +81,43 @@ async def health():
     return {"status": "ok", "service": " BerrAI Assistant"}
 
 
+@app.get("/health/tools")
+async def tool_stats():
+    """Queue depth and latency counters of the tool worker pool, result cache and local indexes."""
+    return dict(
+        tool_executor.get_stats(),
+        cache=tool_cache.get_stats(),
+        drive_index=drive_index.get_stats(),
+        content_index=content_index.get_stats(),
+        credentials=google_auth.get_stats(),
+        sessions=session_store.get_store().get_stats(),
+        turns=turns.get_stats(),
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms and token counters in the Prometheus text format."""
+    return PlainTextResponse(tracing.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    import uvicorn
-    from app.config import settings
+    from app.server import serve
+
+    workers = max(settings.APP_WORKERS, 1)
+    if workers > 1 and settings.SESSION_STORE == "memory":
+        # Each worker would see only its own conversations; workers re-read the environment
+        logging.warning("APP_WORKERS=%d: using SESSION_STORE=sqlite so workers share sessions", workers)
+        os.environ["SESSION_STORE"] = "sqlite"
+    if workers > 1:
+        # Write every save through so the next message may land on any worker
+        os.environ["SESSION_FLUSH_INTERVAL"] = "0"
 
-    uvicorn.run(
+    serve(
         "app.main:app",
         host=settings.APP_HOST,
         port=settings.APP_PORT,
-        reload=True,
+        reload=settings.APP_RELOAD and workers == 1,
+        workers=workers,
+        timeout_graceful_shutdown=int(settings.APP_GRACEFUL_TIMEOUT) + 5,
     )
@@ -1,12 +1,69 @@
-"""Authentication routes – handles Google OAuth2 login/callback/logout."""
+"""Authentication routes – handles Google OAuth2 login/callback/logout.
+
+The browser is identified by a signed user cookie (see ``users``), issued
+when the login starts and confirmed by the callback; the Google credentials
+obtained in the callback are stored under that user. The OAuth ``state`` is
+kept in a signed, short-lived cookie and must come back unchanged, so a
+callback started by someone else's login cannot attach their account here.
+"""
+
+import hmac
+import time
 
 from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse, JSONResponse
 
+from app.config import settings
+from app.services import content_index, drive_index, tool_cache, tool_executor, users
 from app.services.google_auth import get_auth_url, exchange_code, is_authenticated, logout
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+STATE_COOKIE = "berrai_oauth_state"
+STATE_MAX_AGE = 600
+
+
+def _set_user_cookie(response, user_id: str):
+    response.set_cookie(
+        users.COOKIE_NAME,
+        users.sign(user_id),
+        max_age=users.COOKIE_MAX_AGE,
+        httponly=True,
+        samesite="lax",
+        secure=settings.APP_SECURE_COOKIES,
+    )
+
+
+def _valid_state(request: Request, state: str) -> bool:
+    """Whether ``state`` is the one issued by this browser's unexpired login."""
+    payload = users.from_cookie(request.cookies.get(STATE_COOKIE))
+    if not payload or ":" not in payload or not state:
+        return False
+    expected, expires = payload.rsplit(":", 1)
+    return expires.isdigit() and int(expires) >= time.time() and hmac.compare_digest(expected, state)
+
+
+def _forget_account_state(user_id: str):
+    """Drop the cached results and indexes built from the user's previous Google account."""
+    tool_cache.clear(user_id)
+    drive_index.reset()
+    content_index.reset()
+
+
+def _sign_in(code: str, user_id: str):
+    """Store the credentials for ``code`` under ``user_id`` (blocking)."""
+    token = users.set_current_user(user_id)
+    try:
+        if exchange_code(code, user_id):
+            _forget_account_state(user_id)
+    finally:
+        users.reset_current_user(token)
+
+
+def _sign_out(user_id: str):
+    logout()
+    _forget_account_state(user_id)
+
 
 @router.get("/status")
 async def auth_status():
@@ -17,16 +74,37 @@ async def auth_status():
 @router.get("/login")
 async def login():
     """Redirect user to Google OAuth2 consent page."""
-    url = get_auth_url()
-    return RedirectResponse(url=url)
+    url, state = get_auth_url()
+    response = RedirectResponse(url=url)
+    if users.current_user() is None:
+        _set_user_cookie(response, users.new_user_id())
+    response.set_cookie(
+        STATE_COOKIE,
+        users.sign(f"{state}:{int(time.time()) + STATE_MAX_AGE}"),
+        max_age=STATE_MAX_AGE,
+        httponly=True,
+        samesite="lax",
+        secure=settings.APP_SECURE_COOKIES,
+    )
+    return response
 
 
 @router.get("/callback")
-async def callback(code: str):
+async def callback(request: Request, code: str, state: str = ""):
     """Handle the OAuth2 callback and store credentials."""
+    if not _valid_state(request, state):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Authentication failed: geçersiz ya da süresi dolmuş oturum isteği, lütfen tekrar giriş yapın."},
+        )
+    user_id = users.from_cookie(request.cookies.get(users.COOKIE_NAME)) or users.new_user_id()
     try:
-        exchange_code(code)
-        return RedirectResponse(url="/")
+        # Token request and credential store write: off the event loop
+        await tool_executor.run_blocking("auth", _sign_in, code, user_id)
+        response = RedirectResponse(url="/")
+        _set_user_cookie(response, user_id)
+        response.delete_cookie(STATE_COOKIE)
+        return response
     except Exception as e:
         return JSONResponse(
             status_code=400,
@@ -37,5 +115,7 @@ async def callback(code: str):
 @router.post("/logout")
 async def logout_route():
     """Remove stored credentials."""
-    logout()
+    user_id = users.current_user()
+    if user_id is not None:
+        await tool_executor.run_blocking("auth", _sign_out, user_id)
     return {"status": "logged_out"}
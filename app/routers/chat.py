@@ -1,17 +1,22 @@
 """Chat routes – handles text and voice-based chat with the AI agent."""
 
+import asyncio
+import json
+import uuid
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 
-from app.services.ai_agent import chat
+from app.services import turns, users
+from app.services.ai_agent import chat, chat_stream
 from app.services.google_auth import is_authenticated
+from app.services.history import compact_history
+from app.services.session_store import get_store
 
 router = APIRouter(prefix="/api", tags=["Chat"])
 
-# In-memory conversation storage (per-session in production you'd use a DB)
-_conversations: dict[str, list[dict]] = {}
-
 
 class ChatRequest(BaseModel):
     message: str
@@ -21,28 +26,66 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     reply: str
     session_id: str
+    tokens_saved: int = 0
+
+
+NOT_AUTHENTICATED = "⚠️ Google hesabınız bağlı değil. Lütfen önce sol panelden Google hesabınızla giriş yapın."
+CANCELLED = "⏹️ İstek iptal edildi."
+
+
+# Session ids come from the client; the store and the turn registry are
+# shared by all users, so they are keyed by users.scoped(session_id).
+# Store calls may hit SQLite (and wait for its write lock), so they run on a
+# thread like the lease calls in ``turns``.
+
+async def _load_history(session_id: str) -> tuple[list[dict], int]:
+    """Return the session history fitted to the prompt token budget."""
+    history, saved = await compact_history(await asyncio.to_thread(get_store().get, users.scoped(session_id)))
+    if saved:
+        await _save_history(session_id, history)
+    return history, saved
+
+
+async def _save_history(session_id: str, history: list[dict]):
+    await asyncio.to_thread(get_store().put, users.scoped(session_id), history)
+
+
+async def _turn(session_id: str, message: str) -> tuple[str, int]:
+    """One non-streaming turn: load history, run the agent, save."""
+    history, tokens_saved = await _load_history(session_id)
+    reply, updated_history = await chat(message, history)
+    await _save_history(session_id, updated_history)
+    return reply, tokens_saved
+
+
+def _turn_events(session_id: str, message: str):
+    """Factory for one streaming turn; the history is saved on ``done``."""
+    async def events():
+        history, tokens_saved = await _load_history(session_id)
+        async for event in chat_stream(message, history):
+            if event["type"] == "done":
+                await _save_history(session_id, event["history"])
+                event = {"type": "done", "reply": event["reply"], "session_id": session_id, "tokens_saved": tokens_saved}
+            yield event
+    return events
 
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(req: ChatRequest):
-    """Process a text chat message through the AI agent."""
-    if not is_authenticated():
-        return ChatResponse(
-            reply="⚠️ Google hesabınız bağlı değil. Lütfen önce sol panelden Google hesabınızla giriş yapın.",
-            session_id=req.session_id,
-        )
+    """Process a text chat message through the AI agent.
 
-    history = _conversations.get(req.session_id, [])
+    Messages for the same session are processed one at a time, in order.
+    """
+    if not is_authenticated():
+        return ChatResponse(reply=NOT_AUTHENTICATED, session_id=req.session_id)
 
     try:
-        reply, updated_history = await chat(req.message, history)
-        _conversations[req.session_id] = updated_history
-
-        # Keep history manageable (last 30 messages)
-        if len(_conversations[req.session_id]) > 30:
-            _conversations[req.session_id] = _conversations[req.session_id][-30:]
-
-        return ChatResponse(reply=reply, session_id=req.session_id)
+        reply, tokens_saved = await turns.run(
+            users.scoped(req.session_id), lambda: _turn(req.session_id, req.message)
+        )
+        return ChatResponse(reply=reply, session_id=req.session_id, tokens_saved=tokens_saved)
+    except turns.TurnCancelled:
+        return ChatResponse(reply=CANCELLED, session_id=req.session_id)
     except Exception as e:
         return ChatResponse(
             reply=f"❌ Bir hata oluştu: {str(e)}",
@@ -50,23 +93,111 @@ async def chat_endpoint(req: ChatRequest):
         )
 
 
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """Process a text chat message and stream the reply as Server-Sent Events.
+
+    Events: ``token`` (text delta), ``reset`` (discard text shown so far),
+    ``tool`` (tools being run), ``done`` (full reply), ``cancelled`` and
+    ``error``. Closing the connection cancels the turn.
+    """
+    async def events():
+        if not is_authenticated():
+            yield _sse({"type": "error", "reply": NOT_AUTHENTICATED})
+            return
+
+        try:
+            events_factory = _turn_events(req.session_id, req.message)
+            async for event in turns.stream(users.scoped(req.session_id), events_factory):
+                yield _sse(event)
+        except turns.TurnCancelled:
+            yield _sse({"type": "cancelled", "reply": CANCELLED, "session_id": req.session_id})
+        except Exception as e:
+            yield _sse({"type": "error", "reply": f"❌ Bir hata oluştu: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/chat/cancel")
+async def cancel_chat(session_id: str = "default"):
+    """Cancel the running (and queued) turns of a session."""
+    return {"status": "cancelled", "session_id": session_id, "cancelled": turns.cancel(users.scoped(session_id))}
+
+
 @router.post("/chat/clear")
 async def clear_chat(session_id: str = "default"):
     """Clear conversation history for a session."""
-    _conversations.pop(session_id, None)
+    turns.cancel(users.scoped(session_id))
+    await asyncio.to_thread(get_store().delete, users.scoped(session_id))
     return {"status": "cleared", "session_id": session_id}
 
 
 @router.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
-    """WebSocket endpoint for real-time chat (used by voice input)."""
+    """WebSocket endpoint for real-time chat (used by voice input).
+
+    Every connection gets its own session, announced in a ``session`` event.
+    Clients send either plain text or ``{"message": ..., "stream": bool}``;
+    ``{"type": "cancel"}`` cancels the turn in progress. With streaming (the
+    default) ``token`` / ``reset`` / ``tool`` events are sent while the reply
+    is generated, followed by the usual ``message``. Disconnecting cancels
+    whatever is still running.
+    """
+    # HTTP middleware does not run for WebSockets; identify the user here
+    users.set_current_user(users.from_cookie(websocket.cookies.get(users.COOKIE_NAME)))
     await websocket.accept()
-    session_id = "ws_default"
-    history = _conversations.get(session_id, [])
+    session_id = f"ws_{uuid.uuid4().hex}"
+    turn_key = users.scoped(session_id)
+    await websocket.send_json({"type": "session", "session_id": session_id})
+    pending: set[asyncio.Task] = set()
+
+    async def handle(message: str, stream: bool):
+        try:
+            if stream:
+                reply, tokens_saved = "", 0
+                async for event in turns.stream(turn_key, _turn_events(session_id, message)):
+                    if event["type"] == "done":
+                        reply, tokens_saved = event["reply"], event["tokens_saved"]
+                    else:
+                        await websocket.send_json(event)
+            else:
+                reply, tokens_saved = await turns.run(turn_key, lambda: _turn(session_id, message))
+
+            await websocket.send_json({
+                "reply": reply,
+                "type": "message",
+                "tokens_saved": tokens_saved,
+            })
+        except turns.TurnCancelled:
+            await websocket.send_json({"reply": CANCELLED, "type": "cancelled"})
+        except Exception as e:
+            await websocket.send_json({
+                "reply": f"❌ Hata: {str(e)}",
+                "type": "error",
+            })
 
     try:
         while True:
             data = await websocket.receive_text()
+            stream = True
+            try:
+                payload = json.loads(data)
+                if isinstance(payload, dict) and payload.get("type") == "cancel":
+                    turns.cancel(turn_key)
+                    continue
+                if isinstance(payload, dict) and "message" in payload:
+                    data = str(payload["message"])
+                    stream = bool(payload.get("stream", True))
+            except json.JSONDecodeError:
+                pass
 
             if not is_authenticated():
                 await websocket.send_json({
@@ -75,21 +206,15 @@ async def websocket_chat(websocket: WebSocket):
                 })
                 continue
 
-            try:
-                reply, history = await chat(data, history)
-                _conversations[session_id] = history
-
-                if len(_conversations[session_id]) > 30:
-                    _conversations[session_id] = _conversations[session_id][-30:]
-
-                await websocket.send_json({
-                    "reply": reply,
-                    "type": "message",
-                })
-            except Exception as e:
-                await websocket.send_json({
-                    "reply": f"❌ Hata: {str(e)}",
-                    "type": "error",
-                })
+            # Keep reading while the turn runs so a cancel can get through;
+            # turns of this session still run one at a time.
+            task = asyncio.create_task(handle(data, stream))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
     except WebSocketDisconnect:
         pass
+    finally:
+        turns.cancel(turn_key)
+        for task in pending:
+            task.cancel()
+        await asyncio.to_thread(get_store().delete, turn_key)
@@ -0,0 +1,126 @@
+"""Drive routes – streams file downloads to the browser."""
+
+import re
+import tempfile
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.config import settings
+from app.services import google_drive, tool_executor
+from app.services.google_auth import is_authenticated
+
+router = APIRouter(prefix="/api/drive", tags=["Drive"])
+
+# Size of the pieces the spooled file is streamed back in
+_STREAM_CHUNK = 256 * 1024
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Return the inclusive ``(start, end)`` of a single-range header, or None if unsatisfiable."""
+    m = _RANGE.match(header.strip())
+    if m is None or m.group(1) == m.group(2) == "":
+        return None
+    if m.group(1) == "":
+        # Suffix range: the last N bytes
+        length = int(m.group(2))
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _content_disposition(filename: str) -> str:
+    ascii_name = filename.encode("ascii", "replace").decode().replace('"', "'")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _iter_file(fh, start: int, length: int):
+    try:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(_STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+async def _iter_remote(file_id: str, start: int, end: int):
+    """Relay bytes ``start``..``end`` of a stored file, one ranged Drive request per chunk."""
+    while start <= end:
+        stop = min(start + settings.DRIVE_DOWNLOAD_CHUNK_SIZE, end + 1) - 1
+        chunk = await tool_executor.run_blocking("download", google_drive.download_range, file_id, start, stop)
+        if not chunk:
+            break
+        start += len(chunk)
+        yield chunk
+
+
+@router.get("/files/{file_id}/download")
+async def download(file_id: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """Download a Drive file (Google files are exported) as an attachment.
+
+    Stored files are relayed chunk by chunk with ranged Drive requests, so
+    the first bytes go out after the first chunk and a byte range only
+    fetches what was asked for. Exports have no size or ranges, so they are
+    spooled to a temporary file on a tool worker – in memory up to
+    DRIVE_DOWNLOAD_SPOOL_MEMORY, on disk beyond that – and streamed back
+    from there. Single byte ranges are supported.
+    """
+    if not is_authenticated():
+        return JSONResponse(status_code=401, content={"error": "Google hesabı bağlı değil."})
+
+    fh = None
+    try:
+        info = await tool_executor.run_blocking("download", google_drive.get_download_info, file_id)
+        if google_drive.is_exported(info) or info.get("size") is None:
+            fh = tempfile.SpooledTemporaryFile(max_size=settings.DRIVE_DOWNLOAD_SPOOL_MEMORY)
+            info = await tool_executor.run_blocking(
+                "download", google_drive.download_to_file, file_id, fh, None, info
+            )
+    except Exception as e:
+        if fh is not None:
+            fh.close()
+        return JSONResponse(status_code=502, content={"error": f"Dosya indirilemedi: {e}"})
+
+    size = int(info["size"])
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _content_disposition(info["filename"]),
+    }
+    start, end, status = 0, size - 1, 200
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            if fh is not None:
+                fh.close()
+            return JSONResponse(
+                status_code=416,
+                content={"error": "Geçersiz aralık."},
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        start, end = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = max(end - start + 1, 0)
+    headers["Content-Length"] = str(length)
+    body = _iter_file(fh, start, length) if fh is not None else _iter_remote(file_id, start, end)
+    return StreamingResponse(
+        body,
+        status_code=status,
+        media_type=info["mimeType"],
+        headers=headers,
+    )
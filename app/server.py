@@ -0,0 +1,43 @@
+"""Running the app under uvicorn with a graceful drain of agent turns.
+
+uvicorn's ``Server.shutdown`` closes WebSockets and waits for HTTP requests
+before it runs the lifespan shutdown, so by the time the lifespan could wait
+for turns their connections are already gone. ``DrainingServer`` stops new
+turns and waits for the running ones first, then lets uvicorn shut down as
+usual. ``serve()`` mirrors ``uvicorn.run`` (reload, several workers or a
+single process) with that server class.
+"""
+
+import logging
+
+import uvicorn
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+from app.config import settings
+from app.services import turns
+
+logger = logging.getLogger(__name__)
+
+
+class DrainingServer(uvicorn.Server):
+    async def shutdown(self, sockets=None):
+        turns.close()
+        cancelled = await turns.drain(settings.APP_GRACEFUL_TIMEOUT)
+        if cancelled:
+            logger.warning("Cancelled %d unfinished turn(s) on shutdown", cancelled)
+        await super().shutdown(sockets)
+
+
+def serve(app: str, **kwargs):
+    """Like ``uvicorn.run(app, **kwargs)``, with ``DrainingServer`` in every worker."""
+    config = uvicorn.Config(app, **kwargs)
+    server = DrainingServer(config=config)
+    try:
+        if config.should_reload:
+            ChangeReload(config, target=server.run, sockets=[config.bind_socket()]).run()
+        elif config.workers > 1:
+            Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass
@@ -3,16 +3,28 @@
 Uses a function-calling approach: the LLM receives a system prompt describing
 available tools, and when it decides to use a tool, this module parses the
 request and calls the appropriate Google service function.
+
+Backends with OpenAI-style function calling get the tools as structured
+``tools`` instead and return ``tool_calls`` (see ``AI_TOOL_MODE``); the
+prompt-embedded JSON protocol remains the fallback.
 """
 
 import json
+import logging
 import re
-from typing import Optional
+import time
+from typing import AsyncIterator
 
 import httpx
 
 from app.config import settings
 from app.services import google_drive, google_docs, google_sheets, google_slides, google_calendar, google_gmail
+from app.services import batch_updates, columnar, content_index, drive_index, llm_client, result_shaping, tool_cache, tool_executor
+from app.services import tracing
+from app.services.google_clients import NotModified
+from app.services.tool_parser import object_end, parse_reply
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # Tool definitions (sent to the LLM so it knows what it can call)
@@ -23,16 +35,16 @@ TOOLS = [
     {
         "name": "drive_list_files",
         "description": "Google Drive'daki dosyaları listeler. query parametresi opsiyoneldir.",
-        "parameters": {"query": "string (opsiyonel)", "page_size": "integer (varsayılan 20)"},
+        "parameters": {"query": "string (opsiyonel)", "page_size": "integer – döndürülecek dosya sayısı (varsayılan 20)"},
     },
     {
         "name": "drive_search_files",
-        "description": "Google Drive'da dosya arar.",
-        "parameters": {"name": "string – aranacak dosya adı"},
+        "description": "Google Drive'da dosya arar. Tüm sayfaları tarar.",
+        "parameters": {"name": "string – aranacak dosya adı", "max_results": "integer (opsiyonel)"},
     },
     {
         "name": "drive_download_file",
-        "description": "Google Drive'dan dosya indirir. file_id gereklidir.",
+        "description": "Google Drive'dan dosya indirme bağlantısı oluşturur. file_id gereklidir.",
         "parameters": {"file_id": "string"},
     },
     {
@@ -64,8 +76,8 @@ TOOLS = [
     # ----- Sheets -----
     {
         "name": "sheets_create",
-        "description": "Yeni bir Google Spreadsheet oluşturur.",
-        "parameters": {"title": "string", "headers": "list[string] (opsiyonel)"},
+        "description": "Yeni bir Google Spreadsheet oluşturur. İlk veriler (rows) tek seferde yazılabilir.",
+        "parameters": {"title": "string", "headers": "list[string] (opsiyonel)", "rows": "list[list] (opsiyonel)"},
     },
     {
         "name": "sheets_read",
@@ -77,6 +89,32 @@ TOOLS = [
         "description": "Bir Google Spreadsheet'e veri yazar.",
         "parameters": {"spreadsheet_id": "string", "range_name": "string", "values": "list[list]"},
     },
+    {
+        "name": "sheets_batch_read",
+        "description": "Bir Google Spreadsheet'ten birden fazla aralığı tek seferde okur. columnar=true ile sonuç, sütun adı ve tipiyle (number/boolean/string) sütun sütun döner.",
+        "parameters": {"spreadsheet_id": "string", "ranges": "list[string]", "columnar": "boolean (opsiyonel)"},
+    },
+    {
+        "name": "sheets_query",
+        "description": "Bir Google Spreadsheet aralığı üzerinde filtreleme, gruplama ve toplam/ortalama/sayım gibi hesaplamaları sunucuda yapar ve yalnızca sonucu döndürür. Tablo üzerindeki hesaplama sorularında sheets_read yerine bunu kullan. İlk satır sütun adlarıdır; sütunlar adıyla (büyük/küçük harf fark etmez) ya da sayfadaki harfiyle (ör. B) belirtilebilir.",
+        "parameters": {
+            "spreadsheet_id": "string",
+            "range_name": "string (varsayılan A1:Z10000)",
+            "filters": "list[object] (opsiyonel) – her biri {\"column\": \"B\", \"op\": \"=, !=, >, >=, <, <=, contains, in\", \"value\": ...}",
+            "group_by": "list[string] (opsiyonel) – gruplanacak sütunlar (ad veya harf)",
+            "aggregates": "list[object] (opsiyonel) – her biri {\"column\": \"C\", \"func\": \"sum, avg, count, min, max, median\"}; varsayılan count",
+            "order_by": "string (opsiyonel) – sıralama alanı: bir hesaplama, ör. sum(C), ya da group_by sütunu",
+            "limit": "integer (varsayılan 50)",
+        },
+    },
+    {
+        "name": "sheets_batch_write",
+        "description": "Bir Google Spreadsheet'e birden fazla aralığa tek seferde veri yazar.",
+        "parameters": {
+            "spreadsheet_id": "string",
+            "data": "list[object] – her biri {\"range\": \"A1\", \"values\": [[...]]}",
+        },
+    },
     {
         "name": "sheets_append_rows",
         "description": "Bir Google Spreadsheet'e satır ekler.",
@@ -103,6 +141,22 @@ TOOLS = [
         "description": "Bir slayda metin kutusu ekler.",
         "parameters": {"presentation_id": "string", "slide_id": "string", "text": "string"},
     },
+    {
+        "name": "slides_create_deck",
+        "description": "Başlıklı ve içerikli slaytlarla birlikte yeni bir sunum oluşturur (tek seferde). Çok slaytlı sunumlar için bunu kullan.",
+        "parameters": {
+            "title": "string",
+            "slides": "list[object] – her slayt için {\"title\": \"...\", \"body\": \"...\"}",
+        },
+    },
+    {
+        "name": "slides_add_slides",
+        "description": "Var olan bir sunuma başlıklı ve içerikli birden fazla slayt ekler (tek seferde).",
+        "parameters": {
+            "presentation_id": "string",
+            "slides": "list[object] – her slayt için {\"title\": \"...\", \"body\": \"...\"}",
+        },
+    },
     # ----- Calendar -----
     {
         "name": "calendar_list_events",
@@ -162,13 +216,25 @@ TOOLS = [
     {
         "name": "gmail_list_messages",
         "description": "Gmail'deki mesajları listeler.",
-        "parameters": {"query": "string (opsiyonel)", "max_results": "integer (varsayılan 10)"},
+        "parameters": {"query": "string (opsiyonel)", "max_results": "integer (varsayılan 10, en fazla 500)"},
     },
     {
         "name": "gmail_get_message",
         "description": "Bir e-postanın tüm detaylarını getirir.",
         "parameters": {"message_id": "string"},
     },
+    # ----- Workspace -----
+    {
+        "name": "workspace_search",
+        "description": "Docs, Sheets ve Slides dosyalarının İÇERİĞİNDE arama yapar ve en alakalı pasajları döndürür. İçerikle ilgili sorularda belgeleri tamamen okumadan önce bunu kullan.",
+        "parameters": {"query": "string – aranacak ifade", "limit": "integer (varsayılan 5)"},
+    },
+    # ----- Results -----
+    {
+        "name": "result_page",
+        "description": "Kısaltılmış (truncated) büyük bir araç sonucunun devamını getirir. handle, kısaltılmış sonuçta verilir. Sonraki sayfa için yanıttaki nextOffset değerini offset olarak ver.",
+        "parameters": {"handle": "string", "offset": "integer (varsayılan 0)", "limit": "integer (opsiyonel)"},
+    },
 ]
 
 
@@ -176,16 +242,49 @@ TOOLS = [
 # Tool dispatcher
 # ---------------------------------------------------------------------------
 
+# Services whose writes create or change Drive files
+_DRIVE_SERVICES = ("drive", "docs", "sheets", "slides")
+
+
+def _listing_result(listing: google_drive.FileListing) -> dict:
+    """Drain a Drive listing; say so when results were left on the server."""
+    files = list(listing)
+    result = {"result": files}
+    if listing.truncated:
+        result["note"] = (
+            f"İlk {len(files)} sonuç gösteriliyor, daha fazlası var. "
+            "Aramayı daraltın veya max_results değerini artırın."
+        )
+    return result
+
+
 def _dispatch_tool(name: str, args: dict) -> dict:
-    """Call the actual Google service function based on the tool name."""
+    """Call the actual Google service function based on the tool name.
+
+    This is blocking; from async code go through ``tool_executor.run_tool``
+    (with ``_cached_dispatch`` so read results are cached).
+    """
     try:
         if name == "drive_list_files":
-            return {"result": google_drive.list_files(args.get("query"), int(args.get("page_size", 20)))}
+            return _listing_result(google_drive.iter_files(args.get("query"), max_results=int(args.get("page_size", 20))))
         elif name == "drive_search_files":
-            return {"result": google_drive.search_files(args["name"])}
+            max_results = int(args["max_results"]) if args.get("max_results") else None
+            if settings.DRIVE_INDEX_ENABLED:
+                try:
+                    drive_index.ensure_fresh()
+                    return {"result": drive_index.search(args["name"], max_results or 20)}
+                except drive_index.IndexNotReady:
+                    pass
+                except Exception as e:
+                    logger.warning("Drive index unavailable, searching remotely: %s", e)
+            return _listing_result(google_drive.iter_files(google_drive.name_query(args["name"]), max_results=max_results))
         elif name == "drive_download_file":
-            _, filename = google_drive.download_file(args["file_id"])
-            return {"result": f"'{filename}' dosyası başarıyla indirildi. İndirme bağlantısını kullanıcıya sağlayın."}
+            info = google_drive.get_download_info(args["file_id"])
+            return {"result": {
+                "filename": info["filename"],
+                "downloadUrl": f"/api/drive/files/{args['file_id']}/download",
+                "message": f"'{info['filename']}' dosyası indirilmeye hazır. İndirme bağlantısını kullanıcıya sağlayın.",
+            }}
         elif name == "drive_create_folder":
             return {"result": google_drive.create_folder(args["name"], args.get("parent_id"))}
         elif name == "docs_create":
@@ -200,7 +299,10 @@ def _dispatch_tool(name: str, args: dict) -> dict:
             headers = args.get("headers")
             if isinstance(headers, str):
                 headers = json.loads(headers)
-            return {"result": google_sheets.create_spreadsheet(args["title"], headers)}
+            rows = args.get("rows")
+            if isinstance(rows, str):
+                rows = json.loads(rows)
+            return {"result": google_sheets.create_spreadsheet(args["title"], headers, rows)}
         elif name == "sheets_read":
             return {"result": google_sheets.read_range(args["spreadsheet_id"], args.get("range_name", "A1:Z1000"))}
         elif name == "sheets_write":
@@ -208,6 +310,35 @@ def _dispatch_tool(name: str, args: dict) -> dict:
             if isinstance(values, str):
                 values = json.loads(values)
             return {"result": google_sheets.write_range(args["spreadsheet_id"], args["range_name"], values)}
+        elif name == "sheets_batch_read":
+            ranges = args["ranges"]
+            if isinstance(ranges, str):
+                ranges = json.loads(ranges) if ranges.startswith("[") else [ranges]
+            if args.get("columnar") in (True, "true"):
+                tables = google_sheets.read_columns(args["spreadsheet_id"], ranges)
+                return {"result": {"spreadsheetId": args["spreadsheet_id"], "ranges": [t.to_dict() for t in tables]}}
+            return {"result": google_sheets.batch_read(args["spreadsheet_id"], ranges)}
+        elif name == "sheets_query":
+            query_args = {}
+            for key in ("filters", "group_by", "aggregates"):
+                value = args.get(key)
+                if isinstance(value, str):
+                    value = json.loads(value) if value.startswith(("[", "{")) else [value]
+                if isinstance(value, dict):
+                    value = [value]
+                query_args[key] = value
+            table = google_sheets.get_table(args["spreadsheet_id"], args.get("range_name", "A1:Z10000"))
+            return {"result": columnar.query(
+                table,
+                order_by=args.get("order_by"),
+                limit=int(args.get("limit", 50)),
+                **query_args,
+            )}
+        elif name == "sheets_batch_write":
+            data = args["data"]
+            if isinstance(data, str):
+                data = json.loads(data)
+            return {"result": google_sheets.batch_write(args["spreadsheet_id"], data)}
         elif name == "sheets_append_rows":
             values = args["values"]
             if isinstance(values, str):
@@ -221,6 +352,16 @@ def _dispatch_tool(name: str, args: dict) -> dict:
             return {"result": google_slides.add_slide(args["presentation_id"], args.get("layout", "BLANK"))}
         elif name == "slides_add_text":
             return {"result": google_slides.add_text_to_slide(args["presentation_id"], args["slide_id"], args["text"])}
+        elif name in ("slides_create_deck", "slides_add_slides"):
+            slides = args.get("slides") or []
+            if isinstance(slides, str):
+                slides = json.loads(slides)
+            if name == "slides_create_deck":
+                return {"result": google_slides.create_deck(args["title"], slides)}
+            return {"result": google_slides.add_slides(args["presentation_id"], slides)}
+        elif name in ("docs_batch_update", "slides_batch_update"):
+            # Produced by batch_updates.coalesce, not by the model
+            return {"result": batch_updates.apply(name, args)}
         elif name == "calendar_list_events":
             return {"result": google_calendar.list_events(int(args.get("max_results", 10)))}
         elif name == "calendar_create_event":
@@ -266,19 +407,65 @@ def _dispatch_tool(name: str, args: dict) -> dict:
                 )
             }
         elif name == "gmail_list_messages":
-            return {"result": google_gmail.list_messages(args.get("query", ""), int(args.get("max_results", 10)))}
+            return {"result": google_gmail.list_messages(args.get("query", ""), min(int(args.get("max_results", 10)), 500))}
         elif name == "gmail_get_message":
             return {"result": google_gmail.get_message(args["message_id"])}
+        elif name == "workspace_search":
+            return _workspace_search(args["query"], int(args.get("limit", 5)))
+        elif name == "result_page":
+            return {"result": result_shaping.page(args["handle"], args.get("offset", 0), args.get("limit"))}
         else:
             return {"error": f"Bilinmeyen araç: {name}"}
+    except NotModified:
+        # Conditional GET answered 304 – the result cache serves its copy
+        raise
     except Exception as e:
         return {"error": str(e)}
 
 
+def _workspace_search(query: str, limit: int) -> dict:
+    """Search document contents, indexing what changed since the last search first."""
+    if not settings.CONTENT_INDEX_ENABLED:
+        return {"error": "İçerik dizini devre dışı."}
+    if not settings.DRIVE_INDEX_ENABLED:
+        # The content index learns which documents changed from the Drive index
+        return {"error": "İçerik dizini, Drive dizini (DRIVE_INDEX_ENABLED) kapalıyken kullanılamaz."}
+    try:
+        drive_index.ensure_fresh()
+    except drive_index.IndexNotReady:
+        # Without the file list a refresh would treat every document as deleted
+        return {
+            "result": content_index.search(query, limit),
+            "note": "Drive dizini hazırlanıyor; içerik dizini henüz güncellenmedi, sonuçlar eksik olabilir.",
+        }
+    status = content_index.refresh(time_budget=settings.CONTENT_INDEX_REFRESH_BUDGET)
+    result = {"result": content_index.search(query, limit)}
+    if status["pending"]:
+        result["note"] = f"{status['pending']} dosya henüz dizinlenmedi; sonuçlar eksik olabilir."
+    return result
+
+
+def _cached_dispatch(name: str, args: dict) -> dict:
+    """``_dispatch_tool`` behind the read-result cache (blocking), traced as a ``tool`` span."""
+    with tracing.span("tool", tool=name) as tool_span:
+        result = tool_cache.call(_dispatch_tool, name, args)
+        if "error" in result:
+            tool_span.status = "error"
+            tool_span.set(**{"error.message": str(result["error"])[:200]})
+    if name not in tool_executor.READ_ONLY_TOOLS and name.split("_", 1)[0] in _DRIVE_SERVICES:
+        drive_index.mark_stale()
+    return result
+
+
 # ---------------------------------------------------------------------------
 # System prompt
 # ---------------------------------------------------------------------------
 
+# The prompts below are rendered once at import time and must stay
+# byte-identical across requests so provider-side prefix caching can hit.
+# Anything volatile (the current date) goes into DATE_PROMPT, which is sent
+# as a separate message right before the user's message.
+
 SYSTEM_PROMPT = """Sen, Berra AKMAN adlı kullanıcının kişisel yapay zeka asistanısın. Adın "BerrAI".
 
 Kullanıcının Google hesabı ile tam entegre çalışıyorsun. Aşağıdaki araçları kullanabilirsin:
@@ -294,48 +481,337 @@ Kullanıcının Google hesabı ile tam entegre çalışıyorsun. Aşağıdaki ar
 3. ÇOK ÖNEMLİ: Eğer bir araç çağıracaksan, cevabına normal metin ekleme. Sadece JSON bloğunu ver.
 4. ÇOK ÖNEMLİ: Birden fazla araç çağıracaksan, her bir JSON bloğunu ayrı ayrı ver.
 5. Araç çağrıldıktan ve sonucu sana verildikten sonra (veya baştan bir araç kullanmana gerek yoksa) sonucu kullanıcıya Türkçe ve nazikçe özetle.
-6. Tarih/saat: {current_date}
+6. Güncel tarih/saat, kullanıcının mesajından hemen önce ayrı bir sistem mesajıyla verilir.
 """
 
 
-def _build_system_prompt() -> str:
-    """Build the system prompt with tool descriptions."""
-    from datetime import datetime
+NATIVE_SYSTEM_PROMPT = """Sen, Berra AKMAN adlı kullanıcının kişisel yapay zeka asistanısın. Adın "BerrAI".
+
+Kullanıcının Google hesabı ile tam entegre çalışıyorsun. Sana verilen araçları (tools) kullanabilirsin.
+
+## Kurallar:
+1. Kullanıcının isteklerini anla ve eğer işlem yapman gerekiyorsa mutlaka uygun aracı çağır.
+2. Birbirinden bağımsız birden fazla işlem gerekiyorsa araçları aynı yanıtta birlikte çağırabilirsin.
+3. Araç sonuçları sana verildikten sonra (veya baştan bir araç kullanmana gerek yoksa) sonucu kullanıcıya Türkçe ve nazikçe özetle.
+4. Güncel tarih/saat, kullanıcının mesajından hemen önce ayrı bir sistem mesajıyla verilir.
+"""
 
-    tools_text = ""
+DATE_PROMPT = "Tarih/saat: {current_date}"
+
+
+def _render_tools_description() -> str:
+    """Render the tool catalogue for the prompt-embedded protocol."""
+    lines = []
     for tool in TOOLS:
         parameters = tool.get("parameters", {})
         if isinstance(parameters, dict):
             params = ", ".join(f"{k}: {v}" for k, v in parameters.items())
         else:
             params = ""
-        tools_text += f"- **{tool['name']}**: {tool['description']}\n  Parametreler: {params}\n"
+        lines.append(f"- **{tool['name']}**: {tool['description']}\n  Parametreler: {params}\n")
+    return "".join(lines)
+
+
+_PROMPT_SYSTEM_PROMPT = SYSTEM_PROMPT.format(tools_description=_render_tools_description())
+
+
+def _build_system_prompt(native_tools: bool = False) -> str:
+    """Return the pre-rendered system prompt.
+
+    With native function calling the tools travel as structured ``tools``,
+    so the prompt does not describe them or the JSON protocol.
+    """
+    return NATIVE_SYSTEM_PROMPT if native_tools else _PROMPT_SYSTEM_PROMPT
+
+
+def _date_message() -> dict:
+    """The only per-request part of the prompt, placed after the cached prefix."""
+    from datetime import datetime
+
+    return {"role": "system", "content": DATE_PROMPT.format(current_date=datetime.now().strftime("%Y-%m-%d %H:%M"))}
+
+
+# ---------------------------------------------------------------------------
+# Native function calling
+# ---------------------------------------------------------------------------
+
+_JSON_TYPES = {"string": "string", "integer": "integer", "number": "number", "boolean": "boolean", "object": "object"}
+
+
+def _parameter_schema(spec: str) -> tuple[dict, bool]:
+    """Turn a free-text parameter spec like ``"list[string] (opsiyonel)"`` into
+    a JSON schema plus whether the parameter is required."""
+    type_name = spec.split()[0] if spec else "string"
+    if type_name.startswith("list["):
+        inner = type_name[len("list["):-1]
+        if inner == "list":
+            items = {"type": "array", "items": {"type": "string"}}
+        else:
+            items = {"type": _JSON_TYPES.get(inner, "string")}
+        schema = {"type": "array", "items": items}
+    else:
+        schema = {"type": _JSON_TYPES.get(type_name, "string")}
+    description = spec[len(type_name):].strip(" –-")
+    if description:
+        schema["description"] = description
+    required = "opsiyonel" not in spec and "varsayılan" not in spec
+    return schema, required
+
+
+def _tool_schema(tool: dict) -> dict:
+    properties = {}
+    required = []
+    for name, spec in tool.get("parameters", {}).items():
+        properties[name], is_required = _parameter_schema(spec)
+        if is_required:
+            required.append(name)
+    return {
+        "type": "function",
+        "function": {
+            "name": tool["name"],
+            "description": tool["description"],
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+
+# OpenAI-style ``tools`` payload, built once from TOOLS
+TOOL_SCHEMAS = [_tool_schema(tool) for tool in TOOLS]
+
+# Set once a backend rejects ``tools`` in "auto" mode; from then on the
+# prompt-embedded JSON protocol is used.
+_native_tools_unsupported = False
+
+# How backends word a rejected ``tools`` payload: "does not support tools",
+# "tool_choice requires --enable-auto-tool-choice", "function calling is not
+# supported", "extra fields not permitted: tools", ...
+_TOOLS_REJECTED = re.compile(r"\btool(?:s|_choice|_call\w*)?\b|function[ _-]?call", re.IGNORECASE)
+
+
+def _rejects_tools(error: httpx.HTTPStatusError) -> bool:
+    """Whether a failed completion says the backend cannot take ``tools``."""
+    if error.response.status_code not in (400, 404, 422):
+        return False
+    try:
+        body = error.response.text
+    except httpx.ResponseNotRead:
+        return False
+    return bool(_TOOLS_REJECTED.search(body))
+
 
-    return SYSTEM_PROMPT.format(
-        tools_description=tools_text,
-        current_date=datetime.now().strftime("%Y-%m-%d %H:%M"),
+def _use_native_tools() -> bool:
+    if settings.AI_TOOL_MODE == "native":
+        return True
+    if settings.AI_TOOL_MODE == "auto":
+        return not _native_tools_unsupported
+    return False
+
+
+def _native_tool_calls(raw_calls: list[dict]) -> list[dict]:
+    """Convert OpenAI ``tool_calls`` into the internal ``{"tool", "args", "id"}`` form."""
+    calls = []
+    for i, raw in enumerate(raw_calls):
+        function = raw.get("function") or {}
+        arguments = function.get("arguments") or {}
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError:
+                arguments = {}
+        calls.append({
+            "tool": function.get("name", ""),
+            "args": arguments if isinstance(arguments, dict) else {},
+            "id": raw.get("id") or f"call_{i}",
+        })
+    return calls
+
+
+# ---------------------------------------------------------------------------
+# LLM calls
+# ---------------------------------------------------------------------------
+
+def _completion_body(messages: list[dict], stream: bool = False, native_tools: bool = False) -> dict:
+    body = {
+        "model": settings.AI_MODEL,
+        "messages": messages,
+        "temperature": 0.3,
+        "max_tokens": 4096,
+    }
+    if native_tools:
+        body["tools"] = TOOL_SCHEMAS
+        body["tool_choice"] = "auto"
+    if stream:
+        body["stream"] = True
+        if settings.AI_STREAM_USAGE:
+            # Without this OpenAI-compatible backends leave usage out of streams
+            body["stream_options"] = {"include_usage": True}
+    return body
+
+
+async def _complete(messages: list[dict], native_tools: bool = False) -> dict:
+    """Send a non-streaming chat completion request and return the message."""
+    response = await llm_client.get_client().post(
+        "/chat/completions", json=_completion_body(messages, native_tools=native_tools)
     )
+    response.raise_for_status()
+    data = response.json()
+    tracing.record_usage(data.get("usage"))
+    return data["choices"][0]["message"]
+
+
+async def _stream_completion(messages: list[dict], native_tools: bool = False) -> AsyncIterator[dict]:
+    """Send a streaming chat completion request and yield the ``delta`` dicts."""
+    async with llm_client.get_client().stream(
+        "POST", "/chat/completions", json=_completion_body(messages, stream=True, native_tools=native_tools)
+    ) as response:
+        if response.is_error:
+            # Read the error body so the caller can tell why it failed
+            await response.aread()
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+            # Backends that report usage send it with the last chunk
+            tracing.record_usage(chunk.get("usage"))
+            choices = chunk.get("choices") or []
+            if choices and choices[0].get("delta"):
+                yield choices[0]["delta"]
+
+
+# ---------------------------------------------------------------------------
+# Streaming gate
+# ---------------------------------------------------------------------------
+
+_STREAM_MARKERS = ("{", "```", "<think>")
+
+
+def _segment_end(text: str) -> int:
+    """Return the end index of the marker segment ``text`` starts with, or -1 if incomplete."""
+    if text.startswith("<think>"):
+        end = text.find("</think>")
+        return end + len("</think>") if end != -1 else -1
+    if text.startswith("```"):
+        end = text.find("```", 3)
+        return end + 3 if end != -1 else -1
+    return object_end(text, 0)
+
+
+class _StreamGate:
+    """Forwards streamed text to the client, holding back possible tool calls.
+
+    Plain text passes straight through. From a ``{``, a code fence or a
+    ``<think>`` tag on, text is held until the segment is complete: thinking
+    is dropped, a tool-call JSON block stops forwarding for the rest of the
+    reply, and anything else is released unchanged.
+    """
+
+    def __init__(self):
+        self._held = ""
+        self.emitted = ""
+        self.tool_detected = False
+
+    def feed(self, delta: str) -> str:
+        if self.tool_detected:
+            return ""
+        self._held += delta
+        out = []
+        while self._held:
+            starts = [i for i in (self._held.find(m) for m in _STREAM_MARKERS) if i != -1]
+            if not starts:
+                # Keep a trailing partial marker (e.g. "``" or "<thi") for the next delta
+                keep = 0
+                for marker in _STREAM_MARKERS:
+                    for k in range(len(marker) - 1, 0, -1):
+                        if self._held.endswith(marker[:k]):
+                            keep = max(keep, k)
+                            break
+                out.append(self._held[:len(self._held) - keep])
+                self._held = self._held[len(self._held) - keep:]
+                break
+
+            start = min(starts)
+            out.append(self._held[:start])
+            self._held = self._held[start:]
+            end = _segment_end(self._held)
+            if end == -1:
+                break
+            segment, self._held = self._held[:end], self._held[end:]
+            if segment.startswith("<think>"):
+                continue
+            if parse_reply(segment)[0]:
+                self.tool_detected = True
+                self._held = ""
+                break
+            out.append(segment)
+
+        text = "".join(out)
+        self.emitted += text
+        return text
+
+    def finish(self, final_reply: str) -> list[dict]:
+        """Events that bring the streamed text in line with the cleaned final reply."""
+        emitted = self.emitted.lstrip()
+        if final_reply == emitted.rstrip():
+            return []
+        if final_reply.startswith(emitted):
+            return [{"type": "token", "content": final_reply[len(emitted):]}]
+        return [{"type": "reset"}, {"type": "token", "content": final_reply}]
 
 
 # ---------------------------------------------------------------------------
 # Chat function
 # ---------------------------------------------------------------------------
 
-async def chat(
+async def _run_agent(
     user_message: str,
     conversation_history: list[dict],
-    max_tool_iterations: int = 5,
-) -> tuple[str, list[dict]]:
-    """Process a user message, potentially calling tools, and return a response.
-
-    Returns:
-        (assistant_reply, updated_conversation_history)
+    max_tool_iterations: int,
+    stream: bool,
+) -> AsyncIterator[dict]:
+    """Agent loop shared by ``chat`` and ``chat_stream``, traced as one ``turn`` span.
+
+    Yields event dicts: ``token`` (text to show), ``reset`` (discard the text
+    shown so far), ``tool`` (tools about to run) and finally ``done`` with the
+    full reply and the updated history.
     """
-    system_prompt = _build_system_prompt()
+    done = None
+    with tracing.span("turn", stream=stream, history_messages=len(conversation_history)) as turn:
+        async for event in _agent_loop(user_message, conversation_history, max_tool_iterations, stream):
+            if event["type"] == "done":
+                # Close the span now: callers stop iterating once they have the reply
+                turn.set(reply_chars=len(event["reply"]))
+                done = event
+                break
+            if event["type"] == "tool":
+                turn.add("tool_rounds")
+                turn.add("tool_calls", len(event["tools"]))
+            yield event
+    if done is not None:
+        yield done
+
+
+async def _agent_loop(
+    user_message: str,
+    conversation_history: list[dict],
+    max_tool_iterations: int,
+    stream: bool,
+) -> AsyncIterator[dict]:
+    global _native_tools_unsupported
+
+    native = _use_native_tools()
+    system_prompt = _build_system_prompt(native)
 
     # Build messages array
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(conversation_history)
+    messages.append(_date_message())
     messages.append({"role": "user", "content": user_message})
 
     iteration = 0
@@ -343,43 +819,104 @@ async def chat(
         iteration += 1
 
         # Call the LLM
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{settings.AI_BASE_URL}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {settings.AI_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": settings.AI_MODEL,
-                    "messages": messages,
-                    "temperature": 0.3,
-                    "max_tokens": 4096,
-                },
-            )
-            response.raise_for_status()
-            data = response.json()
-
-        assistant_content = data["choices"][0]["message"]["content"]
+        gate = _StreamGate()
+        raw_tool_calls = []
+        try:
+            started = time.perf_counter()
+            with tracing.span(
+                "llm.completion", model=settings.AI_MODEL, iteration=iteration, stream=stream, native_tools=native
+            ) as llm_span:
+                if stream:
+                    parts = []
+                    pending_calls: dict[int, dict] = {}
+                    async for delta in _stream_completion(messages, native):
+                        if "llm.ttft_ms" not in llm_span.attributes and (delta.get("content") or delta.get("tool_calls")):
+                            llm_span.set(**{"llm.ttft_ms": round((time.perf_counter() - started) * 1000, 1)})
+                        content = delta.get("content")
+                        if content:
+                            parts.append(content)
+                            visible = gate.feed(content)
+                            if visible:
+                                yield {"type": "token", "content": visible}
+                        for tc in delta.get("tool_calls") or []:
+                            pending = pending_calls.setdefault(tc.get("index", 0), {"id": "", "function": {"name": "", "arguments": ""}})
+                            if tc.get("id"):
+                                pending["id"] = tc["id"]
+                            function = tc.get("function") or {}
+                            pending["function"]["name"] += function.get("name") or ""
+                            pending["function"]["arguments"] += function.get("arguments") or ""
+                    assistant_content = "".join(parts)
+                    raw_tool_calls = [pending_calls[i] for i in sorted(pending_calls)]
+                else:
+                    message = await _complete(messages, native)
+                    assistant_content = message.get("content") or ""
+                    raw_tool_calls = message.get("tool_calls") or []
+        except httpx.HTTPStatusError as e:
+            # Backend without function calling: fall back to the JSON protocol.
+            # Other client errors (context too long, bad model name) are real.
+            if native and iteration == 1 and settings.AI_TOOL_MODE == "auto" and _rejects_tools(e):
+                logger.warning("LLM backend rejected native tools, using the JSON protocol: %s", e.response.text[:200])
+                _native_tools_unsupported = True
+                native = False
+                messages[0] = {"role": "system", "content": _build_system_prompt(False)}
+                iteration = 0
+                continue
+            raise
 
         # Check for tool calls in the response
-        tool_calls = _extract_tool_calls(assistant_content)
+        with tracing.span("agent.parse", iteration=iteration) as parse_span:
+            native_calls = bool(raw_tool_calls)
+            tool_calls, clean_response = parse_reply(assistant_content)
+            if native_calls:
+                tool_calls = _native_tool_calls(raw_tool_calls)
+            parse_span.set(tool_calls=len(tool_calls), reply_chars=len(assistant_content))
 
         if not tool_calls:
             # No tool calls – this is the final answer
-            # Clean the response (remove any thinking tags)
-            clean_response = _clean_response(assistant_content)
+            if stream:
+                for event in gate.finish(clean_response):
+                    yield event
             conversation_history.append({"role": "user", "content": user_message})
             conversation_history.append({"role": "assistant", "content": clean_response})
-            return clean_response, conversation_history
+            yield {"type": "done", "reply": clean_response, "history": conversation_history}
+            return
+
+        if gate.emitted:
+            yield {"type": "reset"}
+        yield {"type": "tool", "tools": [tc["tool"] for tc in tool_calls]}
+
+        # Execute tool calls (edits to the same document merged into one
+        # batchUpdate) and feed results back
+        merged_calls, groups = batch_updates.coalesce(tool_calls)
+        merged_results = await tool_executor.run_tool_calls(_cached_dispatch, merged_calls)
+        results = batch_updates.expand(merged_results, groups, len(tool_calls))
+        results = [result_shaping.shape(tc["tool"], result) for tc, result in zip(tool_calls, results)]
+
+        if native_calls:
+            messages.append({
+                "role": "assistant",
+                "content": assistant_content,
+                "tool_calls": [
+                    {
+                        "id": tc["id"],
+                        "type": "function",
+                        "function": {"name": tc["tool"], "arguments": json.dumps(tc["args"], ensure_ascii=False)},
+                    }
+                    for tc in tool_calls
+                ],
+            })
+            for tc, result in zip(tool_calls, results):
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tc["id"],
+                    "content": result_shaping.to_json(result),
+                })
+            continue
 
-        # Execute tool calls and feed results back
         messages.append({"role": "assistant", "content": assistant_content})
-
         tool_results = []
-        for tc in tool_calls:
-            result = _dispatch_tool(tc["tool"], tc["args"])
-            tool_results.append(f"Araç `{tc['tool']}` sonucu:\n```json\n{json.dumps(result, ensure_ascii=False, indent=2)}\n```")
+        for tc, result in zip(tool_calls, results):
+            tool_results.append(f"Araç `{tc['tool']}` sonucu:\n```json\n{result_shaping.to_json(result)}\n```")
 
         combined_results = "\n\n".join(tool_results)
         messages.append({"role": "user", "content": f"Araç çağrı sonuçları:\n\n{combined_results}\n\nBu sonuçları kullanarak kullanıcıya anlaşılır bir yanıt ver."})
@@ -387,104 +924,35 @@ async def chat(
     # If we exceeded iterations, return last response
     conversation_history.append({"role": "user", "content": user_message})
     conversation_history.append({"role": "assistant", "content": "İşlem tamamlandı."})
-    return "İşlem tamamlandı.", conversation_history
+    yield {"type": "token", "content": "İşlem tamamlandı."}
+    yield {"type": "done", "reply": "İşlem tamamlandı.", "history": conversation_history}
 
 
-def _extract_tool_calls(content: str) -> list[dict]:
-    """Extract tool_call JSON blocks from the assistant's response."""
-    calls = []
-    
-    # First check explicit markdown code blocks
-    pattern_blocks = r"```(?:json|tool_call)?\s*\n?(\{.*?\})\n?```"
-    matches = re.findall(pattern_blocks, content, re.DOTALL)
-    for match in matches:
-        try:
-            parsed = json.loads(match.strip())
-            if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
-                calls.append(parsed)
-        except json.JSONDecodeError:
-            pass
-
-    if calls:
-        return calls
-
-    # If no markdown blocks, use a robust brace-counting parser to find raw JSON objects
-    start_idx = 0
-    while True:
-        try:
-            start_idx = content.index("{", start_idx)
-            brace_count = 0
-            for i, char in enumerate(content[start_idx:]):
-                if char == "{":
-                    brace_count += 1
-                elif char == "}":
-                    brace_count -= 1
-                    
-                if brace_count == 0:
-                    json_str = content[start_idx:start_idx + i + 1]
-                    try:
-                        parsed = json.loads(json_str)
-                        if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
-                            calls.append(parsed)
-                    except json.JSONDecodeError:
-                        pass
-                    # Jump past this object
-                    start_idx = start_idx + i + 1
-                    break
-            else:
-                # If we exit the loop without break, braces were unbalanced. Just break the while.
-                break
-        except ValueError:
-            break
+async def chat(
+    user_message: str,
+    conversation_history: list[dict],
+    max_tool_iterations: int = 5,
+) -> tuple[str, list[dict]]:
+    """Process a user message, potentially calling tools, and return a response.
 
-    return calls
+    Returns:
+        (assistant_reply, updated_conversation_history)
+    """
+    async for event in _run_agent(user_message, conversation_history, max_tool_iterations, stream=False):
+        if event["type"] == "done":
+            return event["reply"], event["history"]
+    return "İşlem tamamlandı.", conversation_history
 
 
-def _clean_response(content: str) -> str:
-    """Remove thinking tags and tool_call blocks from the response."""
-    content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL)
-    content = re.sub(r"```(?:json|tool_call)?.*?```", "", content, flags=re.DOTALL)
-    
-    # Robust raw JSON removal using the same brace counting
-    start_idx = 0
-    cleaned_content = []
-    
-    while True:
-        try:
-            next_brace = content.index("{", start_idx)
-            # Append anything before the brace
-            cleaned_content.append(content[start_idx:next_brace])
-            
-            brace_count = 0
-            found_object = False
-            for i, char in enumerate(content[next_brace:]):
-                if char == "{":
-                    brace_count += 1
-                elif char == "}":
-                    brace_count -= 1
-                    
-                if brace_count == 0:
-                    json_str = content[next_brace:next_brace + i + 1]
-                    try:
-                        parsed = json.loads(json_str)
-                        if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
-                            # It's a tool call, skip adding it
-                            found_object = True
-                            start_idx = next_brace + i + 1
-                            break
-                    except json.JSONDecodeError:
-                        pass
-                    # Not a valid tool call, keep it
-                    break
-            
-            if not found_object:
-                # Add the `{` and move on
-                cleaned_content.append("{")
-                start_idx = next_brace + 1
-                
-        except ValueError:
-            # No more braces
-            cleaned_content.append(content[start_idx:])
-            break
-            
-    return "".join(cleaned_content).strip()
+async def chat_stream(
+    user_message: str,
+    conversation_history: list[dict],
+    max_tool_iterations: int = 5,
+) -> AsyncIterator[dict]:
+    """Like ``chat`` but streams the reply token by token.
+
+    Yields ``token`` / ``reset`` / ``tool`` events while the agent works and a
+    final ``done`` event carrying ``reply`` and the updated ``history``.
+    """
+    async for event in _run_agent(user_message, conversation_history, max_tool_iterations, stream=True):
+        yield event
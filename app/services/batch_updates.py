@@ -0,0 +1,117 @@
+"""Coalesces the Docs/Slides edits of one agent turn into single batchUpdates.
+
+When the model asks for several edits to the same document in one turn
+(three ``docs_append_text`` calls, a ``slides_add_slide`` followed by
+``slides_add_text`` ...), each would be its own ``batchUpdate`` round trip.
+``coalesce()`` merges them into one ``docs_batch_update`` /
+``slides_batch_update`` call per document, ``apply()`` executes it through
+``DocumentBatch`` / ``PresentationBatch``, and ``expand()`` hands every
+original call its own result again.
+"""
+
+from app.services import google_docs, google_slides
+from app.services.tool_executor import resource_key
+
+# Tool -> (merged tool, argument naming the document)
+COALESCIBLE = {
+    "docs_append_text": ("docs_batch_update", "document_id"),
+    "docs_find_replace": ("docs_batch_update", "document_id"),
+    "slides_add_slide": ("slides_batch_update", "presentation_id"),
+    "slides_add_text": ("slides_batch_update", "presentation_id"),
+}
+
+
+def coalesce(calls: list[dict]) -> tuple[list[dict], list[list[int]]]:
+    """Merge coalescible calls on the same document.
+
+    Returns ``(merged_calls, groups)`` where ``groups[i]`` lists the indices
+    of the original calls that ``merged_calls[i]`` stands for. A merged call
+    takes the place of its first member; any other call touching the same
+    document ends the group, so nothing is reordered around it.
+    """
+    merged: list[dict] = []
+    groups: list[list[int]] = []
+    open_group: dict[str, int] = {}
+
+    for i, call in enumerate(calls):
+        tool = call.get("tool")
+        key = resource_key(call)
+        if tool in COALESCIBLE and key:
+            batch_tool, id_arg = COALESCIBLE[tool]
+            if key in open_group:
+                slot = open_group[key]
+                if merged[slot]["tool"] != batch_tool:
+                    merged[slot] = {
+                        "tool": batch_tool,
+                        "args": {id_arg: call["args"][id_arg], "calls": [calls[j] for j in groups[slot]]},
+                    }
+                merged[slot]["args"]["calls"].append(call)
+                groups[slot].append(i)
+                continue
+            open_group[key] = len(merged)
+        elif key:
+            open_group.pop(key, None)
+        merged.append(call)
+        groups.append([i])
+    return merged, groups
+
+
+def expand(results: list[dict], groups: list[list[int]], count: int) -> list[dict]:
+    """Map the results of ``coalesce``'d calls back onto the original calls."""
+    expanded: list[dict] = [{}] * count
+    for result, group in zip(results, groups):
+        if len(group) == 1:
+            expanded[group[0]] = result
+        elif "error" in result:
+            for i in group:
+                expanded[i] = result
+        else:
+            for i, member in zip(group, result["result"]):
+                expanded[i] = {"result": member}
+    return expanded
+
+
+def _apply_docs(document_id: str, calls: list[dict]) -> list[dict]:
+    batch = google_docs.DocumentBatch(document_id)
+    positions = []
+    for call in calls:
+        args = call["args"]
+        if call["tool"] == "docs_append_text":
+            positions.append(batch.append_text(args["text"]))
+        else:
+            positions.append(batch.replace_all_text(args["find"], args["replace"]))
+    replies = batch.flush()
+
+    results = []
+    for call, position in zip(calls, positions):
+        if call["tool"] == "docs_append_text":
+            results.append({"status": "success", "documentId": document_id})
+        else:
+            reply = replies[position] if position < len(replies) else {}
+            results.append({
+                "status": "success",
+                "occurrencesChanged": reply.get("replaceAllText", {}).get("occurrencesChanged", 0),
+            })
+    return results
+
+
+def _apply_slides(presentation_id: str, calls: list[dict]) -> list[dict]:
+    batch = google_slides.PresentationBatch(presentation_id)
+    results = []
+    for call in calls:
+        args = call["args"]
+        if call["tool"] == "slides_add_slide":
+            slide_id = batch.create_slide(args.get("layout", "BLANK"))
+            results.append({"status": "success", "slideId": slide_id, "presentationId": presentation_id})
+        else:
+            element_id = batch.add_text_box(args["slide_id"], args["text"])
+            results.append({"status": "success", "elementId": element_id, "presentationId": presentation_id})
+    batch.flush()
+    return results
+
+
+def apply(name: str, args: dict) -> list[dict]:
+    """Execute a merged call (blocking); one result per member call."""
+    if name == "docs_batch_update":
+        return _apply_docs(args["document_id"], args["calls"])
+    return _apply_slides(args["presentation_id"], args["calls"])
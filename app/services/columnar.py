@@ -0,0 +1,311 @@
+"""Column-typed tables for spreadsheet data.
+
+The Sheets API returns rows as nested lists of mixed values. ``ColumnTable``
+turns them into one NumPy array per column with an inferred type – float64
+for numbers (NaN for blanks), bool, or object for text – so large budget
+sheets can be filtered and aggregated without per-cell Python work and
+without every number travelling as a string. ``query()`` does exactly that:
+filter, group-by and aggregates computed locally, returning only the result.
+
+Columns are named by their header, ignoring case, or by their A1 letter as
+seen in the sheet (``"C"`` is the third column of ``A1:Z``, the second of
+``B1:Z``). A header that reads like a letter wins over the letter.
+"""
+
+import math
+import re
+from typing import Any, Optional
+
+import numpy as np
+
+# Numbers as text without any separator: "12", "-3". "1,500" or "1.500" may
+# be a thousand or one and a half depending on the locale, so they stay text.
+_NUMERIC_TEXT = re.compile(r"^-?\d+$")
+# A column letter, and the first column of an A1 range ("'Q1'!B2:F" -> "B")
+_COLUMN_LETTER = re.compile(r"^[A-Za-z]{1,3}$")
+_RANGE_START = re.compile(r"^\$?([A-Za-z]{1,3})")
+
+
+def parse_number(value: Any) -> Optional[float]:
+    """``value`` as a float if it is a number or unambiguous numeric text, else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and _NUMERIC_TEXT.match(value.strip()):
+        return float(value.strip())
+    return None
+
+
+def _infer_column(cells: list) -> tuple[str, np.ndarray]:
+    """Return ``(type_name, array)`` for one column of raw cell values."""
+    filled = [c for c in cells if c not in ("", None)]
+    if filled and all(isinstance(c, bool) for c in filled) and len(filled) == len(cells):
+        return "boolean", np.array(cells, dtype=bool)
+
+    numbers = [parse_number(c) for c in filled]
+    if filled and all(n is not None for n in numbers):
+        array = np.array([math.nan if c in ("", None) else parse_number(c) for c in cells], dtype=np.float64)
+        return "number", array
+
+    return "string", np.array([None if c in ("", None) else str(c) for c in cells], dtype=object)
+
+
+def _letter_index(letters: str) -> int:
+    """Zero-based index of an A1 column letter ("A" -> 0, "AA" -> 26)."""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
+
+
+class ColumnTable:
+    """A rectangular table stored column by column as typed NumPy arrays."""
+
+    def __init__(self, names: list[str], columns: list[np.ndarray], types: list[str], range_name: str = ""):
+        self.names = names
+        self.columns = dict(zip(names, columns))
+        self.types = dict(zip(names, types))
+        self.range = range_name
+        self.row_count = len(columns[0]) if columns else 0
+
+    @classmethod
+    def from_values(cls, values: list[list], header: bool = True, range_name: str = "") -> "ColumnTable":
+        """Build from Sheets ``values`` (first row as column names if ``header``)."""
+        if not values:
+            return cls([], [], [], range_name)
+        head = values[0] if header else []
+        rows = values[1:] if header else values
+        width = max([len(head)] + [len(r) for r in rows]) if rows or head else 0
+
+        names, seen = [], set()
+        for i in range(width):
+            name = str(head[i]).strip() if i < len(head) and str(head[i]).strip() else f"#{i + 1}"
+            while name in seen:
+                name += "_"
+            seen.add(name)
+            names.append(name)
+
+        columns, types = [], []
+        for i in range(width):
+            kind, array = _infer_column([r[i] if i < len(r) else "" for r in rows])
+            columns.append(array)
+            types.append(kind)
+        return cls(names, columns, types, range_name)
+
+    def resolve(self, name: str) -> str:
+        """The column called ``name``: a header (any case) or an A1 column letter."""
+        name = str(name).strip()
+        if name in self.columns:
+            return name
+        folded = name.casefold()
+        for candidate in self.names:
+            if candidate.casefold() == folded:
+                return candidate
+        if _COLUMN_LETTER.match(name):
+            start = _RANGE_START.match(self.range.rsplit("!", 1)[-1])
+            index = _letter_index(name) - (_letter_index(start.group(1)) if start else 0)
+            if 0 <= index < len(self.names):
+                return self.names[index]
+        raise ValueError(f"Sütun bulunamadı: {name}. Mevcut sütunlar: {', '.join(self.names)}")
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[self.resolve(name)]
+
+    def type_of(self, name: str) -> str:
+        return self.types[self.resolve(name)]
+
+    def to_dict(self, limit: Optional[int] = None) -> dict:
+        """JSON-friendly form (NaN and blanks become ``None``)."""
+        def plain(array: np.ndarray, kind: str) -> list:
+            values = array[:limit].tolist()
+            if kind == "number":
+                return [None if math.isnan(v) else int(v) if v.is_integer() else v for v in values]
+            return values
+
+        return {
+            "range": self.range,
+            "rowCount": self.row_count,
+            "columns": [
+                {"name": name, "type": self.types[name], "values": plain(self.columns[name], self.types[name])}
+                for name in self.names
+            ],
+        }
+
+
+# ---------------------------------------------------------------------------
+# Filtering and aggregation
+# ---------------------------------------------------------------------------
+
+AGGREGATES = ("count", "sum", "avg", "min", "max", "median")
+OPERATORS = ("=", "!=", ">", ">=", "<", "<=", "contains", "in")
+
+
+def _filter_mask(table: ColumnTable, condition: dict) -> np.ndarray:
+    column = table.column(condition["column"])
+    op = condition.get("op", "=")
+    value = condition.get("value")
+    if op not in OPERATORS:
+        raise ValueError(f"Geçersiz operatör: {op}. Geçerli: {', '.join(OPERATORS)}")
+
+    if table.type_of(condition["column"]) == "number" and op != "contains":
+        if op == "in":
+            targets = [parse_number(v) for v in (value or [])]
+            return np.isin(column, [t for t in targets if t is not None])
+        target = parse_number(value)
+        if target is None:
+            raise ValueError(f"'{condition['column']}' sayısal bir sütun; karşılaştırma değeri sayı olmalı.")
+        with np.errstate(invalid="ignore"):
+            return {
+                "=": column == target,
+                "!=": column != target,
+                ">": column > target,
+                ">=": column >= target,
+                "<": column < target,
+                "<=": column <= target,
+            }[op]
+
+    # Text (and booleans): case-insensitive comparison on the string form
+    text = np.array([("" if v is None else str(v)).casefold() for v in column.tolist()], dtype=object)
+    if op == "in":
+        return np.isin(text, [str(v).casefold() for v in (value or [])])
+    target = str(value).casefold()
+    if op == "contains":
+        return np.array([target in v for v in text], dtype=bool)
+    if op in ("=", "!="):
+        mask = text == target
+        return mask if op == "=" else ~mask
+    return {">": text > target, ">=": text >= target, "<": text < target, "<=": text <= target}[op].astype(bool)
+
+
+def _group_codes(table: ColumnTable, group_by: list[str], mask: np.ndarray) -> tuple[list[tuple], np.ndarray]:
+    """Distinct key tuples and, per selected row, the index of its group."""
+    if not group_by:
+        return [()], np.zeros(int(mask.sum()), dtype=np.int64)
+    codes, uniques = [], []
+    for name in group_by:
+        values = np.array(["" if v is None else str(v) for v in table.column(name)[mask].tolist()], dtype=object)
+        unique, inverse = np.unique(values.astype(str), return_inverse=True)
+        uniques.append(unique)
+        codes.append(inverse)
+    stacked = np.stack(codes, axis=1)
+    keys, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    return [tuple(uniques[c][k] for c, k in enumerate(key)) for key in keys], inverse.reshape(-1)
+
+
+def _aggregate(func: str, values: Optional[np.ndarray], inverse: np.ndarray, groups: int) -> np.ndarray:
+    if func == "count":
+        if values is None:
+            return np.bincount(inverse, minlength=groups).astype(np.float64)
+        present = ~np.isnan(values)
+        return np.bincount(inverse[present], minlength=groups).astype(np.float64)
+
+    present = ~np.isnan(values)
+    idx, data = inverse[present], values[present]
+    counts = np.bincount(idx, minlength=groups)
+    if func in ("sum", "avg"):
+        sums = np.bincount(idx, weights=data, minlength=groups)
+        if func == "sum":
+            return sums
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    if func in ("min", "max"):
+        out = np.full(groups, np.inf if func == "min" else -np.inf)
+        (np.minimum if func == "min" else np.maximum).at(out, idx, data)
+        out[counts == 0] = np.nan
+        return out
+    # median: sort once by (group, value) and pick the middle of each run
+    order = np.lexsort((data, idx))
+    sorted_idx, sorted_data = idx[order], data[order]
+    starts = np.searchsorted(sorted_idx, np.arange(groups))
+    out = np.full(groups, np.nan)
+    for g in np.nonzero(counts)[0]:
+        run = sorted_data[starts[g]:starts[g] + counts[g]]
+        out[g] = np.median(run)
+    return out
+
+
+def _plain_number(value: float):
+    if np.isnan(value):
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 6)
+
+
+def _order_field(table: ColumnTable, order_by: str, fields: list[str]) -> str:
+    """The result field ``order_by`` names: a group column or ``func(column)``, as in ``resolve``."""
+    match = re.match(r"^\s*(\w+)\s*\((.*)\)\s*$", order_by)
+    try:
+        if match:
+            field = f"{match.group(1).lower()}({table.resolve(match.group(2))})"
+        elif order_by.strip().lower() in AGGREGATES:
+            field = order_by.strip().lower()
+        else:
+            field = table.resolve(order_by)
+    except ValueError:
+        field = None
+    if field not in fields:
+        raise ValueError(f"Sıralama alanı bulunamadı: {order_by}. Geçerli: {', '.join(fields)}")
+    return field
+
+
+def query(
+    table: ColumnTable,
+    filters: Optional[list[dict]] = None,
+    group_by: Optional[list[str]] = None,
+    aggregates: Optional[list[dict]] = None,
+    order_by: Optional[str] = None,
+    descending: bool = True,
+    limit: int = 50,
+) -> dict:
+    """Filter ``table``, group it and aggregate columns, all vectorised.
+
+    ``filters`` are ``{"column", "op", "value"}`` conditions combined with
+    AND; ``aggregates`` are ``{"column", "func"}`` (``column`` may be omitted
+    for ``count``). Columns are resolved with ``ColumnTable.resolve`` and
+    appear under their header in the result. Returns the aggregate rows
+    only, never the raw data.
+    """
+    mask = np.ones(table.row_count, dtype=bool)
+    for condition in filters or []:
+        mask &= _filter_mask(table, condition)
+
+    group_by = [table.resolve(name) for name in group_by or []]
+    aggregates = aggregates or [{"func": "count"}]
+    keys, inverse = _group_codes(table, group_by, mask)
+
+    results = {}
+    for spec in aggregates:
+        func = spec.get("func", "count")
+        if func not in AGGREGATES:
+            raise ValueError(f"Geçersiz fonksiyon: {func}. Geçerli: {', '.join(AGGREGATES)}")
+        name = spec.get("column")
+        values = None
+        if name is not None:
+            name = table.resolve(name)
+            if table.types[name] != "number" and func != "count":
+                raise ValueError(f"'{name}' sayısal bir sütun değil; {func} uygulanamaz.")
+            column = table.column(name)[mask]
+            values = column if table.types[name] == "number" else np.array(
+                [np.nan if v is None else 0.0 for v in column.tolist()], dtype=np.float64
+            )
+        label = f"{func}({name})" if name else func
+        results[label] = _aggregate(func, values, inverse, len(keys))
+
+    rows = []
+    for g, key in enumerate(keys):
+        row = dict(zip(group_by, key))
+        row.update({label: _plain_number(values[g]) for label, values in results.items()})
+        rows.append(row)
+
+    if order_by and rows:
+        order_by = _order_field(table, order_by, list(rows[0]))
+        present = sorted((r for r in rows if r[order_by] is not None), key=lambda r: r[order_by], reverse=descending)
+        rows = present + [r for r in rows if r[order_by] is None]
+
+    return {
+        "rowsScanned": table.row_count,
+        "rowsMatched": int(mask.sum()),
+        "groupCount": len(rows),
+        "rows": rows[:limit],
+    }
@@ -0,0 +1,409 @@
+"""Full-text index over the contents of Docs, Sheets and Slides.
+
+The text that ``google_docs.read_document``, ``google_sheets.read_range`` and
+``google_slides.get_presentation`` produce is split into passages (paragraph
+groups, row blocks, single slides) and stored in a SQLite FTS5 table ranked
+with BM25. ``search()`` returns the best passages, so content questions
+("what did my notes say about X") no longer need whole documents in the LLM
+context.
+
+Files to (re-)index come from the Drive metadata index: a file is read again
+only when its ``modifiedTime`` differs from the one it was indexed at.
+``refresh()`` works through them within a time budget, and
+``python -m app.services.content_index --user <id>`` builds a user's whole
+index offline. Like the Drive index, every user has a database of their own.
+
+When CONTENT_INDEX_EMBEDDINGS_MODEL names a sentence-transformers model (and
+the package is installed) passages are also embedded locally and results are
+the reciprocal-rank fusion of BM25 and cosine similarity.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.services import drive_index, google_docs, google_sheets, google_slides, users
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = settings.CONTENT_INDEX_PATH or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "content_index.db"
+)
+
+DOC_MIME = "application/vnd.google-apps.document"
+SHEET_MIME = "application/vnd.google-apps.spreadsheet"
+SLIDES_MIME = "application/vnd.google-apps.presentation"
+INDEXED_TYPES = (DOC_MIME, SHEET_MIME, SLIDES_MIME)
+
+# Rows per passage for spreadsheets (the header row is repeated in each)
+_SHEET_ROWS_PER_PASSAGE = 25
+# Constant of the reciprocal-rank fusion
+_RRF_K = 60
+# A file that failed to index is retried once it changes, or after this many
+# seconds (the failure may have been transient)
+_RETRY_FAILED_AFTER = 24 * 3600
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_id TEXT PRIMARY KEY,
+    title TEXT,
+    mime_type TEXT,
+    modified_time TEXT,
+    link TEXT,
+    indexed_at REAL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+    file_id UNINDEXED,
+    location UNINDEXED,
+    title,
+    text,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    passage_id INTEGER PRIMARY KEY,
+    file_id TEXT,
+    vector BLOB
+);
+CREATE INDEX IF NOT EXISTS embeddings_file ON embeddings (file_id);
+CREATE TABLE IF NOT EXISTS failures (
+    file_id TEXT PRIMARY KEY,
+    modified_time TEXT,
+    failed_at REAL
+);
+"""
+
+# Keyed by database path, i.e. by user; least recently used first
+_conns: "OrderedDict[str, sqlite3.Connection]" = OrderedDict()
+_refresh_locks: dict[str, threading.Lock] = {}
+_lock = threading.RLock()
+_encoder = None
+_encoder_unavailable = False
+
+
+def _db() -> sqlite3.Connection:
+    path = users.scoped_path(INDEX_PATH)
+    with _lock:
+        conn = _conns.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            _conns[path] = conn
+        _conns.move_to_end(path)
+        while len(_conns) > settings.INDEX_CACHE_SIZE:
+            # Closed once the last caller still using it lets go
+            _conns.popitem(last=False)
+    return conn
+
+
+def _get_encoder():
+    """The local embedding model, or None when embeddings are disabled/unavailable."""
+    global _encoder, _encoder_unavailable
+    if not settings.CONTENT_INDEX_EMBEDDINGS_MODEL or _encoder_unavailable:
+        return None
+    if _encoder is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logger.warning("sentence-transformers is not installed; content search uses BM25 only")
+            _encoder_unavailable = True
+            return None
+        _encoder = SentenceTransformer(settings.CONTENT_INDEX_EMBEDDINGS_MODEL)
+    return _encoder
+
+
+# ---------------------------------------------------------------------------
+# Text extraction
+# ---------------------------------------------------------------------------
+
+def _split_text(text: str, size: int) -> list[tuple[str, str]]:
+    """Group paragraphs into passages of about ``size`` characters."""
+    passages = []
+    current, start, last = [], 1, 1
+    length = 0
+    for number, paragraph in enumerate(text.split("\n"), 1):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and length + len(paragraph) > size:
+            passages.append((f"Paragraf {start}-{last}", "\n".join(current)))
+            current, length = [], 0
+        if not current:
+            start = number
+        last = number
+        # A single very long paragraph is cut into pieces
+        while len(paragraph) > size:
+            passages.append((f"Paragraf {number}", paragraph[:size]))
+            paragraph = paragraph[size:]
+        current.append(paragraph)
+        length += len(paragraph)
+    if current:
+        passages.append((f"Paragraf {start}-{last}", "\n".join(current)))
+    return passages
+
+
+def _doc_passages(file_id: str) -> list[tuple[str, str]]:
+    doc = google_docs.read_document(file_id)
+    return _split_text(doc["content"], settings.CONTENT_INDEX_PASSAGE_CHARS)
+
+
+def _slides_passages(file_id: str) -> list[tuple[str, str]]:
+    deck = google_slides.get_presentation(file_id)
+    passages = []
+    for number, slide in enumerate(deck["slides"], 1):
+        text = "\n".join(e["content"] for e in slide["elements"] if e.get("content"))
+        if text:
+            passages.append((f"Slayt {number}", text))
+    return passages
+
+
+def _sheet_passages(file_id: str) -> list[tuple[str, str]]:
+    passages = []
+    for sheet in google_sheets.get_sheet_info(file_id)["sheets"]:
+        title = sheet["title"].replace("'", "''")
+        values = google_sheets.read_range(file_id, f"'{title}'!A1:Z1000")["values"]
+        if not values:
+            continue
+        header, rows = values[0], values[1:] or [[]]
+        for start in range(0, len(rows), _SHEET_ROWS_PER_PASSAGE):
+            block = [header] + rows[start:start + _SHEET_ROWS_PER_PASSAGE]
+            text = "\n".join("\t".join(str(c) for c in row) for row in block)
+            end = min(start + _SHEET_ROWS_PER_PASSAGE, len(rows)) + 1
+            passages.append((f"{sheet['title']} satır {start + 2}-{end}", text))
+    return passages
+
+
+_EXTRACTORS = {
+    DOC_MIME: _doc_passages,
+    SHEET_MIME: _sheet_passages,
+    SLIDES_MIME: _slides_passages,
+}
+
+
+# ---------------------------------------------------------------------------
+# Indexing
+# ---------------------------------------------------------------------------
+
+def _delete(conn: sqlite3.Connection, file_id: str):
+    conn.execute("DELETE FROM failures WHERE file_id = ?", (file_id,))
+    conn.execute("DELETE FROM passages WHERE file_id = ?", (file_id,))
+    conn.execute("DELETE FROM embeddings WHERE file_id = ?", (file_id,))
+    conn.execute("DELETE FROM documents WHERE file_id = ?", (file_id,))
+
+
+def index_file(item: dict):
+    """(Re-)index one file from the Drive index (blocking)."""
+    passages = _EXTRACTORS[item["mimeType"]](item["id"])
+    encoder = _get_encoder()
+    vectors = None
+    if encoder is not None and passages:
+        vectors = encoder.encode([text for _, text in passages], normalize_embeddings=True)
+
+    with _lock:
+        conn = _db()
+        with conn:
+            _delete(conn, item["id"])
+            conn.execute(
+                "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                (item["id"], item["name"], item["mimeType"], item["modifiedTime"], item.get("webViewLink"), time.time()),
+            )
+            for i, (location, text) in enumerate(passages):
+                cursor = conn.execute(
+                    "INSERT INTO passages (file_id, location, title, text) VALUES (?, ?, ?, ?)",
+                    (item["id"], location, item["name"], text),
+                )
+                if vectors is not None:
+                    conn.execute(
+                        "INSERT INTO embeddings VALUES (?, ?, ?)",
+                        (cursor.lastrowid, item["id"], vectors[i].astype("float32").tobytes()),
+                    )
+
+
+def _record_failure(item: dict):
+    with _lock:
+        conn = _db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?)", (item["id"], item["modifiedTime"], time.time())
+            )
+
+
+def pending() -> list[dict]:
+    """Drive files whose indexed copy is missing or older than ``modifiedTime``.
+
+    Files that failed to index in their current version are left out until
+    ``_RETRY_FAILED_AFTER`` has passed.
+    """
+    with _lock:
+        conn = _db()
+        indexed = dict(conn.execute("SELECT file_id, modified_time FROM documents").fetchall())
+        failed = dict(conn.execute(
+            "SELECT file_id, modified_time FROM failures WHERE failed_at > ?", (time.time() - _RETRY_FAILED_AFTER,)
+        ).fetchall())
+    return [
+        f for f in drive_index.files_of_types(INDEXED_TYPES)
+        if indexed.get(f["id"]) != f["modifiedTime"] and failed.get(f["id"]) != f["modifiedTime"]
+    ]
+
+
+def refresh(time_budget: Optional[float] = None) -> dict:
+    """Bring the index up to date with the Drive index (blocking).
+
+    Stops starting new files once ``time_budget`` seconds have passed
+    (``None`` for no limit) and reports how many were left.
+    """
+    deadline = time.monotonic() + time_budget if time_budget else None
+    indexed = failed = 0
+    with _lock:
+        refresh_lock = _refresh_locks.setdefault(users.scoped_path(INDEX_PATH), threading.Lock())
+    with refresh_lock:
+        current = {f["id"] for f in drive_index.files_of_types(INDEXED_TYPES)}
+        with _lock:
+            conn = _db()
+            known = [row[0] for row in conn.execute("SELECT file_id FROM documents UNION SELECT file_id FROM failures")]
+            with conn:
+                for file_id in known:
+                    if file_id not in current:
+                        _delete(conn, file_id)
+
+        todo = sorted(pending(), key=lambda f: f["modifiedTime"] or "", reverse=True)
+        for item in todo:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            try:
+                index_file(item)
+                indexed += 1
+            except Exception as e:
+                failed += 1
+                _record_failure(item)
+                logger.warning("Could not index %s (%s), skipped until it changes: %s", item["name"], item["id"], e)
+    left = len(todo) - indexed - failed
+    if indexed:
+        logger.info("Content index: %d files indexed, %d left", indexed, left)
+    return {"indexed": indexed, "failed": failed, "pending": left}
+
+
+def reset():
+    """Forget the index (e.g. when the Google account changes)."""
+    with _lock:
+        conn = _db()
+        with conn:
+            conn.execute("DELETE FROM passages")
+            conn.execute("DELETE FROM embeddings")
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM failures")
+
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+
+def _fts_query(query: str) -> str:
+    """Match any of the query's words (quoted, so FTS5 syntax cannot leak in)."""
+    return " OR ".join(f'"{word}"' for word in _WORD.findall(query))
+
+
+def _bm25(query: str, limit: int) -> list[int]:
+    match = _fts_query(query)
+    if not match:
+        return []
+    with _lock:
+        rows = _db().execute(
+            # Title hits weigh more than body hits
+            "SELECT rowid FROM passages WHERE passages MATCH ? ORDER BY bm25(passages, 0, 0, 3.0, 1.0) LIMIT ?",
+            (match, limit),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _semantic(query: str, limit: int) -> list[int]:
+    encoder = _get_encoder()
+    if encoder is None:
+        return []
+    import numpy as np
+
+    with _lock:
+        rows = _db().execute("SELECT passage_id, vector FROM embeddings").fetchall()
+    if not rows:
+        return []
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype="float32").reshape(len(rows), -1)
+    scores = matrix @ encoder.encode([query], normalize_embeddings=True)[0]
+    best = np.argsort(-scores)[:limit]
+    return [rows[i][0] for i in best]
+
+
+def search(query: str, limit: int = 5) -> list[dict]:
+    """Return the ``limit`` best passages for ``query``."""
+    lexical = _bm25(query, limit * 4)
+    semantic = _semantic(query, limit * 4)
+    if semantic:
+        fused: dict[int, float] = {}
+        for ranking in (lexical, semantic):
+            for rank, passage_id in enumerate(ranking):
+                fused[passage_id] = fused.get(passage_id, 0.0) + 1.0 / (_RRF_K + rank + 1)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:limit]
+    else:
+        ranked = lexical[:limit]
+    if not ranked:
+        return []
+
+    marks = ", ".join("?" * len(ranked))
+    with _lock:
+        rows = _db().execute(
+            f"""
+            SELECT p.rowid AS id, p.location, p.text, d.file_id, d.title, d.mime_type, d.link, d.modified_time
+            FROM passages p JOIN documents d ON d.file_id = p.file_id
+            WHERE p.rowid IN ({marks})
+            """,
+            ranked,
+        ).fetchall()
+    by_id = {row["id"]: row for row in rows}
+    return [
+        {
+            "fileId": row["file_id"],
+            "title": row["title"],
+            "mimeType": row["mime_type"],
+            "location": row["location"],
+            "passage": row["text"],
+            "link": row["link"],
+            "modifiedTime": row["modified_time"],
+        }
+        for row in (by_id[i] for i in ranked if i in by_id)
+    ]
+
+
+def get_stats() -> dict:
+    """Index state of the current user; empty without a user or an index on disk."""
+    if users.current_user() is None or not os.path.exists(users.scoped_path(INDEX_PATH)):
+        return {"documents": 0, "passages": 0, "failed": 0, "embeddings": _encoder is not None}
+    with _lock:
+        conn = _db()
+        documents = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        passages = conn.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+        failures = conn.execute("SELECT COUNT(*) FROM failures").fetchone()[0]
+    return {"documents": documents, "passages": passages, "failed": failures, "embeddings": _encoder is not None}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the workspace content index offline.")
+    parser.add_argument("--user", required=True, help="user id to index for (the berrai_user cookie up to the dot)")
+    parser.add_argument("--rebuild", action="store_true", help="drop the existing index first")
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    users.set_current_user(cli_args.user)
+    if cli_args.rebuild:
+        reset()
+    drive_index.sync(force=True)
+    print(refresh())
@@ -0,0 +1,423 @@
+"""Local Drive metadata index – answers file-name searches without a round trip.
+
+File metadata (id, name, mimeType, parents, modifiedTime, ...) is mirrored in
+a small SQLite database. The first sync lists the whole Drive in a background
+thread (``ensure_fresh`` raises ``IndexNotReady`` until it is done, so callers
+can search remotely meanwhile); after that the index is kept current
+incrementally with ``changes.list`` and the saved page token, which only
+returns what changed since the previous sync. Searches are answered locally
+(exact, prefix, substring and fuzzy name matches) and only trigger a sync
+when the index is older than DRIVE_INDEX_MAX_AGE seconds.
+
+For fuzzy matches each name and each word of it is a key, and the keys are
+indexed by their character bigrams as files are synced, so a typo search
+only compares the needle with the few keys that share most bigrams with it.
+
+Every user has a database of their own (``users.scoped_path``); all
+functions act on the current user's index.
+"""
+
+import contextvars
+import difflib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.services import google_drive, users
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = settings.DRIVE_INDEX_PATH or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "drive_index.db"
+)
+
+# Fields mirrored for each file (a superset of google_drive.FILE_FIELDS)
+_INDEX_FIELDS = google_drive.FILE_FIELDS + ("parents", "trashed")
+_CHANGES_FIELDS = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({', '.join(_INDEX_FIELDS)}))"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    mime_type TEXT,
+    parents TEXT,
+    modified_time TEXT,
+    size TEXT,
+    web_view_link TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name_lower ON files (name_lower);
+CREATE INDEX IF NOT EXISTS files_modified ON files (modified_time);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS file_keys (
+    key TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (key, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS file_keys_file ON file_keys (file_id);
+CREATE TABLE IF NOT EXISTS key_grams (
+    gram TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (gram, key)
+) WITHOUT ROWID;
+"""
+
+# Keys compared with difflib per fuzzy search, best bigram overlap first
+_FUZZY_CANDIDATES = 200
+
+
+class IndexNotReady(Exception):
+    """The first full sync of the user's Drive is still running."""
+
+# Keyed by database path, i.e. by user; least recently used first
+_conns: "OrderedDict[str, sqlite3.Connection]" = OrderedDict()
+_sync_locks: dict[str, threading.Lock] = {}
+_stale: set[str] = set()
+# Database paths whose first full sync runs in the background
+_building: set[str] = set()
+_lock = threading.RLock()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _db() -> sqlite3.Connection:
+    path = users.scoped_path(INDEX_PATH)
+    with _lock:
+        conn = _conns.get(path)
+        if conn is None:
+            conn = _connect(path)
+            if conn.execute("SELECT 1 FROM files").fetchone() and not conn.execute("SELECT 1 FROM file_keys").fetchone():
+                # Index built before name keys existed
+                with conn:
+                    _index_names(conn, conn.execute("SELECT id, name_lower FROM files").fetchall())
+            _conns[path] = conn
+        _conns.move_to_end(path)
+        while len(_conns) > settings.INDEX_CACHE_SIZE:
+            # Closed once the last caller still using it lets go
+            _conns.popitem(last=False)
+    return conn
+
+
+def _get_meta(key: str) -> Optional[str]:
+    with _lock:
+        row = _db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def _row(item: dict) -> tuple:
+    return (
+        item["id"],
+        item.get("name", ""),
+        item.get("name", "").lower(),
+        item.get("mimeType"),
+        json.dumps(item.get("parents", [])),
+        item.get("modifiedTime"),
+        item.get("size"),
+        item.get("webViewLink"),
+    )
+
+
+def _name_keys(name_lower: str) -> set[str]:
+    """What fuzzy search compares a name by: the whole name and each of its words."""
+    keys = set(name_lower.replace("_", " ").replace("-", " ").split())
+    keys.add(name_lower)
+    return keys
+
+
+def _grams(key: str) -> set[str]:
+    padded = f" {key} "
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def _index_names(conn: sqlite3.Connection, files: list[tuple[str, str]]):
+    """Record the name keys of ``(id, name_lower)`` pairs and the bigrams of new keys."""
+    conn.executemany("DELETE FROM file_keys WHERE file_id = ?", [(file_id,) for file_id, _ in files])
+    pairs = [(key, file_id) for file_id, name_lower in files for key in _name_keys(name_lower)]
+    conn.executemany("INSERT OR IGNORE INTO file_keys VALUES (?, ?)", pairs)
+    keys = {key for key, _ in pairs}
+    conn.executemany("INSERT OR IGNORE INTO key_grams VALUES (?, ?)", [(g, key) for key in keys for g in _grams(key)])
+
+
+def _upsert(conn: sqlite3.Connection, items: list[dict]):
+    rows = [_row(i) for i in items]
+    conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    _index_names(conn, [(row[0], row[2]) for row in rows])
+
+
+def _as_file(row: sqlite3.Row, match: str) -> dict:
+    item = {
+        "id": row["id"],
+        "name": row["name"],
+        "mimeType": row["mime_type"],
+        "modifiedTime": row["modified_time"],
+        "webViewLink": row["web_view_link"],
+        "parents": json.loads(row["parents"] or "[]"),
+        "match": match,
+    }
+    if row["size"] is not None:
+        item["size"] = row["size"]
+    return item
+
+
+# ---------------------------------------------------------------------------
+# Sync
+# ---------------------------------------------------------------------------
+
+def _full_sync():
+    """List the whole Drive into a fresh index."""
+    service = google_drive._get_service()
+    # Take the token first so changes made during the listing are replayed
+    start_token = service.changes().getStartPageToken().execute()["startPageToken"]
+    listing = google_drive.iter_files(
+        "trashed = false",
+        fields=_INDEX_FIELDS,
+        max_results=10 ** 9,
+        time_budget=0,
+        page_size=1000,
+        order_by=None,
+    )
+    batch = []
+    # A connection of its own: searches keep reading the previous snapshot
+    # (WAL) instead of waiting for the listing to finish
+    conn = _connect(users.scoped_path(INDEX_PATH))
+    try:
+        with conn:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM file_keys")
+            conn.execute("DELETE FROM key_grams")
+            for item in listing:
+                batch.append(item)
+                if len(batch) >= 1000:
+                    _upsert(conn, batch)
+                    batch.clear()
+            _upsert(conn, batch)
+            _set_meta(conn, "page_token", start_token)
+            _set_meta(conn, "synced_at", str(time.time()))
+    finally:
+        conn.close()
+    logger.info("Drive index built: %d files in %d pages", count(), listing.pages)
+
+
+def _incremental_sync(page_token: str):
+    """Apply everything ``changes.list`` reports since ``page_token``."""
+    service = google_drive._get_service()
+    applied = 0
+    while True:
+        response = (
+            service.changes()
+            .list(pageToken=page_token, pageSize=1000, fields=_CHANGES_FIELDS)
+            .execute()
+        )
+        removed, updated = [], []
+        for change in response.get("changes", []):
+            item = change.get("file")
+            if change.get("removed") or item is None or item.get("trashed"):
+                removed.append((change["fileId"],))
+            else:
+                updated.append(item)
+        with _lock:
+            conn = _db()
+            with conn:
+                conn.executemany("DELETE FROM files WHERE id = ?", removed)
+                # Keys left without files are skipped by _fuzzy and dropped at the next full sync
+                conn.executemany("DELETE FROM file_keys WHERE file_id = ?", removed)
+                _upsert(conn, updated)
+                page_token = response.get("nextPageToken") or response["newStartPageToken"]
+                _set_meta(conn, "page_token", page_token)
+                if "newStartPageToken" in response:
+                    _set_meta(conn, "synced_at", str(time.time()))
+        applied += len(removed) + len(updated)
+        if "newStartPageToken" in response:
+            break
+    if applied:
+        logger.info("Drive index updated: %d changes", applied)
+
+
+def sync(force: bool = False):
+    """Bring the index up to date (blocking). Only one sync per user runs at a time."""
+    path = users.scoped_path(INDEX_PATH)
+    with _lock:
+        sync_lock = _sync_locks.setdefault(path, threading.Lock())
+    with sync_lock:
+        page_token = _get_meta("page_token")
+        if page_token is None:
+            _full_sync()
+        elif force or is_stale():
+            _incremental_sync(page_token)
+        _stale.discard(path)
+
+
+def is_stale() -> bool:
+    synced_at = _get_meta("synced_at")
+    if users.scoped_path(INDEX_PATH) in _stale or synced_at is None:
+        return True
+    return time.time() - float(synced_at) > settings.DRIVE_INDEX_MAX_AGE
+
+
+def mark_stale():
+    """Force a sync before the next search (after the agent changed Drive)."""
+    _stale.add(users.scoped_path(INDEX_PATH))
+
+
+def _build_in_background(path: str):
+    """Start the first full sync of the current user's index on a thread of its own."""
+    with _lock:
+        if path in _building:
+            return
+        _building.add(path)
+
+    def build():
+        try:
+            sync()
+        except Exception as e:
+            logger.warning("Building the Drive index failed: %s", e)
+        finally:
+            with _lock:
+                _building.discard(path)
+
+    # The thread works for the current user (the context carries the user id)
+    threading.Thread(target=contextvars.copy_context().run, args=(build,), daemon=True).start()
+
+
+def ensure_fresh():
+    """Sync the index if it is stale.
+
+    An index that was never built is listed in the background instead, and
+    ``IndexNotReady`` tells the caller to do without it for now.
+    """
+    if _get_meta("page_token") is None:
+        _build_in_background(users.scoped_path(INDEX_PATH))
+        raise IndexNotReady("Drive dizini hazırlanıyor.")
+    if is_stale():
+        sync()
+
+
+def reset():
+    """Forget the index (e.g. when the Google account changes)."""
+    with _lock:
+        conn = _db()
+        with conn:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM file_keys")
+            conn.execute("DELETE FROM key_grams")
+            conn.execute("DELETE FROM meta")
+    _stale.discard(users.scoped_path(INDEX_PATH))
+
+
+def count() -> int:
+    with _lock:
+        return _db().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+# ---------------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------------
+
+def _like_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fuzzy(needle: str, exclude: set, limit: int) -> list[dict]:
+    """Names (or words of names) close to ``needle`` by difflib ratio."""
+    grams = sorted(_grams(needle))
+    marks = ", ".join("?" * len(grams))
+    with _lock:
+        conn = _db()
+        candidates = [row[0] for row in conn.execute(
+            f"""
+            SELECT key FROM key_grams WHERE gram IN ({marks})
+            GROUP BY key HAVING COUNT(*) >= ?
+            ORDER BY COUNT(*) DESC LIMIT ?
+            """,
+            (*grams, max(len(grams) // 3, 1), _FUZZY_CANDIDATES),
+        )]
+        found, seen = [], set(exclude)
+        for key in difflib.get_close_matches(needle, candidates, n=limit * 2, cutoff=0.6):
+            rows = conn.execute(
+                """
+                SELECT files.* FROM file_keys JOIN files ON files.id = file_keys.file_id
+                WHERE file_keys.key = ? ORDER BY files.modified_time DESC
+                """,
+                (key,),
+            ).fetchall()
+            for row in rows:
+                if row["id"] not in seen:
+                    seen.add(row["id"])
+                    found.append(_as_file(row, "fuzzy"))
+    return found[:limit]
+
+
+def search(name: str, limit: int = 20) -> list[dict]:
+    """Search the local index by file name, best matches first.
+
+    Exact, prefix and substring matches (case-insensitive, newest first)
+    come before fuzzy matches, which also catch typos.
+    """
+    needle = name.strip().lower()
+    if not needle:
+        return []
+    escaped = _like_escape(needle)
+    with _lock:
+        rows = _db().execute(
+            """
+            SELECT *, CASE
+                WHEN name_lower = ? THEN 0
+                WHEN name_lower LIKE ? ESCAPE '\\' THEN 1
+                ELSE 2 END AS rank
+            FROM files
+            WHERE name_lower LIKE ? ESCAPE '\\'
+            ORDER BY rank, modified_time DESC
+            LIMIT ?
+            """,
+            (needle, escaped + "%", "%" + escaped + "%", limit),
+        ).fetchall()
+    labels = ("exact", "prefix", "substring")
+    results = [_as_file(row, labels[row["rank"]]) for row in rows]
+    if len(results) < limit:
+        results += _fuzzy(needle, {r["id"] for r in results}, limit - len(results))
+    return results
+
+
+def recent(limit: int = 20) -> list[dict]:
+    """The most recently modified files."""
+    with _lock:
+        rows = _db().execute("SELECT * FROM files ORDER BY modified_time DESC LIMIT ?", (limit,)).fetchall()
+    return [_as_file(row, "recent") for row in rows]
+
+
+def files_of_types(mime_types: tuple[str, ...]) -> list[dict]:
+    """All indexed files with one of ``mime_types``."""
+    marks = ", ".join("?" * len(mime_types))
+    with _lock:
+        rows = _db().execute(f"SELECT * FROM files WHERE mime_type IN ({marks})", mime_types).fetchall()
+    return [_as_file(row, "type") for row in rows]
+
+
+def get_stats() -> dict:
+    """Index state of the current user; empty without a user or an index on disk."""
+    path = users.scoped_path(INDEX_PATH)
+    if users.current_user() is None or not os.path.exists(path):
+        return {"files": 0, "synced": False, "building": path in _building, "age_seconds": None}
+    synced_at = _get_meta("synced_at")
+    return {
+        "files": count(),
+        "synced": synced_at is not None,
+        "building": path in _building,
+        "age_seconds": round(time.time() - float(synced_at), 1) if synced_at else None,
+    }
@@ -3,24 +3,43 @@
 Handles the full OAuth2 flow: generating auth URLs, exchanging codes for
 tokens, refreshing tokens, and building authenticated Google API service
 objects.
+
+Credentials are kept per user (see ``users``): encrypted at rest in a SQLite
+``CredentialStore`` and, decrypted, in an LRU of ``CredentialManager``
+objects, so one server can serve many Google accounts.
 """
 
+import base64
+import hashlib
 import json
+import logging
 import os
-from typing import Optional
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
 
+from cryptography.fernet import Fernet, InvalidToken
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 
 from app.config import settings
+from app.services import google_clients, users
 
 # Google bazen otomatik olarak `openid` gibi ekstra yetkiler döndürür.
 # İstediğimiz yetkilerle Google'ın döndüğü %100 uyuşmadığında güvenlik hatası fırlatmaması için
 # bu esnekliği aktif ediyoruz.
 os.environ["OAUTHLIB_RELAX_TOKEN_SCOPE"] = "1"
 
-TOKEN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "token.json")
+logger = logging.getLogger(__name__)
+
+CREDENTIALS_PATH = settings.CREDENTIALS_PATH or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "credentials.db"
+)
 
 
 def _client_config() -> dict:
@@ -36,63 +55,394 @@ def _client_config() -> dict:
     }
 
 
-def get_auth_url() -> str:
-    """Generate the Google OAuth2 authorization URL."""
+def get_auth_url() -> tuple[str, str]:
+    """Generate the Google OAuth2 authorization URL; returns ``(url, state)``."""
     flow = Flow.from_client_config(
         _client_config(),
         scopes=settings.GOOGLE_SCOPES,
         redirect_uri=settings.GOOGLE_REDIRECT_URI,
     )
-    auth_url, _ = flow.authorization_url(
+    auth_url, state = flow.authorization_url(
         access_type="offline",
         include_granted_scopes="true",
         prompt="consent",
     )
-    return auth_url
+    return auth_url, state
 
 
-def exchange_code(code: str) -> Credentials:
-    """Exchange an authorization code for credentials and persist them."""
+def exchange_code(code: str, user_id: str) -> bool:
+    """Exchange an authorization code for credentials and store them for ``user_id`` (blocking).
+
+    Returns True if they belong to another Google account than the stored
+    ones (or there were none), i.e. the user's per-account state is stale.
+    """
     flow = Flow.from_client_config(
         _client_config(),
         scopes=settings.GOOGLE_SCOPES,
         redirect_uri=settings.GOOGLE_REDIRECT_URI,
     )
     flow.fetch_token(code=code)
-    creds = flow.credentials
-    _save_credentials(creds)
-    return creds
+    return _manager_for(user_id).set(flow.credentials)
 
 
-def get_credentials() -> Optional[Credentials]:
-    """Load stored credentials, refreshing if expired."""
-    if not os.path.exists(TOKEN_PATH):
+def _account_of(creds: Credentials) -> Optional[str]:
+    """The Google account (``sub`` of the ID token) ``creds`` were issued for, if known."""
+    token = getattr(creds, "id_token", None)
+    if not token:
         return None
+    try:
+        payload = token.split(".")[1]
+        return str(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"])
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+_account_listeners: list[Callable[[str], None]] = []
+
+
+def on_account_change(callback: Callable[[str], None]):
+    """Call ``callback(user_id)`` when another worker logs a user in or out (to drop per-process caches)."""
+    _account_listeners.append(callback)
+
+
+# The built-in default and the .env.example placeholder
+_PLACEHOLDER_SECRETS = ("", "change-me-in-production", "your_secret_key_here")
+
+
+def check_secret_key(secret: Optional[str] = None):
+    """Refuse to run with a missing or placeholder APP_SECRET_KEY.
+
+    The key signs user cookies and encrypts stored credentials, so a
+    well-known key would let anyone forge a session or read the tokens.
+    """
+    if (settings.APP_SECRET_KEY if secret is None else secret) in _PLACEHOLDER_SECRETS:
+        raise RuntimeError(
+            "APP_SECRET_KEY is not set; put a long random value in .env, e.g. the output of "
+            "python -c \"import secrets;print(secrets.token_urlsafe(32))\" (see README, Adım 2)"
+        )
+
+
+class CredentialStore:
+    """Serialised credentials by user id, Fernet-encrypted with a key derived from APP_SECRET_KEY.
+
+    Each row carries a version that is bumped on every write, so workers
+    sharing the database can tell when another one refreshed or replaced a
+    user's credentials, and a refresh only wins if nobody wrote in between.
+    """
+
+    def __init__(self, path: str, secret: str):
+        check_secret_key(secret)
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS credentials (user_id TEXT PRIMARY KEY, version INTEGER, data BLOB)"
+        )
+
+    def version(self, user_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM credentials WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, user_id: str) -> tuple[Optional[str], Optional[int]]:
+        """``(json, version)`` for ``user_id``; ``(None, None)`` if there is nothing usable."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, version FROM credentials WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None, None
+        try:
+            return self._fernet.decrypt(row[0]).decode(), row[1]
+        except InvalidToken:
+            # Encrypted with another APP_SECRET_KEY – the user has to log in again
+            logger.warning("Stored credentials of a user could not be decrypted")
+            return None, None
+
+    def save(self, user_id: str, data: str, expected_version: Optional[int] = None) -> Optional[int]:
+        """Store ``data``; returns the new version, or None if ``expected_version`` is outdated."""
+        token = self._fernet.encrypt(data.encode())
+        with self._lock, self._conn:
+            # Take the write lock before reading so the version check is atomic across workers
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT version FROM credentials WHERE user_id = ?", (user_id,)).fetchone()
+            current = row[0] if row else None
+            if expected_version is not None and current != expected_version:
+                return None
+            version = (current or 0) + 1
+            self._conn.execute("INSERT OR REPLACE INTO credentials VALUES (?, ?, ?)", (user_id, version, token))
+        return version
+
+    def delete(self, user_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM credentials WHERE user_id = ?", (user_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM credentials").fetchone()[0]
+
+
+class CredentialManager:
+    """Keeps one user's credentials in memory and refreshes them ahead of expiry.
 
-    creds = Credentials.from_authorized_user_file(TOKEN_PATH, settings.GOOGLE_SCOPES)
+    The stored credentials are read lazily; afterwards lookups are memory
+    reads plus, at most every ``GOOGLE_TOKEN_RELOAD_INTERVAL`` seconds, a
+    version check against the store so that a login, logout or refresh done
+    by another worker process is picked up. A timer refreshes the access
+    token ``GOOGLE_TOKEN_REFRESH_MARGIN`` seconds before it expires.
+    Refreshes are single-flight within the process; across processes the
+    write is conditional on the version, and a worker that loses adopts the
+    token the other one stored. The store is only written when the
+    serialised credentials actually changed.
+    """
 
-    if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        _save_credentials(creds)
+    def __init__(self, user_id: str, store: CredentialStore):
+        self.user_id = user_id
+        self._store = store
+        self._creds: Optional[Credentials] = None
+        self._loaded = False
+        self._saved_json: Optional[str] = None
+        self._version: Optional[int] = None
+        # Google account of the credentials, stored alongside them
+        self._account: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
 
-    if creds and creds.valid:
-        return creds
+    # -- public API ---------------------------------------------------------
 
-    return None
+    def get(self) -> Optional[Credentials]:
+        """Return valid credentials, refreshing synchronously only if expired."""
+        creds = self._current()
+        if creds is None:
+            return None
+        if creds.expired and creds.refresh_token:
+            self._refresh(creds)
+            creds = self._creds or creds
+        elif self._expiring_soon(creds):
+            self._refresh_in_background()
+        return creds if creds.valid else None
+
+    def has_credentials(self) -> bool:
+        """Cheap check for the hot path – never blocks on a token refresh."""
+        creds = self._current()
+        if creds is None:
+            return False
+        if creds.valid:
+            if self._expiring_soon(creds):
+                self._refresh_in_background()
+            return True
+        if creds.refresh_token:
+            self._refresh_in_background()
+            return True
+        return False
+
+    def set(self, creds: Credentials) -> bool:
+        """Adopt freshly issued credentials (after the OAuth callback).
+
+        Returns True if the account differs from the stored credentials'
+        (compared by refresh token when an ID token is missing).
+        """
+        previous = self._current()
+        previous_key = self._account or (previous.refresh_token if previous else None)
+        account = _account_of(creds)
+        with self._lock:
+            self._creds = creds
+            self._account = account
+            self._loaded = True
+        self._persist(creds, force=True)
+        google_clients.invalidate(self.user_id)
+        self._schedule_refresh(creds)
+        return previous is None or previous_key != (account or creds.refresh_token)
+
+    def clear(self):
+        """Forget the credentials in memory and in the store."""
+        with self._lock:
+            self._creds = None
+            self._loaded = True
+            self._saved_json = None
+            self._version = None
+            self._account = None
+        self.close()
+        self._store.delete(self.user_id)
+        google_clients.invalidate(self.user_id)
+
+    def close(self):
+        """Stop the refresh timer (when the manager leaves the cache)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    # -- internals ----------------------------------------------------------
+
+    def _current(self) -> Optional[Credentials]:
+        if not self._loaded:
+            with self._lock:
+                loaded_now = not self._loaded
+                if loaded_now:
+                    self._creds = self._load()
+                    self._loaded = True
+                    self._checked_at = time.monotonic()
+            if loaded_now and self._creds is not None:
+                self._schedule_refresh(self._creds)
+        elif time.monotonic() - self._checked_at > settings.GOOGLE_TOKEN_RELOAD_INTERVAL:
+            self._reload_if_changed()
+        return self._creds
+
+    def _load(self) -> Optional[Credentials]:
+        data, self._version = self._store.load(self.user_id)
+        self._saved_json = data
+        if data is None:
+            self._account = None
+            return None
+        info = json.loads(data)
+        self._account = info.get("account")
+        return Credentials.from_authorized_user_info(info, settings.GOOGLE_SCOPES)
+
+    def _reload_if_changed(self):
+        """Adopt the stored credentials if another process rewrote or removed them."""
+        self._checked_at = time.monotonic()
+        if self._store.version(self.user_id) == self._version:
+            return
+        with self._lock:
+            old = self._creds
+            self._creds = self._load()
+        old_refresh = old.refresh_token if old else None
+        new_refresh = self._creds.refresh_token if self._creds else None
+        google_clients.invalidate(self.user_id)
+        if self._creds is not None:
+            self._schedule_refresh(self._creds)
+        if old_refresh != new_refresh:
+            logger.info("Google credentials of a user changed in another worker")
+            for callback in _account_listeners:
+                callback(self.user_id)
+
+    @staticmethod
+    def _expiring_soon(creds: Credentials) -> bool:
+        if creds.expiry is None:
+            return False
+        margin = timedelta(seconds=settings.GOOGLE_TOKEN_REFRESH_MARGIN)
+        return creds.expiry - margin <= datetime.utcnow()
+
+    def _refresh(self, creds: Credentials):
+        """Refresh ``creds`` unless another thread or worker already did (single-flight)."""
+        with self._refresh_lock:
+            if self._creds is not creds or not (creds.expired or self._expiring_soon(creds)):
+                return
+            # Another worker may have refreshed already
+            self._reload_if_changed()
+            if self._creds is not creds:
+                if self._creds is None or not self._expiring_soon(self._creds):
+                    return
+                creds = self._creds
+            try:
+                creds.refresh(Request())
+            except RefreshError:
+                # The refresh token was revoked or expired – treat as logged out.
+                with self._lock:
+                    if self._creds is creds:
+                        self._creds = None
+                raise
+            self._persist(creds)
+            google_clients.invalidate(self.user_id)
+        self._schedule_refresh(creds)
+
+    def _refresh_quietly(self):
+        creds = self._creds
+        if creds is None or not creds.refresh_token:
+            return
+        try:
+            self._refresh(creds)
+        except Exception as e:
+            logger.warning("Background token refresh failed: %s", e)
+
+    def _refresh_in_background(self):
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self._refresh_quietly, name="token-refresh", daemon=True).start()
+
+    def _schedule_refresh(self, creds: Credentials):
+        if creds.expiry is None or not creds.refresh_token:
+            return
+        delay = (creds.expiry - datetime.utcnow()).total_seconds() - settings.GOOGLE_TOKEN_REFRESH_MARGIN
+        timer = threading.Timer(max(delay, 0), self._refresh_quietly)
+        timer.daemon = True
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = timer
+        timer.start()
+
+    def _persist(self, creds: Credentials, force: bool = False):
+        """Store the credentials, skipping the write if unchanged.
+
+        Unless ``force``d the write only succeeds if nobody else stored newer
+        credentials since we loaded ours; otherwise theirs are adopted.
+        """
+        data = creds.to_json()
+        if self._account:
+            data = json.dumps(dict(json.loads(data), account=self._account))
+        if data == self._saved_json:
+            return
+        version = self._store.save(self.user_id, data, None if force else self._version)
+        if version is None:
+            self._reload_if_changed()
+            return
+        self._saved_json = data
+        self._version = version
+
+
+_store: Optional[CredentialStore] = None
+_managers: "OrderedDict[str, CredentialManager]" = OrderedDict()
+_managers_lock = threading.Lock()
+
+
+def _manager_for(user_id: str) -> CredentialManager:
+    """The user's manager from the LRU, created (and the oldest evicted) as needed."""
+    global _store
+    evicted = []
+    with _managers_lock:
+        if _store is None:
+            _store = CredentialStore(CREDENTIALS_PATH, settings.APP_SECRET_KEY)
+        manager = _managers.get(user_id)
+        if manager is None:
+            manager = _managers[user_id] = CredentialManager(user_id, _store)
+        _managers.move_to_end(user_id)
+        while len(_managers) > settings.CREDENTIAL_CACHE_SIZE:
+            evicted.append(_managers.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+        google_clients.invalidate(old.user_id)
+    return manager
+
+
+def get_credentials() -> Optional[Credentials]:
+    """Return the current user's credentials, refreshing if expired."""
+    user_id = users.current_user()
+    if user_id is None:
+        return None
+    return _manager_for(user_id).get()
 
 
 def is_authenticated() -> bool:
-    """Check whether valid credentials exist."""
-    return get_credentials() is not None
+    """Check whether the current user has usable credentials (never blocks on a refresh)."""
+    user_id = users.current_user()
+    if user_id is None:
+        return False
+    return _manager_for(user_id).has_credentials()
 
 
 def logout():
-    """Remove stored credentials."""
-    if os.path.exists(TOKEN_PATH):
-        os.remove(TOKEN_PATH)
+    """Remove the current user's stored credentials."""
+    user_id = users.current_user()
+    if user_id is not None:
+        _manager_for(user_id).clear()
 
 
-def _save_credentials(creds: Credentials):
-    """Persist credentials to disk."""
-    with open(TOKEN_PATH, "w") as f:
-        f.write(creds.to_json())
+def get_stats() -> dict:
+    with _managers_lock:
+        cached = len(_managers)
+    return {"cached": cached, "stored": _store.count() if _store is not None else 0}
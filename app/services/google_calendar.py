@@ -3,16 +3,15 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-from googleapiclient.discovery import build
-
 from app.services.google_auth import get_credentials
+from app.services.google_clients import get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("calendar", "v3", credentials=creds)
+    return get_service("calendar", "v3", creds)
 
 
 def list_events(
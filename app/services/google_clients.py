@@ -0,0 +1,142 @@
+"""Google API client registry – builds each service object once and reuses it.
+
+``googleapiclient.discovery.build`` parses the discovery document and sets up
+a fresh HTTP transport, which costs tens of milliseconds of CPU per call. The
+registry caches built clients per (api, version, credentials) instead.
+
+The underlying httplib2 transport is not thread-safe, so clients are cached
+per thread: each tool worker thread gets its own client for every API and
+user (the current user from ``users``) and keeps reusing it, up to
+GOOGLE_CLIENT_CACHE_SIZE clients per thread. ``invalidate()`` drops the
+cached clients of one user, or of everyone (e.g. after a token refresh or
+logout); threads rebuild lazily on their next call.
+
+Clients also support conditional GETs: inside ``conditional_requests()``
+requests carry ``If-None-Match`` for URIs with a known ETag, ETags returned
+by the server are recorded, and a ``304 Not Modified`` raises
+``NotModified`` instead of an ``HttpError``.
+
+Every request is traced as a ``google.api`` span (see ``tracing``). Batches
+and chunked media downloads talk to the transport directly, so their callers
+wrap them in ``api_span()`` themselves.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from app.config import settings
+from app.services import tracing, users
+
+_local = threading.local()
+_generation = 0
+_user_generations: dict[str, int] = {}
+_generation_lock = threading.Lock()
+
+
+class NotModified(Exception):
+    """The server answered a conditional GET with 304 Not Modified."""
+
+
+class ConditionalContext:
+    """ETags to send (``etags``) and ETags the server returned (``seen``), by URI."""
+
+    def __init__(self, etags: Optional[dict[str, str]] = None):
+        self.etags = etags or {}
+        self.seen: dict[str, str] = {}
+        self.requests = 0
+
+
+@contextmanager
+def conditional_requests(etags: Optional[dict[str, str]] = None):
+    """Make GETs issued by this thread conditional for the duration of the block."""
+    ctx = ConditionalContext(etags)
+    previous = getattr(_local, "conditional", None)
+    _local.conditional = ctx
+    try:
+        yield ctx
+    finally:
+        _local.conditional = previous
+
+
+def api_span(method: str, http_method: str = "GET", **attributes):
+    """A ``google.api`` span for a request that does not go through ``HttpRequest.execute``."""
+    return tracing.span("google.api", method=method, http_method=http_method, **attributes)
+
+
+class _ConditionalRequest(HttpRequest):
+    def execute(self, http=None, num_retries=0):
+        with api_span(self.methodId or self.method, self.method) as request_span:
+            try:
+                return self._execute(http, num_retries)
+            except NotModified:
+                request_span.status = "ok"
+                request_span.set(not_modified=True)
+                raise
+
+    def _execute(self, http, num_retries):
+        ctx = getattr(_local, "conditional", None)
+        if ctx is None or self.method != "GET":
+            return super().execute(http=http, num_retries=num_retries)
+
+        ctx.requests += 1
+        uri = self.uri
+        if uri in ctx.etags:
+            self.headers["If-None-Match"] = ctx.etags[uri]
+
+        postproc = self.postproc
+
+        def capture(resp, content):
+            if resp.get("etag"):
+                ctx.seen[uri] = resp["etag"]
+            return postproc(resp, content)
+
+        self.postproc = capture
+        try:
+            return super().execute(http=http, num_retries=num_retries)
+        except HttpError as e:
+            if e.resp.status == 304:
+                raise NotModified(uri) from e
+            raise
+
+
+def get_service(api: str, version: str, creds: Credentials):
+    """Return a cached client for ``api``/``version`` bound to ``creds``."""
+    cache = getattr(_local, "clients", None)
+    if cache is None or _local.generation != _generation:
+        cache = OrderedDict()
+        _local.clients = cache
+        _local.generation = _generation
+
+    # Keyed on the access token too, so a refreshed or different credential
+    # never reuses a client bound to the old one.
+    user_id = users.current_user()
+    key = (user_id, api, version)
+    generation = _user_generations.get(user_id, 0)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == generation and entry[1] == creds.token:
+        cache.move_to_end(key)
+        return entry[2]
+
+    service = build(api, version, credentials=creds, requestBuilder=_ConditionalRequest)
+    cache[key] = (generation, creds.token, service)
+    cache.move_to_end(key)
+    while len(cache) > settings.GOOGLE_CLIENT_CACHE_SIZE:
+        cache.popitem(last=False)
+    return service
+
+
+def invalidate(user_id: Optional[str] = None):
+    """Drop the cached clients of ``user_id`` (of everyone if None) in every thread."""
+    global _generation
+    with _generation_lock:
+        if user_id is None:
+            _generation += 1
+        else:
+            _user_generations[user_id] = _user_generations.get(user_id, 0) + 1
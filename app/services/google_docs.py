@@ -2,23 +2,22 @@
 
 from typing import Optional
 
-from googleapiclient.discovery import build
-
 from app.services.google_auth import get_credentials
+from app.services.google_clients import get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("docs", "v1", credentials=creds)
+    return get_service("docs", "v1", creds)
 
 
 def _get_drive_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("drive", "v3", credentials=creds)
+    return get_service("drive", "v3", creds)
 
 
 def create_document(title: str, body_text: Optional[str] = None) -> dict:
@@ -58,35 +57,61 @@ def read_document(document_id: str) -> dict:
     }
 
 
-def append_text(document_id: str, text: str) -> dict:
-    """Append text to the end of a Google Doc."""
-    service = _get_service()
-    requests = [
-        {
+class DocumentBatch:
+    """Collects edits to one document and sends them as a single batchUpdate.
+
+    Each method queues a request and returns its position; ``flush()`` sends
+    everything queued so far and returns the replies in that order. Requests
+    apply in order, atomically.
+    """
+
+    def __init__(self, document_id: str):
+        self.document_id = document_id
+        self.requests: list[dict] = []
+
+    def append_text(self, text: str) -> int:
+        self.requests.append({
             "insertText": {
-                "location": {"index": 1},
+                "endOfSegmentLocation": {"segmentId": ""},
                 "text": text,
             }
-        }
-    ]
-    service.documents().batchUpdate(
-        documentId=document_id, body={"requests": requests}
-    ).execute()
+        })
+        return len(self.requests) - 1
+
+    def replace_all_text(self, find: str, replace: str, match_case: bool = True) -> int:
+        self.requests.append({
+            "replaceAllText": {
+                "containsText": {"text": find, "matchCase": match_case},
+                "replaceText": replace,
+            }
+        })
+        return len(self.requests) - 1
+
+    def flush(self) -> list[dict]:
+        if not self.requests:
+            return []
+        service = _get_service()
+        result = service.documents().batchUpdate(
+            documentId=self.document_id, body={"requests": self.requests}
+        ).execute()
+        self.requests = []
+        return result.get("replies", [])
+
+
+def append_text(document_id: str, text: str) -> dict:
+    """Append text to the end of a Google Doc."""
+    batch = DocumentBatch(document_id)
+    batch.append_text(text)
+    batch.flush()
     return {"status": "success", "documentId": document_id}
 
 
 def find_and_replace(document_id: str, find: str, replace: str) -> dict:
     """Find and replace text in a Google Doc."""
-    service = _get_service()
-    requests = [
-        {
-            "replaceAllText": {
-                "containsText": {"text": find, "matchCase": True},
-                "replaceText": replace,
-            }
-        }
-    ]
-    result = service.documents().batchUpdate(
-        documentId=document_id, body={"requests": requests}
-    ).execute()
-    return {"status": "success", "replacements": result}
+    batch = DocumentBatch(document_id)
+    batch.replace_all_text(find, replace)
+    reply = batch.flush()[0]
+    return {
+        "status": "success",
+        "occurrencesChanged": reply.get("replaceAllText", {}).get("occurrencesChanged", 0),
+    }
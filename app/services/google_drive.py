@@ -1,42 +1,102 @@
 """Google Drive service – list, search, download files."""
 
-import io
-from typing import Optional
+import time
+from typing import BinaryIO, Iterator, Optional
 
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
+from app.config import settings
 from app.services.google_auth import get_credentials
+from app.services.google_clients import api_span, get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil. Lütfen önce giriş yapın.")
-    return build("drive", "v3", credentials=creds)
-
-
-def list_files(query: Optional[str] = None, page_size: int = 20) -> list[dict]:
-    """List files from Google Drive, optionally filtered by a query."""
-    service = _get_service()
-    q = query if query else None
-    results = (
-        service.files()
-        .list(
-            pageSize=page_size,
-            fields="files(id, name, mimeType, modifiedTime, size, webViewLink)",
-            q=q,
-            orderBy="modifiedTime desc",
-        )
-        .execute()
-    )
-    return results.get("files", [])
-
-
-def search_files(name: str) -> list[dict]:
-    """Search for files by name."""
-    query = f"name contains '{name}' and trashed = false"
-    return list_files(query=query)
+    return get_service("drive", "v3", creds)
+
+
+# Fields returned for each file by the listing functions
+FILE_FIELDS = ("id", "name", "mimeType", "modifiedTime", "size", "webViewLink")
+
+
+def _escape_query_value(value: str) -> str:
+    """Escape a string for use inside a single-quoted Drive query literal."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+class FileListing:
+    """Lazy iterator over every page of a Drive ``files.list`` query.
+
+    Pages are requested only as the caller consumes files, so breaking out of
+    the loop stops paging. Iteration also stops after ``max_results`` files
+    (DRIVE_LIST_MAX_RESULTS by default) or once ``time_budget`` seconds
+    (DRIVE_LIST_TIME_BUDGET by default, 0 for none) have passed; ``truncated``
+    then tells whether more results were left on the server. Only ``fields``
+    are requested for each file.
+    """
+
+    def __init__(
+        self,
+        query: Optional[str] = None,
+        fields: tuple[str, ...] = FILE_FIELDS,
+        max_results: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        page_size: Optional[int] = None,
+        order_by: Optional[str] = "modifiedTime desc",
+    ):
+        self.query = query
+        self.fields = fields
+        self.max_results = max_results or settings.DRIVE_LIST_MAX_RESULTS
+        self.time_budget = settings.DRIVE_LIST_TIME_BUDGET if time_budget is None else time_budget
+        self.page_size = min(page_size or settings.DRIVE_LIST_PAGE_SIZE, 1000)
+        self.order_by = order_by
+        self.truncated = False
+        self.pages = 0
+
+    def __iter__(self) -> Iterator[dict]:
+        service = _get_service()
+        deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        fields = f"nextPageToken, files({', '.join(self.fields)})"
+        self.truncated = False
+        self.pages = 0
+        yielded = 0
+        page_token = None
+        while True:
+            page_size = min(self.page_size, self.max_results - yielded)
+            response = (
+                service.files()
+                .list(
+                    q=self.query,
+                    pageSize=page_size,
+                    pageToken=page_token,
+                    fields=fields,
+                    orderBy=self.order_by,
+                )
+                .execute()
+            )
+            self.pages += 1
+            files = response.get("files", [])
+            page_token = response.get("nextPageToken")
+            for item in files[: self.max_results - yielded]:
+                yielded += 1
+                yield item
+            if not page_token:
+                return
+            if yielded >= self.max_results or (deadline is not None and time.monotonic() > deadline):
+                self.truncated = True
+                return
+
+
+def iter_files(query: Optional[str] = None, **kwargs) -> FileListing:
+    """Iterate lazily over all files matching ``query`` (see ``FileListing``)."""
+    return FileListing(query, **kwargs)
+
+
+def name_query(name: str) -> str:
+    """Drive query for non-trashed files whose name contains ``name``."""
+    return f"name contains '{_escape_query_value(name)}' and trashed = false"
 
 
 def get_file_metadata(file_id: str) -> dict:
@@ -49,44 +109,74 @@ def get_file_metadata(file_id: str) -> dict:
     )
 
 
-def download_file(file_id: str) -> tuple[bytes, str]:
-    """Download a file and return (content_bytes, filename)."""
+# Google Workspace files need to be exported
+_EXPORT_MAP = {
+    "application/vnd.google-apps.document": (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        ".docx",
+    ),
+    "application/vnd.google-apps.spreadsheet": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        ".xlsx",
+    ),
+    "application/vnd.google-apps.presentation": (
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        ".pptx",
+    ),
+}
+
+
+def get_download_info(file_id: str) -> dict:
+    """Return the filename and MIME type a download of ``file_id`` will have."""
     service = _get_service()
-    meta = service.files().get(fileId=file_id, fields="name, mimeType").execute()
+    meta = service.files().get(fileId=file_id, fields="name, mimeType, size").execute()
     filename = meta["name"]
     mime = meta.get("mimeType", "")
-
-    # Google Workspace files need to be exported
-    export_map = {
-        "application/vnd.google-apps.document": (
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            ".docx",
-        ),
-        "application/vnd.google-apps.spreadsheet": (
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            ".xlsx",
-        ),
-        "application/vnd.google-apps.presentation": (
-            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-            ".pptx",
-        ),
-    }
-
-    buf = io.BytesIO()
-    if mime in export_map:
-        export_mime, ext = export_map[mime]
-        request = service.files().export_media(fileId=file_id, mimeType=export_mime)
+    if mime in _EXPORT_MAP:
+        export_mime, ext = _EXPORT_MAP[mime]
         if not filename.endswith(ext):
             filename += ext
+        return {"filename": filename, "mimeType": export_mime, "sourceMimeType": mime}
+    return {"filename": filename, "mimeType": mime or "application/octet-stream", "sourceMimeType": mime, "size": meta.get("size")}
+
+
+def is_exported(info: dict) -> bool:
+    """Whether the download described by ``info`` is an export (no size, no byte ranges)."""
+    return info["sourceMimeType"] in _EXPORT_MAP
+
+
+def download_range(file_id: str, start: int, end: int) -> bytes:
+    """Bytes ``start``..``end`` (inclusive) of a stored (not exported) file.
+
+    The range is forwarded to Drive, so only those bytes are transferred.
+    """
+    request = _get_service().files().get_media(fileId=file_id)
+    request.headers["Range"] = f"bytes={start}-{end}"
+    return request.execute()
+
+
+def download_to_file(file_id: str, fh: BinaryIO, chunk_size: Optional[int] = None, info: Optional[dict] = None) -> dict:
+    """Download (or export) a file into ``fh`` chunk by chunk.
+
+    Only one chunk (DRIVE_DOWNLOAD_CHUNK_SIZE by default) is held in memory
+    at a time. Returns the info from ``get_download_info`` (fetched unless
+    given) plus the number of bytes written.
+    """
+    service = _get_service()
+    info = dict(info) if info else get_download_info(file_id)
+    if info["sourceMimeType"] in _EXPORT_MAP:
+        request = service.files().export_media(fileId=file_id, mimeType=info["mimeType"])
     else:
         request = service.files().get_media(fileId=file_id)
 
-    downloader = MediaIoBaseDownload(buf, request)
+    downloader = MediaIoBaseDownload(fh, request, chunksize=chunk_size or settings.DRIVE_DOWNLOAD_CHUNK_SIZE)
     done = False
     while not done:
-        _, done = downloader.next_chunk()
+        with api_span(request.methodId):
+            _, done = downloader.next_chunk()
 
-    return buf.getvalue(), filename
+    info["size"] = fh.tell()
+    return info
 
 
 def create_folder(name: str, parent_id: Optional[str] = None) -> dict:
@@ -5,16 +5,15 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 
-from googleapiclient.discovery import build
-
 from app.services.google_auth import get_credentials
+from app.services.google_clients import api_span, get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("gmail", "v1", credentials=creds)
+    return get_service("gmail", "v1", creds)
 
 
 def _build_message(to: str, subject: str, body: str, cc: str = "", bcc: str = "") -> dict:
@@ -69,8 +68,31 @@ def create_draft(
     }
 
 
+# Gmail allows up to 100 calls per batch but recommends staying at or below 50
+_BATCH_SIZE = 50
+# messages.list returns at most 500 IDs per page
+_MAX_PAGE_SIZE = 500
+
+
+def _message_summary(msg: dict) -> dict:
+    headers = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
+    return {
+        "id": msg["id"],
+        "threadId": msg.get("threadId", ""),
+        "subject": headers.get("Subject", ""),
+        "from": headers.get("From", ""),
+        "date": headers.get("Date", ""),
+        "snippet": msg.get("snippet", ""),
+    }
+
+
 def list_messages(query: str = "", max_results: int = 10) -> list[dict]:
-    """List Gmail messages, optionally filtered by query."""
+    """List Gmail messages, optionally filtered by query.
+
+    IDs are paged through with ``nextPageToken`` until ``max_results`` is
+    reached, and the metadata of the messages is fetched in batch requests
+    (one HTTP round trip per 50 messages) instead of one ``get`` each.
+    """
     service = _get_service()
     
     # Gelen kutusundan aramak için varsayılan olarak 'in:inbox' ekliyoruz
@@ -79,30 +101,60 @@ def list_messages(query: str = "", max_results: int = 10) -> list[dict]:
     elif "in:" not in query:
         query = f"in:inbox {query}"
 
-    results = (
-        service.users()
-        .messages()
-        .list(userId="me", q=query, maxResults=max_results)
-        .execute()
-    )
-    messages = []
-    for msg_meta in results.get("messages", []):
-        msg = (
+    ids = []
+    page_token = None
+    while len(ids) < max_results:
+        results = (
             service.users()
             .messages()
-            .get(userId="me", id=msg_meta["id"], format="metadata",
-                 metadataHeaders=["Subject", "From", "Date"])
+            .list(
+                userId="me",
+                q=query,
+                maxResults=min(max_results - len(ids), _MAX_PAGE_SIZE),
+                pageToken=page_token,
+            )
             .execute()
         )
-        headers = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
-        messages.append({
-            "id": msg["id"],
-            "threadId": msg.get("threadId", ""),
-            "subject": headers.get("Subject", ""),
-            "from": headers.get("From", ""),
-            "date": headers.get("Date", ""),
-            "snippet": msg.get("snippet", ""),
-        })
+        ids.extend(m["id"] for m in results.get("messages", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+    # messages.list can return a message twice when the mailbox changes between pages
+    ids = list(dict.fromkeys(ids))[:max_results]
+
+    # Keyed by position in ``ids``, never by message id: a batch raises on a
+    # repeated request id
+    fetched: dict[str, dict] = {}
+    errors: dict[str, str] = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = str(exception)
+        else:
+            fetched[request_id] = response
+
+    for start in range(0, len(ids), _BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        chunk = ids[start:start + _BATCH_SIZE]
+        for position, msg_id in enumerate(chunk, start):
+            batch.add(
+                service.users().messages().get(
+                    userId="me", id=msg_id, format="metadata",
+                    metadataHeaders=["Subject", "From", "Date"],
+                ),
+                request_id=str(position),
+            )
+        # Batches bypass HttpRequest.execute, where requests are traced
+        with api_span("gmail.users.messages.get", "POST", batch=len(chunk)):
+            batch.execute()
+
+    # Batch callbacks arrive in any order; keep the order messages.list gave us
+    messages = []
+    for position, msg_id in enumerate(ids):
+        if str(position) in fetched:
+            messages.append(_message_summary(fetched[str(position)]))
+        elif str(position) in errors:
+            messages.append({"id": msg_id, "error": errors[str(position)]})
     return messages
 
 
@@ -1,39 +1,101 @@
-"""Google Sheets service – create, read, write, append rows."""
+"""Google Sheets service – create, read, write, append rows (also in bulk)."""
 
+import re
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
-from googleapiclient.discovery import build
-
+from app.config import settings
+from app.services import users
+from app.services.columnar import ColumnTable, parse_number
 from app.services.google_auth import get_credentials
+from app.services.google_clients import get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("sheets", "v4", credentials=creds)
+    return get_service("sheets", "v4", creds)
 
 
 def _get_drive_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("drive", "v3", credentials=creds)
+    return get_service("drive", "v3", creds)
+
+
+# Text whose meaning depends on the sheet's locale: "12.5", "1.500,25 ₺",
+# "%15", "12.03.2024", "12:30" – digits with only separators and symbols
+_LOCALE_TEXT = re.compile(r"^[\s\d.,:/%+\-()₺$€£]*\d[\s\d.,:/%+\-()₺$€£]*$")
+
+
+def _needs_locale(value) -> bool:
+    """Whether ``value`` must be parsed by Sheets (USER_ENTERED) rather than by ``_cell``."""
+    return isinstance(value, str) and parse_number(value) is None and bool(_LOCALE_TEXT.match(value.strip()))
+
 
+def _cell(value) -> dict:
+    """``CellData`` for a value written at creation time.
 
-def create_spreadsheet(title: str, headers: Optional[list[str]] = None) -> dict:
-    """Create a new Google Spreadsheet, optionally with header row."""
+    Booleans, real numbers and digit-only text become typed values, text
+    starting with "=" a formula, None and "" an empty cell, and anything else
+    plain text. Text for ``_needs_locale`` (decimals, dates, percentages) is
+    not for here: ``create_spreadsheet`` writes such data with USER_ENTERED.
+    """
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    number = parse_number(value)
+    if number is not None:
+        return {"userEnteredValue": {"numberValue": number}}
+    text = str(value)
+    if text.startswith("="):
+        return {"userEnteredValue": {"formulaValue": text}}
+    return {"userEnteredValue": {"stringValue": text}}
+
+
+def create_spreadsheet(
+    title: str,
+    headers: Optional[list[str]] = None,
+    rows: Optional[list[list]] = None,
+) -> dict:
+    """Create a new Google Spreadsheet, optionally with a header row and data.
+
+    The initial cells travel inside the create request, so this is a single
+    round trip however much data there is – unless some cells hold text the
+    sheet's locale has to interpret (see ``_needs_locale``); then the data is
+    written afterwards with USER_ENTERED, exactly as typed into the sheet.
+    """
     service = _get_service()
     body = {"properties": {"title": title}}
+    values = ([headers] if headers else []) + (rows or [])
+    user_entered = any(_needs_locale(v) for row in values for v in row)
+    if values and not user_entered:
+        body["sheets"] = [{
+            "data": [{
+                "startRow": 0,
+                "startColumn": 0,
+                "rowData": [{"values": [_cell(v) for v in row]} for row in values],
+            }],
+        }]
     sheet = service.spreadsheets().create(body=body, fields="spreadsheetId").execute()
     sheet_id = sheet["spreadsheetId"]
-
-    if headers:
-        write_range(sheet_id, "A1", [headers])
+    if user_entered:
+        service.spreadsheets().values().update(
+            spreadsheetId=sheet_id,
+            range="A1",
+            valueInputOption="USER_ENTERED",
+            body={"values": values},
+        ).execute()
 
     return {
         "spreadsheetId": sheet_id,
         "title": title,
+        "rowsWritten": len(values),
         "link": f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit",
     }
 
@@ -56,6 +118,7 @@ def read_range(spreadsheet_id: str, range_name: str = "A1:Z1000") -> dict:
 
 def write_range(spreadsheet_id: str, range_name: str, values: list[list]) -> dict:
     """Write values to a spreadsheet range."""
+    _forget_tables(spreadsheet_id)
     service = _get_service()
     body = {"values": values}
     result = (
@@ -76,8 +139,99 @@ def write_range(spreadsheet_id: str, range_name: str, values: list[list]) -> dic
     }
 
 
+def batch_read(spreadsheet_id: str, ranges: list[str]) -> dict:
+    """Read several ranges in one round trip.
+
+    Values come back unformatted (numbers as numbers, dates as text), ready
+    for ``columnar.ColumnTable.from_values``.
+    """
+    service = _get_service()
+    result = (
+        service.spreadsheets()
+        .values()
+        .batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            valueRenderOption="UNFORMATTED_VALUE",
+            dateTimeRenderOption="FORMATTED_STRING",
+        )
+        .execute()
+    )
+    return {
+        "spreadsheetId": spreadsheet_id,
+        "ranges": [
+            {"range": vr.get("range", requested), "values": vr.get("values", [])}
+            for requested, vr in zip(ranges, result.get("valueRanges", []))
+        ],
+    }
+
+
+def read_columns(spreadsheet_id: str, ranges: list[str], header: bool = True) -> list[ColumnTable]:
+    """Read several ranges as column-typed tables (one per range)."""
+    data = batch_read(spreadsheet_id, ranges)
+    return [ColumnTable.from_values(r["values"], header, r["range"]) for r in data["ranges"]]
+
+
+# (user, spreadsheet_id, range) -> (fetched_at, ColumnTable), for sheets_query
+_tables: "OrderedDict[tuple[Optional[str], str, str], tuple[float, ColumnTable]]" = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def get_table(spreadsheet_id: str, range_name: str) -> ColumnTable:
+    """A range as a ColumnTable, reused for SHEETS_TABLE_CACHE_TTL seconds.
+
+    Repeated analytic questions about the same sheet are answered from the
+    cached columns; writes through this module drop the spreadsheet's tables.
+    """
+    key = (users.current_user(), spreadsheet_id, range_name)
+    with _tables_lock:
+        cached = _tables.get(key)
+        if cached is not None and time.monotonic() - cached[0] < settings.SHEETS_TABLE_CACHE_TTL:
+            _tables.move_to_end(key)
+            return cached[1]
+    table = read_columns(spreadsheet_id, [range_name])[0]
+    with _tables_lock:
+        _tables[key] = (time.monotonic(), table)
+        _tables.move_to_end(key)
+        while len(_tables) > settings.SHEETS_TABLE_CACHE_SIZE:
+            _tables.popitem(last=False)
+    return table
+
+
+def _forget_tables(spreadsheet_id: str):
+    # Other users' copies too: they read the same (now changed) spreadsheet
+    with _tables_lock:
+        for key in [k for k in _tables if k[1] == spreadsheet_id]:
+            del _tables[key]
+
+
+def batch_write(spreadsheet_id: str, data: list[dict]) -> dict:
+    """Write several ``{"range": ..., "values": [[...]]}`` blocks in one round trip."""
+    _forget_tables(spreadsheet_id)
+    service = _get_service()
+    result = (
+        service.spreadsheets()
+        .values()
+        .batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                "valueInputOption": "USER_ENTERED",
+                "data": [{"range": d["range"], "values": d["values"]} for d in data],
+            },
+        )
+        .execute()
+    )
+    return {
+        "status": "success",
+        "updatedRanges": len(result.get("responses", [])),
+        "updatedCells": result.get("totalUpdatedCells", 0),
+        "spreadsheetId": spreadsheet_id,
+    }
+
+
 def append_rows(spreadsheet_id: str, values: list[list], range_name: str = "A1") -> dict:
     """Append rows to a spreadsheet."""
+    _forget_tables(spreadsheet_id)
     service = _get_service()
     body = {"values": values}
     result = (
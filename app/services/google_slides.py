@@ -1,17 +1,17 @@
 """Google Slides service – create presentations, add slides, insert text."""
 
+import uuid
 from typing import Optional
 
-from googleapiclient.discovery import build
-
 from app.services.google_auth import get_credentials
+from app.services.google_clients import get_service
 
 
 def _get_service():
     creds = get_credentials()
     if not creds:
         raise PermissionError("Google hesabı bağlı değil.")
-    return build("slides", "v1", credentials=creds)
+    return get_service("slides", "v1", creds)
 
 
 def create_presentation(title: str) -> dict:
@@ -51,37 +51,59 @@ def get_presentation(presentation_id: str) -> dict:
     }
 
 
-def add_slide(presentation_id: str, layout: str = "BLANK") -> dict:
-    """Add a new slide to a presentation."""
-    service = _get_service()
-    requests = [
-        {
-            "createSlide": {
-                "slideLayoutReference": {"predefinedLayout": layout},
-            }
+def new_object_id(prefix: str) -> str:
+    """A unique page/element ID (Slides wants 5-50 chars of ``[a-zA-Z0-9_]``)."""
+    return f"{prefix}_{uuid.uuid4().hex[:16]}"
+
+
+class PresentationBatch:
+    """Collects edits to one presentation and sends them as a single batchUpdate.
+
+    Object IDs are generated up front, so later requests in the same batch can
+    refer to slides and shapes created by earlier ones. ``flush()`` sends
+    everything queued so far (atomically, in order) and returns the replies.
+    """
+
+    def __init__(self, presentation_id: str):
+        self.presentation_id = presentation_id
+        self.requests: list[dict] = []
+
+    def create_slide(self, layout: str = "BLANK", placeholders: Optional[dict[str, str]] = None) -> str:
+        """Queue a new slide; ``placeholders`` maps layout placeholder types
+        (``"TITLE"``, ``"BODY"``) to the object IDs they should get."""
+        slide_id = new_object_id("slide")
+        request = {
+            "objectId": slide_id,
+            "slideLayoutReference": {"predefinedLayout": layout},
         }
-    ]
-    response = service.presentations().batchUpdate(
-        presentationId=presentation_id, body={"requests": requests}
-    ).execute()
-    slide_id = response["replies"][0]["createSlide"]["objectId"]
-    return {"status": "success", "slideId": slide_id, "presentationId": presentation_id}
+        if placeholders:
+            request["placeholderIdMappings"] = [
+                {"layoutPlaceholder": {"type": kind, "index": 0}, "objectId": object_id}
+                for kind, object_id in placeholders.items()
+            ]
+        self.requests.append({"createSlide": request})
+        return slide_id
 
+    def insert_text(self, object_id: str, text: str):
+        self.requests.append({
+            "insertText": {
+                "objectId": object_id,
+                "insertionIndex": 0,
+                "text": text,
+            }
+        })
 
-def add_text_to_slide(
-    presentation_id: str,
-    slide_id: str,
-    text: str,
-    x: float = 100,
-    y: float = 100,
-    width: float = 500,
-    height: float = 300,
-) -> dict:
-    """Add a text box with content to a specific slide."""
-    service = _get_service()
-    element_id = f"textbox_{slide_id[:8]}"
-    requests = [
-        {
+    def add_text_box(
+        self,
+        slide_id: str,
+        text: str,
+        x: float = 100,
+        y: float = 100,
+        width: float = 500,
+        height: float = 300,
+    ) -> str:
+        element_id = new_object_id("textbox")
+        self.requests.append({
             "createShape": {
                 "objectId": element_id,
                 "shapeType": "TEXT_BOX",
@@ -100,16 +122,99 @@ def add_text_to_slide(
                     },
                 },
             }
-        },
-        {
-            "insertText": {
-                "objectId": element_id,
-                "insertionIndex": 0,
-                "text": text,
-            }
-        },
-    ]
-    service.presentations().batchUpdate(
-        presentationId=presentation_id, body={"requests": requests}
-    ).execute()
+        })
+        self.insert_text(element_id, text)
+        return element_id
+
+    def add_content_slide(self, title: str = "", body: str = "") -> str:
+        """Queue a TITLE_AND_BODY slide filled with ``title`` and ``body``."""
+        title_id, body_id = new_object_id("title"), new_object_id("body")
+        slide_id = self.create_slide("TITLE_AND_BODY", {"TITLE": title_id, "BODY": body_id})
+        if title:
+            self.insert_text(title_id, title)
+        if body:
+            self.insert_text(body_id, body)
+        return slide_id
+
+    def delete_object(self, object_id: str):
+        self.requests.append({"deleteObject": {"objectId": object_id}})
+
+    def flush(self) -> list[dict]:
+        if not self.requests:
+            return []
+        service = _get_service()
+        result = service.presentations().batchUpdate(
+            presentationId=self.presentation_id, body={"requests": self.requests}
+        ).execute()
+        self.requests = []
+        return result.get("replies", [])
+
+
+def _slide_contents(slides: list) -> list[tuple[str, str]]:
+    """Normalise ``[{"title": ..., "body": ...}]`` (or plain strings) to pairs."""
+    contents = []
+    for slide in slides:
+        if isinstance(slide, dict):
+            body = slide.get("body", "")
+            if isinstance(body, list):
+                body = "\n".join(str(line) for line in body)
+            contents.append((str(slide.get("title", "")), str(body)))
+        else:
+            contents.append((str(slide), ""))
+    return contents
+
+
+def add_slides(presentation_id: str, slides: list) -> dict:
+    """Append several title/body slides in one round trip."""
+    batch = PresentationBatch(presentation_id)
+    slide_ids = [batch.add_content_slide(title, body) for title, body in _slide_contents(slides)]
+    batch.flush()
+    return {"status": "success", "slideIds": slide_ids, "presentationId": presentation_id}
+
+
+def create_deck(title: str, slides: list) -> dict:
+    """Create a presentation with all its slides in two round trips.
+
+    The blank slide Google adds to every new presentation is removed in the
+    same batch that adds the content slides.
+    """
+    service = _get_service()
+    presentation = service.presentations().create(body={"title": title}).execute()
+    pres_id = presentation["presentationId"]
+
+    batch = PresentationBatch(pres_id)
+    slide_ids = [batch.add_content_slide(t, b) for t, b in _slide_contents(slides)]
+    if slide_ids:
+        for slide in presentation.get("slides", []):
+            batch.delete_object(slide["objectId"])
+    batch.flush()
+    return {
+        "presentationId": pres_id,
+        "title": title,
+        "slideIds": slide_ids,
+        "link": f"https://docs.google.com/presentation/d/{pres_id}/edit",
+    }
+
+
+def add_slide(presentation_id: str, layout: str = "BLANK") -> dict:
+    """Add a new slide to a presentation."""
+    batch = PresentationBatch(presentation_id)
+    slide_id = batch.create_slide(layout)
+    batch.flush()
+    return {"status": "success", "slideId": slide_id, "presentationId": presentation_id}
+
+
+def add_text_to_slide(
+    presentation_id: str,
+    slide_id: str,
+    text: str,
+    x: float = 100,
+    y: float = 100,
+    width: float = 500,
+    height: float = 300,
+) -> dict:
+    """Add a text box with content to a specific slide."""
+    batch = PresentationBatch(presentation_id)
+    element_id = batch.add_text_box(slide_id, text, x, y, width, height)
+    batch.flush()
     return {"status": "success", "elementId": element_id, "presentationId": presentation_id}
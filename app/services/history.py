@@ -0,0 +1,150 @@
+"""Conversation history manager – keeps the prompt within a token budget.
+
+Instead of keeping the last N messages regardless of their size, the history
+is measured in (estimated) tokens. When it grows past ``HISTORY_TOKEN_BUDGET``
+the older turns are folded into a running summary that is kept as the first
+message, and only the most recent turns are sent verbatim.
+"""
+
+import logging
+
+from app.config import settings
+from app.services import llm_client, tracing
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Önceki konuşmanın özeti:\n"
+
+SUMMARY_PROMPT = """Aşağıda bir kullanıcı ile asistanı arasındaki konuşmanın eski bölümü var.
+Bunu, konuşmanın devamı için gereken bilgileri (kullanıcının istekleri, alınan kararlar,
+oluşturulan/kullanılan dosya ve belge kimlikleri, bağlantılar, tarihler) koruyarak kısa
+ve maddeler halinde Türkçe özetle. Yalnızca özeti yaz."""
+
+# Per-message overhead of the chat format (role, separators)
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) without a tokenizer."""
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message.get("content") or "") + _MESSAGE_OVERHEAD
+
+
+def history_tokens(history: list[dict]) -> int:
+    return sum(message_tokens(m) for m in history)
+
+
+def is_summary(message: dict) -> bool:
+    return message.get("role") == "system" and (message.get("content") or "").startswith(SUMMARY_PREFIX)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of ``text`` so it fits in ``max_tokens``."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]}\n…[{len(text) - 2 * half} karakter kısaltıldı]…\n{text[-half:]}"
+
+
+def _split_recent(messages: list[dict], budget: int) -> int:
+    """Index where the verbatim tail starts: as many recent turns as fit in ``budget``.
+
+    The split always lands on a user message so question/answer pairs stay
+    together, and at least the last turn is kept.
+    """
+    used = 0
+    split = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += message_tokens(messages[i])
+        if used > budget and split < len(messages):
+            break
+        if messages[i].get("role") == "user":
+            split = i
+    return split
+
+
+def _extractive_summary(previous: str, messages: list[dict]) -> str:
+    """Fallback summary when the LLM is unavailable: clipped first lines of each turn."""
+    lines = [previous] if previous else []
+    for message in messages:
+        content = " ".join((message.get("content") or "").split())
+        if content:
+            role = "Kullanıcı" if message.get("role") == "user" else "Asistan"
+            lines.append(f"- {role}: {content[:200]}")
+    return "\n".join(lines)
+
+
+async def _summarise(previous: str, messages: list[dict]) -> str:
+    transcript = "\n\n".join(
+        f"{'Kullanıcı' if m.get('role') == 'user' else 'Asistan'}: {m.get('content') or ''}"
+        for m in messages
+    )
+    if previous:
+        transcript = f"Önceki özet:\n{previous}\n\n{transcript}"
+
+    model = settings.HISTORY_SUMMARY_MODEL or settings.AI_MODEL
+    try:
+        with tracing.span("llm.completion", model=model, purpose="summary"):
+            response = await llm_client.get_client().post(
+                "/chat/completions",
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": _truncate(transcript, settings.HISTORY_TOKEN_BUDGET * 2)},
+                    ],
+                    "temperature": 0.2,
+                    "max_tokens": settings.HISTORY_SUMMARY_TOKENS,
+                },
+            )
+            response.raise_for_status()
+            data = response.json()
+            tracing.record_usage(data.get("usage"))
+        summary = data["choices"][0]["message"]["content"] or ""
+    except Exception as e:
+        logger.warning("History summarisation failed, using extractive summary: %s", e)
+        summary = _extractive_summary(previous, messages)
+
+    return _truncate(summary.strip(), settings.HISTORY_SUMMARY_TOKENS)
+
+
+async def compact_history(history: list[dict]) -> tuple[list[dict], int]:
+    """Enforce the token budget on ``history``.
+
+    Returns ``(history, tokens_saved)``; the list is returned unchanged (and
+    ``tokens_saved`` is 0) while it fits in the budget.
+    """
+    budget = settings.HISTORY_TOKEN_BUDGET
+    before = history_tokens(history)
+    if before <= budget:
+        return history, 0
+
+    previous = ""
+    turns = history
+    if history and is_summary(history[0]):
+        previous = history[0]["content"][len(SUMMARY_PREFIX):]
+        turns = history[1:]
+
+    recent_budget = budget - settings.HISTORY_SUMMARY_TOKENS
+    split = _split_recent(turns, recent_budget)
+    older, recent = turns[:split], turns[split:]
+
+    # A single huge message (e.g. an echoed document) can still blow the budget
+    recent = [
+        dict(m, content=_truncate(m["content"], recent_budget // 2))
+        if message_tokens(m) > recent_budget // 2 else m
+        for m in recent
+    ]
+
+    compacted = list(recent)
+    if older or previous:
+        summary = await _summarise(previous, older) if older else previous
+        compacted.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary})
+
+    saved = before - history_tokens(compacted)
+    logger.info("History compacted: %d -> %d tokens (saved %d)", before, before - saved, saved)
+    return compacted, max(saved, 0)
@@ -0,0 +1,60 @@
+"""Shared HTTP client for LLM calls.
+
+One ``httpx.AsyncClient`` is opened for the lifetime of the app (see the
+lifespan in ``app/main.py``) so consecutive LLM round trips reuse pooled
+keep-alive connections instead of paying a new TCP+TLS handshake each time.
+HTTP/2 is negotiated via ALPN when the backend supports it.
+"""
+
+from typing import Optional
+
+import httpx
+
+from app.config import settings
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=settings.AI_BASE_URL,
+        headers={
+            "Authorization": f"Bearer {settings.AI_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        http2=settings.AI_HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.AI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.AI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.AI_CONNECT_TIMEOUT,
+            read=settings.AI_READ_TIMEOUT,
+            write=settings.AI_CONNECT_TIMEOUT,
+            pool=settings.AI_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+async def open_client():
+    """Open the shared client (called on app start-up)."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+
+
+async def close_client():
+    """Close the shared client and its pooled connections (called on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily outside the app lifespan."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
@@ -0,0 +1,280 @@
+"""Result shaping – keeps tool results fed back to the LLM within a size budget.
+
+A ``sheets_read`` of ``A1:Z1000``, a long ``docs_read`` or a big
+``slides_get`` would otherwise push tens of thousands of tokens into the
+next LLM call. ``shape()`` passes small results through unchanged and
+replaces large ones with a bounded preview:
+
+- sheets: header, first/last rows and per-column statistics
+- documents / e-mails: head and tail excerpts of the text
+- slide decks and lists: the first items
+
+The full result is kept in memory under a handle that the LLM can page
+through with the ``result_page`` tool.
+"""
+
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.config import settings
+from app.services import users
+
+# Per-tool budget (characters of compact JSON) overriding TOOL_RESULT_MAX_CHARS
+TOOL_BUDGETS = {
+    "sheets_read": 4000,
+    "sheets_batch_read": 6000,
+    "slides_get": 4000,
+    "gmail_get_message": 4000,
+}
+
+PAGE_HINT = "Sonuç kısaltıldı. Devamını görmek için result_page aracını bu handle ile çağır."
+
+# handle -> (user, tool, data)
+_store: "OrderedDict[str, tuple[Optional[str], str, Any]]" = OrderedDict()
+_store_lock = threading.Lock()
+
+
+def to_json(result: Any) -> str:
+    """Compact JSON used for everything sent back to the LLM."""
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _remember(tool: str, data: Any) -> str:
+    handle = f"res_{uuid.uuid4().hex[:10]}"
+    with _store_lock:
+        _store[handle] = (users.current_user(), tool, data)
+        while len(_store) > settings.TOOL_RESULT_STORE_SIZE:
+            _store.popitem(last=False)
+    return handle
+
+
+def _excerpt(text: str, budget: int) -> dict:
+    half = max(budget * 2 // 5, 200)
+    return {
+        "head": text[:half],
+        "tail": text[-half:],
+        "totalChars": len(text),
+    }
+
+
+def _to_number(value: Any):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.replace(",", ".")) if value.strip() else None
+        except ValueError:
+            return None
+    return None
+
+
+def _column_stats(header: list, rows: list[list]) -> list[dict]:
+    width = max([len(header)] + [len(r) for r in rows[:1000]]) if rows or header else 0
+    stats = []
+    for col in range(width):
+        cells = [r[col] for r in rows if col < len(r) and r[col] not in ("", None)]
+        numbers = [n for n in (_to_number(c) for c in cells) if n is not None]
+        entry = {
+            "column": header[col] if col < len(header) and header[col] != "" else f"#{col + 1}",
+            "nonEmpty": len(cells),
+        }
+        if numbers and len(numbers) >= len(cells) / 2:
+            entry.update({
+                "min": min(numbers),
+                "max": max(numbers),
+                "sum": round(sum(numbers), 4),
+                "mean": round(sum(numbers) / len(numbers), 4),
+            })
+        else:
+            entry["distinct"] = len(set(map(str, cells)))
+        stats.append(entry)
+    return stats
+
+
+def _shape_sheet(result: dict, budget: int) -> dict:
+    values = result.get("values", [])
+    header, rows = (values[0], values[1:]) if values else ([], [])
+    head_rows, tail_rows = settings.TOOL_RESULT_SAMPLE_ROWS, max(settings.TOOL_RESULT_SAMPLE_ROWS // 2, 1)
+    shaped = {
+        "spreadsheetId": result.get("spreadsheetId"),
+        "range": result.get("range"),
+        "totalRows": len(rows),
+        "header": header,
+        "firstRows": rows[:head_rows],
+        "lastRows": rows[-tail_rows:] if len(rows) > head_rows else [],
+        "columnStats": _column_stats(header, rows),
+    }
+    # Very wide sheets: trim the samples until they fit
+    while len(to_json(shaped)) > budget and (shaped["firstRows"] or shaped["lastRows"]):
+        shaped["firstRows"] = shaped["firstRows"][: len(shaped["firstRows"]) // 2]
+        shaped["lastRows"] = shaped["lastRows"][: len(shaped["lastRows"]) // 2]
+    return shaped
+
+
+def _shape_columnar(result: dict, budget: int) -> dict:
+    """Columnar sheet data: sample values and statistics per column."""
+    sample = settings.TOOL_RESULT_SAMPLE_ROWS
+    columns = []
+    for column in result.get("columns", []):
+        entry = {"name": column["name"], "type": column["type"], "firstValues": column["values"][:sample]}
+        stats = _column_stats([column["name"]], [[v] for v in column["values"]])[0]
+        entry.update({k: v for k, v in stats.items() if k != "column"})
+        columns.append(entry)
+    shaped = {"range": result.get("range"), "rowCount": result.get("rowCount"), "columns": columns}
+    while len(to_json(shaped)) > budget and sample > 1:
+        sample //= 2
+        for column in columns:
+            column["firstValues"] = column["firstValues"][:sample]
+    return shaped
+
+
+def _shape_ranges(result: dict, budget: int) -> dict:
+    """Several ranges: each gets an equal share of the budget."""
+    ranges = result.get("ranges", [])
+    share = max(budget // max(len(ranges), 1), 500)
+    shaped = []
+    for entry in ranges:
+        if "columns" in entry:
+            shaped.append(_shape_columnar(entry, share))
+        else:
+            shaped.append(_shape_sheet(entry, share))
+    return {"spreadsheetId": result.get("spreadsheetId"), "ranges": shaped}
+
+
+def _shape_slides(result: dict, budget: int) -> dict:
+    shaped = {k: v for k, v in result.items() if k != "slides"}
+    slides = []
+    for slide in result.get("slides", []):
+        candidate = slides + [slide]
+        if len(to_json(dict(shaped, slides=candidate))) > budget:
+            break
+        slides = candidate
+    shaped["slides"] = slides
+    shaped["shownSlides"] = len(slides)
+    return shaped
+
+
+def _shape_text_field(result: dict, field: str, budget: int) -> dict:
+    shaped = dict(result)
+    shaped[field] = _excerpt(result.get(field, ""), budget)
+    return shaped
+
+
+def _shape_list(items: list, budget: int) -> dict:
+    shown = []
+    used = 2
+    for item in items:
+        size = len(to_json(item)) + 1
+        if used + size > budget:
+            break
+        shown.append(item)
+        used += size
+    return {"items": shown, "shownItems": len(shown), "totalItems": len(items)}
+
+
+def shape(tool: str, result: dict) -> dict:
+    """Return ``result`` (``{"result": ...}`` or ``{"error": ...}``) within the tool's budget.
+
+    Keys next to ``result`` (e.g. a ``note``) are passed through.
+    """
+    data = result.get("result")
+    if data is None or tool == "result_page":
+        # Pages are already cut to the budget by page()
+        return result
+    budget = TOOL_BUDGETS.get(tool, settings.TOOL_RESULT_MAX_CHARS)
+    if len(to_json(data)) <= budget:
+        return result
+
+    if tool == "sheets_read" and isinstance(data, dict):
+        shaped = _shape_sheet(data, budget)
+    elif tool == "sheets_batch_read" and isinstance(data, dict):
+        shaped = _shape_ranges(data, budget)
+    elif tool == "slides_get" and isinstance(data, dict):
+        shaped = _shape_slides(data, budget)
+    elif tool == "docs_read" and isinstance(data, dict):
+        shaped = _shape_text_field(data, "content", budget)
+    elif tool == "gmail_get_message" and isinstance(data, dict):
+        shaped = _shape_text_field(data, "body", budget)
+    elif isinstance(data, list):
+        shaped = _shape_list(data, budget)
+    elif isinstance(data, str):
+        shaped = _excerpt(data, budget)
+    else:
+        shaped = _excerpt(to_json(data), budget)
+
+    shaped["truncated"] = True
+    shaped["handle"] = _remember(tool, data)
+    shaped["hint"] = PAGE_HINT
+    return dict(result, result=shaped)
+
+
+def _fit(envelope: dict, key: str, items: list, offset: int, limit: Optional[int], budget: int) -> dict:
+    """``envelope`` with items from ``offset`` under ``key``, as many as fit in ``budget``.
+
+    At most ``limit`` items; at least one, so paging always moves forward.
+    """
+    used = len(to_json(dict(envelope, **{key: [], "nextOffset": len(items)})))
+    shown = []
+    for item in items[offset:offset + limit] if limit else items[offset:]:
+        size = len(to_json(item)) + 1
+        if shown and used + size > budget:
+            break
+        shown.append(item)
+        used += size
+    return dict(envelope, **{key: shown, "nextOffset": offset + len(shown)})
+
+
+def _fit_text(envelope: dict, text: str, offset: int, limit: Optional[int], budget: int) -> dict:
+    """``envelope`` with the text from ``offset``, as much as fits in ``budget`` once escaped."""
+    room = max(budget - len(to_json(dict(envelope, text="", nextOffset=len(text)))), 1)
+    chunk = text[offset:offset + min(int(limit or room), room)]
+    # Quotes, backslashes and control characters grow when escaped
+    while len(chunk) > 1 and len(to_json(chunk)) - 2 > room:
+        chunk = chunk[:max(len(chunk) - (len(to_json(chunk)) - 2 - room), 1)]
+    return dict(envelope, text=chunk, nextOffset=offset + len(chunk))
+
+
+def page(handle: str, offset: int = 0, limit: Optional[int] = None) -> dict:
+    """Return a slice of a result previously shortened by ``shape()``.
+
+    Rows for sheets, slides for decks, items for lists and characters for
+    text: at most ``limit`` of them, and never more than fit within the
+    ``result_page`` budget, so a page is not shortened again.
+    """
+    with _store_lock:
+        entry = _store.get(handle)
+        if entry is not None:
+            _store.move_to_end(handle)
+    if entry is None or entry[0] != users.current_user():
+        raise ValueError(f"Sonuç bulunamadı veya süresi doldu: {handle}")
+    _, tool, data = entry
+    offset = max(int(offset), 0)
+    limit = int(limit) if limit else None
+    budget = TOOL_BUDGETS.get("result_page", settings.TOOL_RESULT_MAX_CHARS)
+
+    if tool == "sheets_read" and isinstance(data, dict):
+        values = data.get("values", [])
+        header, rows = (values[0], values[1:]) if values else ([], [])
+        envelope = {"handle": handle, "header": header, "offset": offset, "totalRows": len(rows)}
+        return _fit(envelope, "rows", rows, offset, limit, budget)
+    if tool == "slides_get" and isinstance(data, dict):
+        slides = data.get("slides", [])
+        envelope = {"handle": handle, "offset": offset, "totalSlides": len(slides)}
+        return _fit(envelope, "slides", slides, offset, limit, budget)
+    if isinstance(data, list):
+        envelope = {"handle": handle, "offset": offset, "totalItems": len(data)}
+        return _fit(envelope, "items", data, offset, limit, budget)
+
+    if tool == "docs_read" and isinstance(data, dict):
+        text = data.get("content", "")
+    elif tool == "gmail_get_message" and isinstance(data, dict):
+        text = data.get("body", "")
+    elif isinstance(data, str):
+        text = data
+    else:
+        text = to_json(data)
+    envelope = {"handle": handle, "offset": offset, "totalChars": len(text)}
+    return _fit_text(envelope, text, offset, limit, budget)
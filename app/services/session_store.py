@@ -0,0 +1,404 @@
+"""Conversation session storage.
+
+``SessionStore`` is the interface the chat routes use to load and save the
+history of a session. Two implementations:
+
+- ``MemorySessionStore``: in-process LRU capped by the total (approximate)
+  size of the stored messages, with an idle TTL. Nothing survives a restart.
+- ``SqliteSessionStore``: the same LRU as a read cache in front of a SQLite
+  database. Saves are write-behind: they land in memory immediately and a
+  background thread writes the dirty sessions in one transaction every
+  SESSION_FLUSH_INTERVAL seconds (and on shutdown). With an interval of 0
+  (what multi-worker mode uses) every save is written synchronously, so
+  other workers see it on their next read; otherwise they see it only after
+  the next flush.
+
+Each row carries a version, so workers sharing the database notice when
+another worker has updated a session. A save only replaces the version it
+was based on – the one this worker last read or wrote, remembered even when
+the session itself has left the cache (compare-and-swap); if another worker
+saved the session in between, the save is rejected as a conflict, counted in
+the stats and – for synchronous saves – raised as ``SessionConflict``.
+
+Messages are kept as ``__slots__`` records rather than dicts.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = settings.SESSION_STORE_PATH or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "sessions.db"
+)
+
+
+class Message:
+    """One history entry; roles are interned so they are shared, not copied."""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def to_dict(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+    @classmethod
+    def from_dict(cls, message: dict) -> "Message":
+        return cls(message.get("role", "user"), message.get("content") or "")
+
+
+class SessionConflict(Exception):
+    """Another worker saved the session since this one loaded it."""
+
+    def __init__(self, session_id: str):
+        super().__init__("Bu konuşma başka bir istekte güncellendi; lütfen mesajınızı tekrar gönderin.")
+        self.session_id = session_id
+
+
+class _Session:
+    __slots__ = ("messages", "size", "touched", "version")
+
+    def __init__(self, messages: tuple, version: int = 0):
+        self.messages = messages
+        # Content dominates; the per-message constant covers the record itself
+        self.size = sum(len(m.content) for m in messages) + 64 * len(messages)
+        self.touched = time.time()
+        self.version = version
+
+
+def _pack(history: list[dict]) -> tuple:
+    return tuple(Message.from_dict(m) for m in history)
+
+
+class SessionStore:
+    """Interface for conversation storage."""
+
+    def get(self, session_id: str) -> list[dict]:
+        raise NotImplementedError
+
+    def put(self, session_id: str, history: list[dict]):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def close(self):
+        """Persist anything pending (called on shutdown)."""
+
+    def acquire_lease(self, session_id: str, owner: str, ttl: float) -> bool:
+        """Try to make ``owner`` the only process running turns of the session.
+
+        In-process stores have nothing to share; the asyncio lock in
+        ``turns`` is enough, so the lease is always granted.
+        """
+        return True
+
+    def release_lease(self, session_id: str, owner: str):
+        pass
+
+    def get_stats(self) -> dict:
+        return {}
+
+
+class MemorySessionStore(SessionStore):
+    """In-memory LRU bounded by ``max_bytes``, dropping sessions idle for ``ttl`` seconds."""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _drop(self, session_id: str) -> Optional[_Session]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+        return session
+
+    def _expire(self, now: float):
+        # The LRU order is also the idle order: stop at the first live session
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.touched <= self.ttl:
+                break
+            self._drop(session_id)
+
+    def lookup(self, session_id: str) -> Optional[_Session]:
+        with self._lock:
+            self._expire(time.time())
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def store(self, session_id: str, session: _Session) -> list[str]:
+        """Insert ``session``; returns the ids evicted to stay within the budget."""
+        evicted = []
+        with self._lock:
+            self._drop(session_id)
+            self._sessions[session_id] = session
+            self._bytes += session.size
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._drop(oldest)
+                evicted.append(oldest)
+                self.evictions += 1
+        return evicted
+
+    def get(self, session_id: str) -> list[dict]:
+        session = self.lookup(session_id)
+        return [m.to_dict() for m in session.messages] if session else []
+
+    def put(self, session_id: str, history: list[dict]):
+        self.store(session_id, _Session(_pack(history)))
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes, "evictions": self.evictions}
+
+
+# Sessions whose last seen version is remembered (far more than are cached)
+_SEEN_LIMIT = 100_000
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite-backed sessions with an in-memory LRU and write-behind batching."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: float, flush_interval: float):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache = MemorySessionStore(max_bytes, ttl)
+        self._dirty: dict[str, Optional[_Session]] = {}
+        self._dirty_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, version INTEGER, updated_at REAL, data TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (session_id TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+        )
+        self._conn.commit()
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+            self._flusher.start()
+        self.flushes = 0
+        self.conflicts = 0
+        # Version each session had when this worker last read or wrote it
+        self._seen: "OrderedDict[str, int]" = OrderedDict()
+        self._seen_lock = threading.Lock()
+
+    def _see(self, session_id: str, version: int):
+        with self._seen_lock:
+            self._seen[session_id] = version
+            self._seen.move_to_end(session_id)
+            while len(self._seen) > _SEEN_LIMIT:
+                self._seen.popitem(last=False)
+
+    def _version(self, session_id: str) -> Optional[int]:
+        with self._db_lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def _load(self, session_id: str) -> Optional[_Session]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version, updated_at, data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        messages = tuple(Message(role, content) for role, content in json.loads(row[2]))
+        return _Session(messages, row[0])
+
+    def get(self, session_id: str) -> list[dict]:
+        with self._dirty_lock:
+            pending = session_id in self._dirty
+            session = self._dirty.get(session_id)
+        if not pending:
+            session = self._cache.lookup(session_id)
+            # Another worker may have written the session since we cached it
+            version = self._version(session_id)
+            if session is None or version != session.version:
+                session = self._load(session_id) if version is not None else None
+                if session is not None:
+                    self._cache.store(session_id, session)
+            # The next put() is based on this, whatever the cache does meanwhile
+            self._see(session_id, version or 0)
+        return [m.to_dict() for m in session.messages] if session else []
+
+    def put(self, session_id: str, history: list[dict]):
+        """Save ``history`` as the version after the one this worker last read or wrote.
+
+        Raises ``SessionConflict`` (synchronous mode only) if another worker
+        saved the session in the meantime; the newer stored copy is kept.
+        """
+        session = _Session(_pack(history))
+        with self._dirty_lock:
+            pending = self._dirty.get(session_id)
+        if pending is not None:
+            # Replaces an unflushed save: based on the same stored version
+            session.version = pending.version
+        else:
+            with self._seen_lock:
+                base = self._seen.get(session_id)
+            if base is None:
+                # Never read here (e.g. a new session)
+                base = self._version(session_id) or 0
+            session.version = base + 1
+        if self.flush_interval <= 0:
+            if self._write({session_id: session}, time.time()):
+                raise SessionConflict(session_id)
+            self._cache.store(session_id, session)
+            self._see(session_id, session.version)
+            return
+        self._cache.store(session_id, session)
+        self._see(session_id, session.version)
+        with self._dirty_lock:
+            self._dirty[session_id] = session
+
+    def delete(self, session_id: str):
+        self._cache.delete(session_id)
+        with self._seen_lock:
+            self._seen.pop(session_id, None)
+        if self.flush_interval <= 0:
+            self._write({session_id: None}, time.time())
+            return
+        with self._dirty_lock:
+            self._dirty[session_id] = None
+
+    def acquire_lease(self, session_id: str, owner: str, ttl: float) -> bool:
+        """Take (or extend) the session's lease unless another live owner holds it."""
+        now = time.time()
+        with self._db_lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT owner, expires FROM leases WHERE session_id = ?", (session_id,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            self._conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (session_id, owner, now + ttl))
+        return True
+
+    def release_lease(self, session_id: str, owner: str):
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+    def flush(self):
+        """Write all pending sessions in one transaction and drop expired rows."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, {}
+        now = time.time()
+        try:
+            self._write(dirty, now)
+        except Exception:
+            # Keep the sessions pending unless they were saved again meanwhile
+            with self._dirty_lock:
+                for session_id, session in dirty.items():
+                    self._dirty.setdefault(session_id, session)
+            raise
+        if dirty:
+            self.flushes += 1
+
+    def _write(self, dirty: dict[str, Optional[_Session]], now: float) -> list[str]:
+        """Write ``dirty`` in one transaction; returns the ids rejected as conflicts."""
+        conflicts = []
+        with self._db_lock, self._conn:
+            # Take the write lock before reading so the version checks are atomic across workers
+            self._conn.execute("BEGIN IMMEDIATE")
+            for session_id, session in dirty.items():
+                if session is None:
+                    self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    continue
+                row = self._conn.execute(
+                    "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if (row[0] if row else 0) != session.version - 1:
+                    conflicts.append(session_id)
+                    continue
+                data = json.dumps(
+                    [[m.role, m.content] for m in session.messages], ensure_ascii=False, separators=(",", ":")
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                    (session_id, session.version, now, data),
+                )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+        for session_id in conflicts:
+            # Our copy lost; the next get() loads the one the other worker saved
+            self._cache.delete(session_id)
+            with self._seen_lock:
+                self._seen.pop(session_id, None)
+            self.conflicts += 1
+            logger.warning("Session %s was saved by another worker; discarded this worker's copy", session_id)
+        return conflicts
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Session flush failed, will retry: %s", e)
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+        self._conn.close()
+
+    def get_stats(self) -> dict:
+        with self._dirty_lock:
+            pending = len(self._dirty)
+        with self._db_lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return dict(
+            self._cache.get_stats(), stored=stored, pending=pending, flushes=self.flushes, conflicts=self.conflicts
+        )
+
+
+_store: Optional[SessionStore] = None
+
+
+def get_store() -> SessionStore:
+    """The store selected by SESSION_STORE ("memory" or "sqlite"), created on first use."""
+    global _store
+    if _store is None:
+        if settings.SESSION_STORE == "sqlite":
+            _store = SqliteSessionStore(
+                STORE_PATH,
+                settings.SESSION_MAX_BYTES,
+                settings.SESSION_TTL,
+                settings.SESSION_FLUSH_INTERVAL,
+            )
+        else:
+            _store = MemorySessionStore(settings.SESSION_MAX_BYTES, settings.SESSION_TTL)
+    return _store
+
+
+def close_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
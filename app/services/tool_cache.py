@@ -0,0 +1,170 @@
+"""Result cache for read-only Google tools.
+
+Read tools are cached by tool name plus normalised arguments, each with its
+own TTL, in an LRU bounded by the (approximate) byte size of the results.
+When an entry has expired but the server handed out an ETag for the single
+GET behind it, the entry is revalidated with ``If-None-Match`` instead of
+being fetched again.
+
+Write tools invalidate what they can affect: entries for the same resource
+(e.g. ``docs_read`` of the ``document_id`` that ``docs_append_text`` just
+changed) and the listings of that service.
+
+Entries belong to the user who made the call and are never served to, or
+invalidated by, anyone else.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from app.config import settings
+from app.services import users
+from app.services.google_clients import NotModified, conditional_requests
+from app.services.tool_executor import READ_ONLY_TOOLS, resource_key
+
+# Seconds a cached result is served without asking Google again
+TOOL_TTLS = {
+    "drive_list_files": 60,
+    "drive_search_files": 60,
+    "calendar_list_events": 30,
+    "gmail_list_messages": 30,
+    "gmail_get_message": 600,
+    "docs_read": 120,
+    "sheets_read": 60,
+    "sheets_batch_read": 60,
+    "sheets_query": 60,
+    "slides_get": 120,
+    "workspace_search": 60,
+}
+
+# Listings that any write to the given service can change
+_LISTINGS = {
+    "drive": ("drive_list_files", "drive_search_files", "workspace_search"),
+    "docs": ("drive_list_files", "drive_search_files", "workspace_search"),
+    "sheets": ("drive_list_files", "drive_search_files", "workspace_search"),
+    "slides": ("drive_list_files", "drive_search_files", "workspace_search"),
+    "calendar": ("calendar_list_events",),
+    "gmail": ("gmail_list_messages",),
+}
+
+
+class _Entry:
+    __slots__ = ("user", "tool", "value", "size", "expires", "etags", "resource")
+
+    def __init__(self, tool: str, value: dict, size: int, expires: float, etags: dict, resource: Optional[str]):
+        self.user = users.current_user()
+        self.tool = tool
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.etags = etags
+        self.resource = resource
+
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()
+_total_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+
+
+def _normalise(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.isdigit() else value
+    if isinstance(value, dict):
+        return {k: _normalise(v) for k, v in value.items() if v not in (None, "")}
+    if isinstance(value, list):
+        return [_normalise(v) for v in value]
+    return value
+
+
+def cache_key(name: str, args: dict) -> str:
+    return users.scoped(name) + ":" + json.dumps(_normalise(args or {}), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def _drop(key: str):
+    global _total_bytes
+    entry = _entries.pop(key, None)
+    if entry is not None:
+        _total_bytes -= entry.size
+
+
+def _store(key: str, entry: _Entry):
+    global _total_bytes
+    if entry.size > settings.TOOL_CACHE_MAX_BYTES // 4:
+        return
+    with _lock:
+        _drop(key)
+        _entries[key] = entry
+        _total_bytes += entry.size
+        while _total_bytes > settings.TOOL_CACHE_MAX_BYTES and _entries:
+            _drop(next(iter(_entries)))
+            _stats["evictions"] += 1
+
+
+def invalidate_for(name: str, args: dict):
+    """Drop the cached entries a write tool call can have made stale."""
+    service = name.split("_", 1)[0]
+    listings = _LISTINGS.get(service, ())
+    resource = resource_key({"tool": name, "args": args})
+    user_id = users.current_user()
+    with _lock:
+        stale = [
+            k for k, e in _entries.items()
+            if e.user == user_id and (e.tool in listings or (resource and e.resource == resource))
+        ]
+        for key in stale:
+            _drop(key)
+
+
+def clear(user_id: Optional[str] = None):
+    """Drop the entries of ``user_id`` (e.g. when their Google account changes), or everything."""
+    with _lock:
+        for key in [k for k, e in _entries.items() if user_id is None or e.user == user_id]:
+            _drop(key)
+
+
+def call(func: Callable[[str, dict], dict], name: str, args: dict) -> dict:
+    """Run ``func(name, args)`` through the cache. Blocking – runs on a tool worker."""
+    ttl = TOOL_TTLS.get(name)
+    if not settings.TOOL_CACHE_ENABLED or ttl is None:
+        result = func(name, args)
+        if name not in READ_ONLY_TOOLS:
+            invalidate_for(name, args)
+        return result
+
+    key = cache_key(name, args)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            if entry.expires > time.monotonic():
+                _stats["hits"] += 1
+                return entry.value
+
+    etags = entry.etags if entry is not None else {}
+    try:
+        with conditional_requests(etags) as ctx:
+            result = func(name, args)
+    except NotModified:
+        with _lock:
+            entry.expires = time.monotonic() + ttl
+            _stats["revalidated"] += 1
+        return entry.value
+
+    with _lock:
+        _stats["misses"] += 1
+    if "error" not in result:
+        # ETags are only meaningful when the tool is a single GET
+        seen = ctx.seen if ctx.requests == 1 else {}
+        size = len(json.dumps(result, ensure_ascii=False, default=str))
+        _store(key, _Entry(name, result, size, time.monotonic() + ttl, seen, resource_key({"tool": name, "args": args})))
+    return result
+
+
+def get_stats() -> dict:
+    with _lock:
+        return dict(_stats, entries=len(_entries), bytes=_total_bytes)
@@ -0,0 +1,244 @@
+"""Tool executor – runs blocking Google tool calls off the event loop.
+
+The googleapiclient functions are synchronous, so calling them from inside
+``async def chat`` blocks uvicorn's event loop for the whole HTTP round trip.
+This module hands every tool call to a bounded thread pool and additionally
+limits how many calls per Google service may run at once, so a burst of
+Gmail calls cannot starve Drive (or the other way around).
+
+Queue-depth and latency counters are kept per service and exposed through
+``get_stats()``.
+
+``run_tool_calls`` executes all tool calls of one LLM turn: independent calls
+run concurrently, while calls that write to the same resource (same
+``document_id``, ``spreadsheet_id``, ...) keep their original order.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# asyncio primitives are bound to the loop that created them, so they are
+# created lazily from inside the running loop.
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+_stats: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+# Tools that never modify anything in the user's Google account.
+READ_ONLY_TOOLS = {
+    "drive_list_files",
+    "drive_search_files",
+    "drive_download_file",
+    "docs_read",
+    "sheets_read",
+    "sheets_batch_read",
+    "sheets_query",
+    "slides_get",
+    "calendar_list_events",
+    "gmail_list_messages",
+    "gmail_get_message",
+    "result_page",
+    "workspace_search",
+}
+
+# Arguments that identify the Google resource a tool call operates on.
+RESOURCE_ARGS = (
+    "document_id",
+    "spreadsheet_id",
+    "presentation_id",
+    "event_id",
+    "file_id",
+    "message_id",
+)
+
+
+def _service_of(tool_name: str) -> str:
+    """Map a tool name (e.g. ``gmail_list_messages``) to its service (``gmail``)."""
+    return tool_name.split("_", 1)[0]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.TOOL_WORKERS,
+                    thread_name_prefix="tool",
+                )
+    return _executor
+
+
+def _semaphore_for(service: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(service)
+    if sem is None:
+        default = settings.DRIVE_DOWNLOAD_CONCURRENCY if service == "download" else settings.TOOL_SERVICE_CONCURRENCY
+        limit = settings.TOOL_SERVICE_LIMITS.get(service, default)
+        sem = asyncio.Semaphore(max(1, limit))
+        _semaphores[service] = sem
+    return sem
+
+
+def _stats_for(service: str) -> dict:
+    stats = _stats.get(service)
+    if stats is None:
+        stats = {
+            "queued": 0,
+            "running": 0,
+            "completed": 0,
+            "max_queued": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+        _stats[service] = stats
+    return stats
+
+
+def _run(stats: dict, ticket: dict, func: Callable, *args):
+    """Worker-thread body: move the call from 'queued' to 'running' and execute it."""
+    started = time.perf_counter()
+    with _stats_lock:
+        if ticket["cancelled"]:
+            # The caller gave up after the thread picked the call up but before
+            # it got here; the caller already took it off 'queued'
+            return None
+        ticket["started"] = True
+        stats["queued"] -= 1
+        stats["running"] += 1
+        stats["wait_seconds"] += started - ticket["enqueued"]
+    try:
+        return func(*args)
+    finally:
+        with _stats_lock:
+            stats["running"] -= 1
+            stats["completed"] += 1
+            stats["run_seconds"] += time.perf_counter() - started
+
+
+async def run_blocking(service: str, func: Callable, *args):
+    """Run ``func(*args)`` on the worker pool under ``service``'s concurrency limit.
+
+    The call first waits for a slot in its service's concurrency limit, then
+    for a free worker thread. Cancelling the awaiting task drops the call if it
+    has not started yet; a call that is already running finishes in the
+    background and its result is discarded. The call runs in a copy of the
+    caller's context, so it acts for the same user (see ``users``).
+    """
+    # Whichever of _run ("started") and the caller ("cancelled") claims the
+    # ticket first under _stats_lock takes the call off 'queued'
+    ticket = {"started": False, "cancelled": False, "enqueued": time.perf_counter()}
+    with _stats_lock:
+        stats = _stats_for(service)
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+
+    try:
+        async with _semaphore_for(service):
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(_get_executor(), context.run, _run, stats, ticket, func, *args)
+    finally:
+        with _stats_lock:
+            if not ticket["started"]:
+                ticket["cancelled"] = True
+                stats["queued"] -= 1
+
+
+async def run_tool(func: Callable[[str, dict], dict], name: str, args: dict) -> dict:
+    """Run the tool call ``func(name, args)`` on the pool without blocking the loop."""
+    return await run_blocking(_service_of(name), func, name, args)
+
+
+def resource_key(call: dict) -> Optional[str]:
+    """Return ``"<arg>:<id>"`` for the Google resource a tool call targets, if any."""
+    args = call.get("args") or {}
+    if not isinstance(args, dict):
+        return None
+    for arg in RESOURCE_ARGS:
+        if args.get(arg):
+            return f"{arg}:{args[arg]}"
+    return None
+
+
+def plan_tool_calls(calls: list[dict]) -> list[list[int]]:
+    """Split the calls of one LLM turn into lanes that may run concurrently.
+
+    Each lane is a list of indices into ``calls`` that must run one after the
+    other. Every call touching a resource that is written to in this turn goes
+    into that resource's lane, in original order. Writes without a resource
+    key (sending mail, creating a new file, ...) share a single lane so their
+    side effects keep the order the model asked for. Everything else is
+    independent and gets a lane of its own.
+    """
+    written = set()
+    for call in calls:
+        key = resource_key(call)
+        if key and call.get("tool") not in READ_ONLY_TOOLS:
+            written.add(key)
+
+    lanes: list[list[int]] = []
+    lane_of: dict[str, list[int]] = {}
+    for i, call in enumerate(calls):
+        key = resource_key(call)
+        if key is None and call.get("tool") not in READ_ONLY_TOOLS:
+            key = "_unkeyed_writes"
+        elif key not in written:
+            key = None
+
+        if key is None:
+            lanes.append([i])
+        elif key in lane_of:
+            lane_of[key].append(i)
+        else:
+            lane_of[key] = [i]
+            lanes.append(lane_of[key])
+    return lanes
+
+
+async def run_tool_calls(func: Callable[[str, dict], dict], calls: list[dict]) -> list[dict]:
+    """Execute the tool calls of one LLM turn, returning results in call order."""
+    results: list[Optional[dict]] = [None] * len(calls)
+
+    async def run_lane(lane: list[int]):
+        for i in lane:
+            results[i] = await run_tool(func, calls[i]["tool"], calls[i]["args"])
+
+    await asyncio.gather(*(run_lane(lane) for lane in plan_tool_calls(calls)))
+    return results
+
+
+def get_stats() -> dict:
+    """Return a snapshot of the per-service queue depth and latency counters."""
+    with _stats_lock:
+        services = {}
+        for service, stats in _stats.items():
+            snapshot = dict(stats)
+            completed = stats["completed"]
+            snapshot["avg_wait_ms"] = round(stats["wait_seconds"] * 1000 / completed, 2) if completed else 0.0
+            snapshot["avg_run_ms"] = round(stats["run_seconds"] * 1000 / completed, 2) if completed else 0.0
+            services[service] = snapshot
+    return {
+        "workers": settings.TOOL_WORKERS,
+        "queued": sum(s["queued"] for s in services.values()),
+        "running": sum(s["running"] for s in services.values()),
+        "services": services,
+    }
+
+
+def shutdown(wait: bool = True):
+    """Stop the worker pool (called from the FastAPI lifespan on shutdown)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
+    _semaphores.clear()
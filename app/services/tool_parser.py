@@ -0,0 +1,159 @@
+"""Tool-call parser – extracts tool calls and cleans the reply in one pass.
+
+The LLM asks for a tool by emitting ``{"tool": ..., "args": {...}}``, either
+inside a code fence or as raw JSON in the text. ``parse_reply`` walks the
+reply once, left to right, and returns both the tool calls and the text with
+tool-call blocks and ``<think>`` sections removed.
+
+The walk only stops at interesting characters (found with precompiled
+regexes), brace matching understands JSON strings (so ``"}"`` inside an
+argument does not end the object), and every character is visited a bounded
+number of times, so the cost is linear in the length of the reply even for
+code-heavy answers full of braces.
+"""
+
+import json
+import re
+
+# Top-level markers: a raw JSON object, a code fence or a thinking block
+_TOP_LEVEL = re.compile(r"\{|```|<think>")
+# Inside an object: braces and string delimiters
+_IN_OBJECT = re.compile(r'[{}"]')
+# Inside a JSON string: escapes and the closing quote
+_IN_STRING = re.compile(r'[\\"]')
+# Optional language tag of a fenced tool call
+_FENCE_TAG = re.compile(r"(?:json|tool_call)?\s*")
+
+
+def object_end(content: str, start: int) -> int:
+    """Return the index just past the object opened at ``content[start]``, or -1."""
+    end, _ = _scan_object(content, start)
+    return end
+
+
+def _scan_object(content: str, start: int) -> tuple[int, list[int]]:
+    """Match the brace at ``start``.
+
+    Returns ``(end, [])`` when the object is balanced. When it never closes,
+    returns ``(-1, unclosed)`` where ``unclosed`` are the positions of the
+    braces still open at the end of the text (``start`` among them). Scanning
+    from any of those would end the same way, so callers can skip them.
+    """
+    # Start indices of the open braces
+    stack = [start]
+    pos = start + 1
+    in_string = False
+    while True:
+        if in_string:
+            m = _IN_STRING.search(content, pos)
+            if m is None:
+                break
+            if m.group() == "\\":
+                pos = m.end() + 1
+                continue
+            in_string = False
+            pos = m.end()
+            continue
+
+        m = _IN_OBJECT.search(content, pos)
+        if m is None:
+            break
+        char, i = m.group(), m.start()
+        pos = i + 1
+        if char == '"':
+            in_string = True
+        elif char == "{":
+            stack.append(i)
+        else:
+            stack.pop()
+            if not stack:
+                return i + 1, []
+
+    return -1, stack
+
+
+def _as_tool_call(text: str):
+    """Return ``text`` parsed as a tool call, or None."""
+    if '"tool"' not in text:
+        return None
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
+        return parsed
+    return None
+
+
+def _fenced_tool_call(inner: str):
+    """Return the tool call inside a code fence body, or None."""
+    body = inner[_FENCE_TAG.match(inner).end():].strip()
+    if body.startswith("{") and body.endswith("}"):
+        return _as_tool_call(body)
+    return None
+
+
+def parse_reply(content: str) -> tuple[list[dict], str]:
+    """Return ``(tool_calls, cleaned_text)`` for an assistant reply.
+
+    Tool calls in code fences take precedence: if any are present, raw JSON
+    tool calls are not returned (but are still removed from the text). Code
+    fences that do not hold a tool call are kept as they are.
+    """
+    fenced_calls = []
+    raw_calls = []
+    kept = []
+    pos = 0
+    # Braces known never to close (see _scan_object)
+    unclosed = set()
+
+    while True:
+        m = _TOP_LEVEL.search(content, pos)
+        if m is None:
+            kept.append(content[pos:])
+            break
+        token, i = m.group(), m.start()
+
+        if token == "<think>":
+            end = content.find("</think>", i + len(token))
+            if end == -1:
+                kept.append(content[pos:m.end()])
+                pos = m.end()
+                continue
+            kept.append(content[pos:i])
+            pos = end + len("</think>")
+            continue
+
+        if token == "```":
+            end = content.find("```", i + 3)
+            if end == -1:
+                kept.append(content[pos:m.end()])
+                pos = m.end()
+                continue
+            call = _fenced_tool_call(content[i + 3:end])
+            kept.append(content[pos:i])
+            if call is not None:
+                fenced_calls.append(call)
+            else:
+                kept.append(content[i:end + 3])
+            pos = end + 3
+            continue
+
+        end, still_open = _scan_object(content, i) if i not in unclosed else (-1, ())
+        if end == -1:
+            # The brace never closes: keep it as text and go on right after it,
+            # so later objects, fences and thinking blocks are still handled.
+            unclosed.update(still_open)
+            kept.append(content[pos:m.end()])
+            pos = m.end()
+            continue
+
+        kept.append(content[pos:i])
+        call = _as_tool_call(content[i:end])
+        if call is not None:
+            raw_calls.append(call)
+        else:
+            kept.append(content[i:end])
+        pos = end
+
+    return fenced_calls or raw_calls, "".join(kept).strip()
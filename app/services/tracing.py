@@ -0,0 +1,295 @@
+"""Span-based tracing of agent turns, plus Prometheus-style latency metrics.
+
+``span(name, **attributes)`` times a block and nests under the span that is
+current in the context, so a turn produces one trace: the ``turn`` span with
+``llm.completion``, ``agent.parse``, ``tool`` and ``google.api`` spans below
+it. Tool calls run on worker threads, which get the caller's context (see
+``tool_executor.run_blocking``), so their spans land in the right trace too.
+
+Finished spans are appended to TRACE_PATH as JSON lines whose fields follow
+the OTLP span model (``traceId``, ``spanId``, ``parentSpanId``, nanosecond
+timestamps, ``attributes``, ``status``) – queued and written in batches by a
+writer thread, so the event loop never waits on the file – and the durations of the spans in
+``_METRICS`` feed histograms rendered by ``render_metrics()`` for ``/metrics``.
+Metrics are per process; with several workers each reports its own.
+"""
+
+import bisect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACE_PATH = settings.TRACE_PATH and (
+    settings.TRACE_PATH if os.path.isabs(settings.TRACE_PATH)
+    else os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), settings.TRACE_PATH)
+)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Span name -> (histogram, label taken from the span's attributes, help)
+_METRICS = {
+    "turn": ("berrai_turn_duration_seconds", None, "Duration of a whole agent turn."),
+    "llm.completion": ("berrai_llm_request_duration_seconds", "model", "Duration of one LLM completion request."),
+    "agent.parse": ("berrai_parse_duration_seconds", None, "Time spent extracting tool calls from a reply."),
+    "tool": ("berrai_tool_duration_seconds", "tool", "Duration of one tool call on a worker thread."),
+    "google.api": ("berrai_google_api_duration_seconds", "method", "Duration of one Google API request."),
+}
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "root", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status = "unset"
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float = 1):
+        """Increment a counter attribute (safe from several worker threads)."""
+        with _counter_lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is disabled."""
+
+    attributes: dict = {}
+    status = "unset"
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key: str, amount: float = 1):
+        pass
+
+
+_NOOP = _NoopSpan()
+_counter_lock = threading.Lock()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """Time the block as a span named ``name``, child of the current span."""
+    if not settings.TRACING_ENABLED:
+        yield _NOOP
+        return
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        if current.status == "unset":
+            current.status = "error"
+            current.attributes["error.type"] = type(e).__name__
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # An async generator finished in another context than it started in
+            _current.set(None)
+        _finish(current)
+
+
+def current_span():
+    """The innermost open span (a no-op stand-in if there is none)."""
+    return _current.get() or _NOOP
+
+
+def annotate(**attributes):
+    """Set attributes on the current span."""
+    current_span().set(**attributes)
+
+
+# ---------------------------------------------------------------------------
+# Sinks
+# ---------------------------------------------------------------------------
+
+_sink_lock = threading.Lock()
+# JSON lines waiting for the writer thread; None asks it to stop
+_sink_queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+_writer: Optional[threading.Thread] = None
+
+
+def _write(record: dict):
+    global _writer
+    if _writer is None:
+        with _sink_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_lines, name="trace-writer", daemon=True)
+                _writer.start()
+    _sink_queue.put(json.dumps(record, ensure_ascii=False, default=str, separators=(",", ":")))
+
+
+def _write_lines():
+    """Append queued lines to TRACE_PATH, everything queued at once per write, until ``close()``."""
+    sink = None
+    while True:
+        lines = [_sink_queue.get()]
+        while True:
+            try:
+                lines.append(_sink_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in lines
+        lines = [line for line in lines if line is not None]
+        try:
+            if lines:
+                if sink is None:
+                    sink = open(TRACE_PATH, "a", encoding="utf-8")
+                sink.write("\n".join(lines) + "\n")
+                sink.flush()
+        except OSError as e:
+            logger.warning("Could not write trace to %s: %s", TRACE_PATH, e)
+        if stop:
+            if sink is not None:
+                sink.close()
+            return
+
+
+def _finish(finished: Span):
+    if finished.root is not finished:
+        # Per-trace totals on the root span: count.llm.completion, count.google.api, ...
+        finished.root.add(f"count.{finished.name}")
+    metric = _METRICS.get(finished.name)
+    if metric is not None:
+        name, label, _ = metric
+        _observe(name, finished.attributes.get(label, "") if label else None, finished.duration)
+    if TRACE_PATH:
+        _write(finished.to_dict())
+
+
+def close():
+    """Write out the queued spans and close the trace file (called on shutdown)."""
+    global _writer
+    with _sink_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        _sink_queue.put(None)
+        writer.join(timeout=5)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+# histogram -> label value -> [bucket counts..., +Inf count, sum]
+_histograms: dict[str, dict[Optional[str], list]] = {}
+# counter -> label value -> total
+_counters: dict[str, dict[str, float]] = {}
+_COUNTER_HELP = {
+    "berrai_llm_tokens_total": ("direction", "LLM tokens reported by the backend, prompt (in) and completion (out)."),
+}
+_metrics_lock = threading.Lock()
+
+
+def _observe(name: str, label: Optional[str], value: float):
+    with _metrics_lock:
+        series = _histograms.setdefault(name, {})
+        counts = series.get(label)
+        if counts is None:
+            counts = series[label] = [0] * (len(BUCKETS) + 1) + [0.0]
+        counts[bisect.bisect_left(BUCKETS, value)] += 1
+        counts[-1] += value
+
+
+def count(name: str, label: str, amount: float = 1):
+    """Add ``amount`` to the counter ``name`` (one of ``_COUNTER_HELP``)."""
+    if not settings.TRACING_ENABLED:
+        return
+    with _metrics_lock:
+        series = _counters.setdefault(name, {})
+        series[label] = series.get(label, 0) + amount
+
+
+def record_usage(usage: Optional[dict]):
+    """Attach an OpenAI-style ``usage`` block to the current span and the token counters."""
+    if not usage:
+        return
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    annotate(**{"llm.tokens_in": prompt, "llm.tokens_out": completion})
+    count("berrai_llm_tokens_total", "in", prompt)
+    count("berrai_llm_tokens_total", "out", completion)
+
+
+def _labels(key: str, value: Optional[str], extra: str = "") -> str:
+    parts = [f'{key}="{value}"'] if value is not None else []
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> str:
+    """All histograms and counters in the Prometheus text exposition format."""
+    lines = []
+    with _metrics_lock:
+        for name, label, help_text in _METRICS.values():
+            series = _histograms.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for value, counts in sorted(series.items(), key=lambda item: item[0] or ""):
+                value = _escape(value) if label else None
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _labels(label, value, 'le="' + le + '"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_labels(label, value)} {counts[-1]}")
+                lines.append(f"{name}_count{_labels(label, value)} {cumulative}")
+        for name, (label, help_text) in _COUNTER_HELP.items():
+            series = _counters.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for value, total in sorted(series.items()):
+                lines.append(f"{name}{_labels(label, _escape(value))} {total}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,204 @@
+"""Per-session turn serialisation and cancellation.
+
+Two messages for the same session must not run concurrently: both would
+load the same history and the one finishing last would overwrite the
+other's turn. ``run()`` and ``stream()`` execute a turn while holding the
+session's lock, so turns of one session queue up while different sessions
+still run in parallel. With several worker processes the lock alone is not
+enough: the turn also holds the session's lease in the shared session store
+(``SessionStore.acquire_lease``), renewed while the turn runs, so a message
+that lands on another worker waits as well.
+
+On shutdown ``close()`` stops new turns and ``drain()`` lets running ones
+finish; ``app.server`` calls both before uvicorn closes any connection.
+
+Each turn runs in its own task, registered under its session, so
+``cancel()`` can stop it from another request (or when the client goes
+away). Cancelling aborts the in-flight LLM request and the tool calls that
+have not started yet; see ``tool_executor.run_blocking``.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from app.config import settings
+from app.services.session_store import get_store
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_locks: dict[str, asyncio.Lock] = {}
+_users: dict[str, int] = {}
+_tasks: dict[str, set[asyncio.Task]] = {}
+# Turns stopped through cancel() (as opposed to their caller going away)
+_cancelled: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+_closed = False
+
+_DONE = object()
+# Seconds between attempts to take a lease held by another worker
+_LEASE_POLL = 0.1
+
+
+class TurnCancelled(Exception):
+    """The turn was cancelled by the client."""
+
+
+class TurnsClosed(Exception):
+    """The server is shutting down and takes no new turns."""
+
+    def __init__(self):
+        super().__init__("Sunucu yeniden başlatılıyor; lütfen birazdan tekrar deneyin.")
+
+
+@asynccontextmanager
+async def _lease(session_id: str):
+    """Hold the session's cross-process lease for the duration of the block."""
+    store = get_store()
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    ttl = settings.SESSION_LEASE_TTL
+    while not await asyncio.to_thread(store.acquire_lease, session_id, owner, ttl):
+        await asyncio.sleep(_LEASE_POLL)
+
+    async def renew():
+        while True:
+            await asyncio.sleep(ttl / 3)
+            if not await asyncio.to_thread(store.acquire_lease, session_id, owner, ttl):
+                logger.warning("Lost the lease of session %s to another worker", session_id)
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        renewer.cancel()
+        await asyncio.to_thread(store.release_lease, session_id, owner)
+
+
+@asynccontextmanager
+async def _session_lock(session_id: str):
+    lock = _locks.setdefault(session_id, asyncio.Lock())
+    _users[session_id] = _users.get(session_id, 0) + 1
+    try:
+        async with lock, _lease(session_id):
+            yield
+    finally:
+        _users[session_id] -= 1
+        if not _users[session_id]:
+            del _users[session_id]
+            del _locks[session_id]
+
+
+def _register(session_id: str, task: asyncio.Task):
+    _tasks.setdefault(session_id, set()).add(task)
+
+
+def _unregister(session_id: str, task: asyncio.Task):
+    tasks = _tasks.get(session_id)
+    if tasks is not None:
+        tasks.discard(task)
+        if not tasks:
+            del _tasks[session_id]
+
+
+async def run(session_id: str, func: Callable[[], Awaitable[T]]) -> T:
+    """Run ``func()`` as the session's next turn.
+
+    Raises ``TurnCancelled`` if the turn is cancelled through ``cancel()``
+    and ``TurnsClosed`` during shutdown.
+    """
+    if _closed:
+        raise TurnsClosed()
+
+    async def exclusive():
+        async with _session_lock(session_id):
+            return await func()
+
+    task = asyncio.create_task(exclusive())
+    _register(session_id, task)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if task in _cancelled:
+            raise TurnCancelled() from None
+        raise
+    finally:
+        _unregister(session_id, task)
+        task.cancel()
+
+
+async def stream(session_id: str, events: Callable[[], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+    """Like ``run()`` for a streaming turn: yields the events of ``events()``.
+
+    If the consumer stops iterating (client disconnected) the turn is
+    cancelled as well. Raises ``TurnCancelled`` after the last event when
+    the turn was cancelled through ``cancel()``.
+    """
+    if _closed:
+        raise TurnsClosed()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        async with _session_lock(session_id):
+            async for event in events():
+                queue.put_nowait(event)
+
+    task = asyncio.create_task(pump())
+    task.add_done_callback(lambda _: queue.put_nowait(_DONE))
+    _register(session_id, task)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            yield item
+        if task.cancelled():
+            if task in _cancelled:
+                raise TurnCancelled()
+            raise asyncio.CancelledError()
+        task.result()
+    finally:
+        _unregister(session_id, task)
+        task.cancel()
+
+
+def cancel(session_id: str) -> int:
+    """Cancel the running and queued turns of a session; returns how many."""
+    tasks = [t for t in _tasks.get(session_id, ()) if not t.done()]
+    for task in tasks:
+        _cancelled.add(task)
+        task.cancel()
+    return len(tasks)
+
+
+def close():
+    """Refuse new turns (shutdown has begun)."""
+    global _closed
+    _closed = True
+
+
+async def drain(timeout: float) -> int:
+    """Wait up to ``timeout`` seconds for running turns, then cancel the rest.
+
+    Called on shutdown, before connections are closed, so agent loops in
+    flight can finish, save their history and deliver the reply. Returns how
+    many turns were cancelled.
+    """
+    tasks = [t for ts in _tasks.values() for t in ts if not t.done()]
+    if not tasks:
+        return 0
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=1)
+    return len(pending)
+
+
+def get_stats() -> dict:
+    return {"sessions": len(_tasks), "turns": sum(len(t) for t in _tasks.values())}
@@ -0,0 +1,73 @@
+"""Who is making the request – signed user cookies and the current-user context.
+
+Every browser that logs in gets a random user id in a cookie signed with
+APP_SECRET_KEY. The id is put into a context variable for the duration of
+the request (``set_current_user``), so everything below the routers –
+credentials, Google clients, caches, indexes – can scope its state to the
+user without the id being passed through every call. Tool calls run on
+worker threads; ``tool_executor.run_blocking`` copies the context into them.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+from contextvars import ContextVar, Token
+from typing import Optional
+
+from app.config import settings
+
+COOKIE_NAME = "berrai_user"
+COOKIE_MAX_AGE = 365 * 24 * 3600
+
+_current: ContextVar[Optional[str]] = ContextVar("current_user", default=None)
+
+
+def new_user_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _signature(user_id: str) -> str:
+    return hmac.new(settings.APP_SECRET_KEY.encode(), user_id.encode(), hashlib.sha256).hexdigest()
+
+
+def sign(user_id: str) -> str:
+    """Cookie value for ``user_id``."""
+    return f"{user_id}.{_signature(user_id)}"
+
+
+def from_cookie(value: Optional[str]) -> Optional[str]:
+    """The user id in a cookie value, or None if it is missing or forged."""
+    if not value or "." not in value:
+        return None
+    user_id, signature = value.rsplit(".", 1)
+    if not hmac.compare_digest(signature, _signature(user_id)):
+        return None
+    return user_id
+
+
+def current_user() -> Optional[str]:
+    return _current.get()
+
+
+def set_current_user(user_id: Optional[str]) -> Token:
+    return _current.set(user_id)
+
+
+def reset_current_user(token: Token):
+    _current.reset(token)
+
+
+def scoped(key: str) -> str:
+    """``key`` prefixed with the current user, for stores shared by all users."""
+    user_id = _current.get()
+    return f"{user_id}:{key}" if user_id else key
+
+
+def scoped_path(path: str) -> str:
+    """Per-user variant of a database path (``drive_index.db`` -> ``drive_index.<user>.db``)."""
+    user_id = _current.get()
+    if not user_id:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{user_id}{ext}"
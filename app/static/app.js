@@ -100,8 +100,11 @@ async function sendMessage() {
 
   state.isLoading = true;
 
+  let bubble = null;
+  let streamed = '';
+
   try {
-    const res = await fetch('/api/chat', {
+    const res = await fetch('/api/chat/stream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({
@@ -110,9 +113,42 @@ async function sendMessage() {
       }),
     });
 
-    const data = await res.json();
-    removeTyping(typingId);
-    addMessage(data.reply, 'assistant');
+    // Server-Sent Events: "data: {json}\n\n" frames
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) !== -1) {
+        const frame = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        if (!frame.startsWith('data:')) continue;
+        const event = JSON.parse(frame.slice(5));
+
+        if (event.type === 'token') {
+          if (!bubble) {
+            removeTyping(typingId);
+            bubble = addMessage('', 'assistant');
+          }
+          streamed += event.content;
+          bubble.innerHTML = renderMarkdown(streamed);
+          scrollToBottom();
+        } else if (event.type === 'reset') {
+          streamed = '';
+          if (bubble) bubble.innerHTML = '';
+        } else if (event.type === 'done' || event.type === 'error' || event.type === 'cancelled') {
+          removeTyping(typingId);
+          if (!bubble) bubble = addMessage('', 'assistant');
+          bubble.innerHTML = renderMarkdown(event.reply);
+          scrollToBottom();
+        }
+      }
+    }
   } catch (err) {
     removeTyping(typingId);
     addMessage('❌ Bağlantı hatası oluştu. Lütfen tekrar deneyin.', 'assistant');
@@ -145,6 +181,7 @@ function addMessage(content, role) {
 
   chatMessages.appendChild(msgDiv);
   scrollToBottom();
+  return msgDiv.querySelector('.message-bubble');
 }
 
 function showTyping() {
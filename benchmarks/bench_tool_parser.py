@@ -0,0 +1,167 @@
+"""Microbenchmark for the tool-call parser.
+
+Compares ``tool_parser.parse_reply`` with the previous two-pass implementation
+(``_extract_tool_calls`` + ``_clean_response``, copied below) on synthetic
+replies full of code blocks, braces and JSON snippets.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tool_parser
+"""
+
+import json
+import re
+import timeit
+
+from app.services.tool_parser import parse_reply
+
+CODE_BLOCK = """```python
+def handler(event: dict) -> dict:
+    config = {"retries": 3, "backoff": {"base": 0.5, "max": 8}}
+    if event.get("type") == "ping":
+        return {"status": "ok", "echo": "{not json}"}
+    return {k: v for k, v in event.items() if v is not None}
+```
+"""
+
+PROSE = "Bu örnekte {anahtar: değer} sözlüğü ve `if (x) {` gibi ifadeler var. "
+
+TOOL_CALL = json.dumps({"tool": "docs_append_text", "args": {"document_id": "abc", "text": "fn() { return 1; }"}})
+
+
+def make_reply(size: int) -> str:
+    """Build a code-heavy reply of roughly ``size`` characters."""
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        chunk = CODE_BLOCK if i % 3 else PROSE * 4
+        parts.append(chunk)
+        total += len(chunk)
+        i += 1
+    return "".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# Previous implementation (baseline)
+# ---------------------------------------------------------------------------
+
+def legacy_extract_tool_calls(content: str) -> list[dict]:
+    """Extract tool_call JSON blocks from the assistant's response."""
+    calls = []
+
+    # First check explicit markdown code blocks
+    pattern_blocks = r"```(?:json|tool_call)?\s*\n?(\{.*?\})\n?```"
+    matches = re.findall(pattern_blocks, content, re.DOTALL)
+    for match in matches:
+        try:
+            parsed = json.loads(match.strip())
+            if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
+                calls.append(parsed)
+        except json.JSONDecodeError:
+            pass
+
+    if calls:
+        return calls
+
+    # If no markdown blocks, use a robust brace-counting parser to find raw JSON objects
+    start_idx = 0
+    while True:
+        try:
+            start_idx = content.index("{", start_idx)
+            brace_count = 0
+            for i, char in enumerate(content[start_idx:]):
+                if char == "{":
+                    brace_count += 1
+                elif char == "}":
+                    brace_count -= 1
+
+                if brace_count == 0:
+                    json_str = content[start_idx:start_idx + i + 1]
+                    try:
+                        parsed = json.loads(json_str)
+                        if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
+                            calls.append(parsed)
+                    except json.JSONDecodeError:
+                        pass
+                    # Jump past this object
+                    start_idx = start_idx + i + 1
+                    break
+            else:
+                # If we exit the loop without break, braces were unbalanced. Just break the while.
+                break
+        except ValueError:
+            break
+
+    return calls
+
+
+def legacy_clean_response(content: str) -> str:
+    """Remove thinking tags and tool_call blocks from the response."""
+    content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL)
+    content = re.sub(r"```(?:json|tool_call)?.*?```", "", content, flags=re.DOTALL)
+
+    # Robust raw JSON removal using the same brace counting
+    start_idx = 0
+    cleaned_content = []
+
+    while True:
+        try:
+            next_brace = content.index("{", start_idx)
+            # Append anything before the brace
+            cleaned_content.append(content[start_idx:next_brace])
+
+            brace_count = 0
+            found_object = False
+            for i, char in enumerate(content[next_brace:]):
+                if char == "{":
+                    brace_count += 1
+                elif char == "}":
+                    brace_count -= 1
+
+                if brace_count == 0:
+                    json_str = content[next_brace:next_brace + i + 1]
+                    try:
+                        parsed = json.loads(json_str)
+                        if isinstance(parsed, dict) and "tool" in parsed and "args" in parsed:
+                            # It's a tool call, skip adding it
+                            found_object = True
+                            start_idx = next_brace + i + 1
+                            break
+                    except json.JSONDecodeError:
+                        pass
+                    # Not a valid tool call, keep it
+                    break
+
+            if not found_object:
+                # Add the `{` and move on
+                cleaned_content.append("{")
+                start_idx = next_brace + 1
+
+        except ValueError:
+            # No more braces
+            cleaned_content.append(content[start_idx:])
+            break
+
+    return "".join(cleaned_content).strip()
+
+
+def legacy_parse(content: str):
+    return legacy_extract_tool_calls(content), legacy_clean_response(content)
+
+
+def main():
+    print(f"{'size':>10} {'case':<10} {'legacy ms':>12} {'single-pass ms':>15} {'speed-up':>9}")
+    for size in (1_000, 10_000, 100_000, 400_000):
+        for case, reply in (
+            ("code", make_reply(size)),
+            ("code+tool", make_reply(size) + TOOL_CALL),
+        ):
+            runs = max(1, 200_000 // size)
+            legacy = min(timeit.repeat(lambda: legacy_parse(reply), number=runs, repeat=3)) / runs
+            single = min(timeit.repeat(lambda: parse_reply(reply), number=runs, repeat=3)) / runs
+            print(f"{len(reply):>10} {case:<10} {legacy * 1000:>12.2f} {single * 1000:>15.2f} {legacy / single:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()